@@ -0,0 +1,79 @@
+"""
+Length-aware scoring (CHURN_LENGTH_AWARE=1) against scoring the zero-padded windows, on synthetic
+purchase histories of a few mean lengths. Reports the share of short windows, the time steps and
+attention scores the length buckets skip, throughput of both modes and how much the short
+windows' probabilities move. The full-length windows score identically in both modes. A randomly
+initialised model is used unless a model bundle or best_model.pth is found, so the accuracy
+columns only mean something with the production model. Run from the repository root:
+    python -m benchmarks.bench_lengths --customers 20000 --purchases 3 6 12
+"""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.suite import load_benchmark_model
+from benchmarks.synthetic import categories, genders, make_purchases, payment_methods
+from churn_service import churn_service
+from churn_service.database.repositories import encode_purchases
+from churn_service.domain import build_windows_for_rows, customer_boundaries, scale_windows, score_windows, window_lengths
+
+
+def encoded_windows(n_customers, mean_purchases, seed):
+    """Scaled windows of synthetic customers, encoded as insert_csv_data_to_table encodes them"""
+    df = make_purchases(1, n_customers, mean_purchases, np.random.default_rng(seed))
+    df = encode_purchases(df, {"Gender": genders, "Payment Method": payment_methods, "Product Category": categories}, 0.0)
+    df = df.sort_values(["Customer ID", "Purchase Date"], kind="stable")
+    customer_ids = df["Customer ID"].to_numpy()
+    _, X, y, positions, _ = build_windows_for_rows(customer_ids, df[churn_service.feature_columns].to_numpy(),
+                                                   df["Churn"].to_numpy())
+    lengths = window_lengths(np.diff(customer_boundaries(customer_ids)))
+    return scale_windows(X), y, positions, lengths
+
+
+def timed_scores(windows, positions, lengths, length_aware, repeat):
+    churn_service.length_aware = length_aware
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        probabilities = score_windows(windows, positions, lengths=lengths)
+        best = min(best, time.perf_counter() - start)
+    return best, probabilities
+
+
+def run_benchmarks(n_customers, means, seed, repeat):
+    seq_length = churn_service.seq_length
+    print(f"Padded vs length-aware scoring, {n_customers} customers")
+    print(f"   {'mean':>5} {'windows':>8} {'short':>6} {'steps':>6} {'attn':>6} {'padded/s':>10} {'aware/s':>10} "
+          f"{'speedup':>7} {'mean dp':>8} {'max dp':>7} {'flips':>6} {'acc pad':>7} {'acc aw':>7}")
+    for mean in means:
+        windows, labels, positions, lengths = encoded_windows(n_customers, mean, seed)
+        padded_time, padded = timed_scores(windows, positions, lengths, False, repeat)
+        aware_time, aware = timed_scores(windows, positions, lengths, True, repeat)
+        short = lengths < seq_length
+        # Shares of the time steps (embedding, feed-forward) and attention scores the buckets skip
+        steps_saved = 1 - lengths.sum() / (len(lengths) * seq_length)
+        attention_saved = 1 - (lengths.astype(np.int64) ** 2).sum() / (len(lengths) * seq_length ** 2)
+        change = np.abs(aware - padded)[short] if short.any() else np.zeros(1)
+        flips = ((aware > 0.5) != (padded > 0.5))[short].mean() if short.any() else 0.0
+        print(f"   {mean:5g} {len(windows):8d} {short.mean():6.1%} {steps_saved:6.1%} {attention_saved:6.1%} "
+              f"{len(windows) / padded_time:10.0f} {len(windows) / aware_time:10.0f} {padded_time / aware_time:6.2f}x "
+              f"{change.mean():8.4f} {change.max():7.4f} {flips:6.1%} "
+              f"{((padded > 0.5) == labels).mean():7.1%} {((aware > 0.5) == labels).mean():7.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--customers", type=int, default=20_000)
+    parser.add_argument("--purchases", type=float, nargs="+", default=[3, 6, 12], help="mean purchases per customer")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"Model: {load_benchmark_model(directory)}")
+        run_benchmarks(args.customers, args.purchases, args.seed, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
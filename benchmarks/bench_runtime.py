@@ -0,0 +1,78 @@
+"""
+CPU latency and throughput of each ChurnModel inference backend (see churn_service.runtime).
+
+Speed does not depend on the weights, so a randomly initialised model is used unless --checkpoint
+points at best_model.pth. Run from the repository root:
+    python -m benchmarks.bench_runtime
+    python -m benchmarks.bench_runtime --backends eager torchscript-int8 --threads 1
+"""
+import argparse
+import tempfile
+import time
+import warnings
+
+import numpy as np
+import torch
+
+from churn_service import churn_service
+from churn_service.runtime import backends, build_runtime, onnxruntime
+
+
+def make_model(checkpoint=None):
+    torch.manual_seed(0)
+    model = churn_service.ChurnModel(churn_service.input_size, churn_service.d_model, churn_service.num_heads,
+                                     churn_service.d_ff, churn_service.num_layers)
+    if checkpoint:
+        state_dict = torch.load(checkpoint, map_location="cpu")
+        state_dict = state_dict.get("model_state_dict", state_dict)
+        state_dict.pop("pos_encoder.pe", None)
+        model.load_state_dict(state_dict)
+    return model.eval()
+
+
+def time_calls(runtime, batch_size, seconds, seed=0):
+    rng = np.random.default_rng(seed)
+    windows = torch.from_numpy(rng.standard_normal(
+        (batch_size, churn_service.seq_length, churn_service.num_features)).astype(np.float32))
+    positions = torch.arange(batch_size)
+    latencies = []
+    with torch.no_grad():
+        runtime(windows, positions)  # warm-up
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline or len(latencies) < 5:
+            start = time.perf_counter()
+            runtime(windows, positions)
+            latencies.append(time.perf_counter() - start)
+    return np.array(latencies) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", choices=backends, default=list(backends))
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 32, 1024])
+    parser.add_argument("--seconds", type=float, default=2.0, help="time spent on each backend and batch size")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    parser.add_argument("--checkpoint", default=None)
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    warnings.filterwarnings("ignore")  # tracer and exporter warnings
+
+    model = make_model(args.checkpoint)
+    print(f"ChurnModel inference on CPU ({torch.get_num_threads()} threads)")
+    with tempfile.TemporaryDirectory() as directory:
+        for backend in args.backends:
+            if backend.startswith("onnx") and onnxruntime is None:
+                print(f"\n{backend}: skipped, onnxruntime is not installed")
+                continue
+            runtime = build_runtime(model, backend, version="bench", directory=directory)
+            print(f"\n{backend}")
+            for batch_size in args.batch_sizes:
+                latencies = time_calls(runtime, batch_size, args.seconds)
+                p50, p99 = np.percentile(latencies, [50, 99])
+                throughput = batch_size * len(latencies) / latencies.sum() * 1000
+                print(f"   batch {batch_size:5d}   p50 {p50:8.2f} ms   p99 {p99:8.2f} ms   {throughput:10.0f} windows/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Worker cold start: importing the API, loading the model and scaler and scoring a first window,
+each measured in a fresh interpreter. Compares loading best_model.pth plus scaler.pkl with
+loading the model bundle. Speed does not depend on the weights, so a randomly initialised
+checkpoint of the production size is used unless --checkpoint is given. Run from the repository root:
+    python -m benchmarks.bench_startup --runs 5
+"""
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+import torch
+
+from churn_service import churn_service
+from churn_service.bundle import hyperparameter_names, make_bundle, save_bundle
+
+PROBE = """
+import json, time
+start = time.perf_counter()
+import churn_service.main
+imported = time.perf_counter()
+import numpy as np
+from churn_service import churn_service, domain
+churn_service.load_model()
+loaded = time.perf_counter()
+domain.score_windows(np.zeros((1, churn_service.seq_length, churn_service.num_features), np.float32))
+scored = time.perf_counter()
+print(json.dumps({"import": imported - start, "load_model": loaded - imported, "first_prediction": scored - loaded,
+                  "total": scored - start}))
+"""
+
+
+def make_checkpoint(path):
+    """A training-style checkpoint with random weights, including the positional encoding buffer"""
+    torch.manual_seed(0)
+    state_dict = churn_service.ChurnModel(churn_service.input_size, churn_service.d_model, churn_service.num_heads,
+                                          churn_service.d_ff, churn_service.num_layers).state_dict()
+    position = torch.arange(10000, dtype=torch.float).unsqueeze(1)
+    div_term = torch.exp(torch.arange(0, churn_service.d_model, 2).float() * (-math.log(10000.0) / churn_service.d_model))
+    pe = torch.zeros(10000, churn_service.d_model)
+    pe[:, 0::2] = torch.sin(position * div_term)
+    pe[:, 1::2] = torch.cos(position * div_term)
+    state_dict["pos_encoder.pe"] = pe.unsqueeze(0)
+    torch.save({"model_state_dict": state_dict}, path)
+
+
+def time_startup(env, runs):
+    timings = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-c", PROBE], env={**os.environ, **env}, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise SystemExit(result.stderr)
+        timings.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    return {stage: float(np.median([timing[stage] for timing in timings])) for stage in timings[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--checkpoint", default=None)
+    parser.add_argument("--scaler", default=churn_service.scaler_path)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        checkpoint = args.checkpoint or os.path.join(directory, "best_model.pth")
+        if not args.checkpoint:
+            make_checkpoint(checkpoint)
+        bundle = os.path.join(directory, "model_bundle.pt")
+        save_bundle(make_bundle(checkpoint, args.scaler, {name: getattr(churn_service, name) for name in hyperparameter_names}),
+                    bundle)
+        sources = {
+            "best_model.pth + scaler.pkl": {"CHURN_MODEL_BUNDLE": os.path.join(directory, "missing.pt"),
+                                            "CHURN_CHECKPOINT_PATH": checkpoint, "CHURN_SCALER_PATH": args.scaler},
+            "model bundle": {"CHURN_MODEL_BUNDLE": bundle},
+        }
+        print(f"Cold start, median of {args.runs} fresh interpreters (seconds)")
+        print(f"   {'':28s} {'import':>8} {'load':>8} {'first':>8} {'total':>8}")
+        for name, env in sources.items():
+            timing = time_startup(env, args.runs)
+            print(f"   {name:28s} {timing['import']:8.3f} {timing['load_model']:8.3f} "
+                  f"{timing['first_prediction']:8.3f} {timing['total']:8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Benchmark the vectorized window builder against the original iloc loop.
+
+Run from the repository root:
+    python -m benchmarks.bench_windows
+"""
+import time
+import numpy as np
+import pandas as pd
+
+from churn_service import churn_service
+from churn_service.domain import build_windows, build_windows_for_customers, churn_offset
+
+
+def legacy_windows(customer_data, seq_length=10):
+    """The window loop get_customer_sequence_scaled used before build_windows"""
+    features = churn_service.feature_columns
+    sequences = []
+    labels = []
+    for i in range(max(1,len(customer_data)-seq_length+1)):
+        seq = customer_data.iloc[i:min(i+seq_length, len(customer_data))][features].values
+        if len(seq) < seq_length:
+            pad_shape = (seq_length - len(seq), len(features))
+            padding = np.zeros(pad_shape)
+            seq = np.vstack([seq, padding])
+        if i + seq_length < len(customer_data) - churn_offset:
+            label = 0
+        else:
+            label = customer_data.iloc[min(i+seq_length-1, len(customer_data)-1)]['Churn']
+        sequences.append(seq)
+        labels.append(label)
+    return np.array(sequences), np.array(labels)
+
+
+def make_purchases(n_customers, max_history, seed=0):
+    rng = np.random.default_rng(seed)
+    counts = rng.integers(1, max_history + 1, n_customers)
+    n_rows = counts.sum()
+    df = pd.DataFrame(rng.random((n_rows, len(churn_service.feature_columns))), columns=churn_service.feature_columns)
+    df.insert(0, 'Customer ID', np.repeat(np.arange(1, n_customers + 1), counts))
+    df['Churn'] = np.repeat(rng.integers(0, 2, n_customers), counts)
+    return df
+
+
+def timed(fn, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def run_benchmarks():
+    print("Window builder: legacy iloc loop vs build_windows")
+    for n_customers, max_history in [(200, 30), (1000, 30), (500, 200)]:
+        df = make_purchases(n_customers, max_history)
+        groups = [group for _, group in df.groupby('Customer ID', sort=True)]
+
+        legacy_time, legacy = timed(lambda: [legacy_windows(group) for group in groups], repeat=1)
+        single_time, single = timed(lambda: [build_windows(group[churn_service.feature_columns].to_numpy(), group['Churn'].to_numpy()) for group in groups])
+        bulk_time, bulk = timed(lambda: build_windows_for_customers(df))
+
+        # Same windows and labels from every path; the bulk builder emits float32
+        legacy_X = np.concatenate([X for X, _ in legacy])
+        legacy_y = np.concatenate([y for _, y in legacy])
+        assert np.array_equal(legacy_X, np.concatenate([X for X, _, _, _ in single]))
+        assert np.array_equal(legacy_X.astype(np.float32), bulk[1]) and np.array_equal(legacy_y, bulk[2])
+
+        print(f"\n{n_customers} customers, up to {max_history} purchases ({len(df)} rows, {len(legacy_X)} windows)")
+        print(f"   legacy loop:            {legacy_time * 1000:9.1f} ms")
+        print(f"   build_windows/customer: {single_time * 1000:9.1f} ms  ({legacy_time / single_time:6.1f}x)")
+        print(f"   build_windows bulk:     {bulk_time * 1000:9.1f} ms  ({legacy_time / bulk_time:6.1f}x)")
+
+
+if __name__ == "__main__":
+    run_benchmarks()
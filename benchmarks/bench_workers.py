@@ -0,0 +1,175 @@
+"""
+Memory of N API workers started two ways:
+    uvicorn --workers spawns a fresh interpreter per worker, and each one loads the model;
+    churn_service.serve loads the model once and forks the workers.
+Then a hot reload under load with the forked workers. Reports the summed RSS, PSS and USS of the
+workers and of the whole server (parent included). PSS splits shared pages between the
+processes that map them; USS counts the pages only that process holds. Also reports how long it
+takes until every worker serves the new model, and how many requests failed meanwhile.
+
+Uses random-weight model bundles and a temporary SQLite database of synthetic customers.
+Needs httpx and psutil. Run from the repository root:
+    python -m benchmarks.bench_workers --workers 4
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from benchmarks.synthetic import write_csv
+
+
+def make_bundles(directory):
+    """Two model bundles of different random weights; returns their paths"""
+    import torch
+    from benchmarks.bench_startup import make_checkpoint
+    from churn_service import churn_service
+    from churn_service.bundle import hyperparameter_names, make_bundle, save_bundle
+    hyperparameters = {name: getattr(churn_service, name) for name in hyperparameter_names}
+    checkpoint = os.path.join(directory, "best_model.pth")
+    make_checkpoint(checkpoint)
+    paths = []
+    for seed in (1, 2):
+        state_dict = torch.load(checkpoint)["model_state_dict"]
+        generator = torch.Generator().manual_seed(seed)
+        state_dict["fc.weight"] += 0.1 * torch.randn(state_dict["fc.weight"].shape, generator=generator)
+        torch.save({"model_state_dict": state_dict}, checkpoint)
+        path = os.path.join(directory, f"bundle_{seed}.pt")
+        save_bundle(make_bundle(checkpoint, churn_service.scaler_path, hyperparameters), path)
+        paths.append(path)
+    return paths
+
+
+async def ask_workers(url, n):
+    """/model from n fresh connections at once, so the requests spread over the workers"""
+    async def ask():
+        async with httpx.AsyncClient(base_url=url, timeout=30) as http:
+            return (await http.get("/model")).json()
+    return await asyncio.gather(*[ask() for _ in range(n)])
+
+
+async def wait_for_workers(url, workers, timeout=120):
+    """The pids of the workers once all of them answer"""
+    deadline = time.monotonic() + timeout
+    pids = set()
+    while len(pids) < workers:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"only {len(pids)} of {workers} workers answered")
+        try:
+            pids |= {answer["pid"] for answer in await ask_workers(url, 4 * workers)}
+        except httpx.HTTPError:
+            await asyncio.sleep(0.5)
+    return pids
+
+
+async def load(url, customers, requests):
+    errors = 0
+    async with httpx.AsyncClient(base_url=url, timeout=60) as http:
+        for i in range(requests):
+            try:
+                response = await http.get(f"/customers_predicts/{i % customers + 1}")
+                errors += response.status_code != 200
+            except httpx.HTTPError:
+                errors += 1
+    return errors
+
+
+def memory(pids):
+    totals = {"rss": 0, "pss": 0, "uss": 0}
+    for pid in pids:
+        info = psutil.Process(pid).memory_full_info()
+        for name in totals:
+            totals[name] += getattr(info, name)
+    return {name: value / 2 ** 20 for name, value in totals.items()}
+
+
+async def measure(command, env, url, workers, customers):
+    server = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        pids = await wait_for_workers(url, workers)
+        await asyncio.gather(*[load(url, customers, 50) for _ in range(2 * workers)])
+        return server, pids, memory(pids), memory(pids | {server.pid})
+    except BaseException:
+        server.terminate()
+        server.wait()
+        raise
+
+
+async def reload_under_load(url, pids, bundle_path, new_bundle, customers):
+    """Swap the bundle, POST /model/reload during a load, and time until every worker has the new version"""
+    from churn_service.bundle import load_bundle, save_bundle
+    version = load_bundle(new_bundle)["model_version"]
+    save_bundle(load_bundle(new_bundle), bundle_path)
+    traffic = asyncio.gather(*[load(url, customers, 200) for _ in range(4)])
+    start = time.perf_counter()
+    async with httpx.AsyncClient(base_url=url, timeout=60) as http:
+        result = (await http.post("/model/reload")).json()
+    reloaded = set()
+    while reloaded != pids:
+        reloaded |= {answer["pid"] for answer in await ask_workers(url, 4 * len(pids)) if answer["model_version"] == version}
+    elapsed = time.perf_counter() - start
+    return result, elapsed, sum(await traffic)
+
+
+async def run(args, directory):
+    csv_path = os.path.join(directory, "synthetic.csv")
+    write_csv(csv_path, args.customers)
+    env = {**os.environ, "CHURN_DATABASE_URL": f"sqlite:///{os.path.join(directory, 'bench.db')}",
+           "CHURN_MODEL_BUNDLE": os.path.join(directory, "model_bundle.pt")}
+    os.environ.update(env)
+    from churn_service.database import engine
+    from churn_service.database.repositories import insert_csv_data_to_table
+    insert_csv_data_to_table(csv_path, "ecommerce", engine)
+    bundles = make_bundles(directory)
+    from churn_service.bundle import load_bundle, save_bundle
+    save_bundle(load_bundle(bundles[0]), env["CHURN_MODEL_BUNDLE"])
+
+    url = f"http://127.0.0.1:{args.port}"
+    commands = {
+        "uvicorn --workers": [sys.executable, "-m", "uvicorn", "churn_service.main:app", "--port", str(args.port),
+                              "--workers", str(args.workers)],
+        "churn_service.serve": [sys.executable, "-m", "churn_service.serve", "--port", str(args.port),
+                                "--workers", str(args.workers)],
+    }
+    print(f"{args.workers} workers, memory in MiB")
+    print(f"   {'':22s} {'workers rss':>12} {'pss':>8} {'uss':>8} {'server pss':>11} {'uss':>8}")
+    for name, command in commands.items():
+        server, pids, workers, total = await measure(command, env, url, args.workers, args.customers)
+        print(f"   {name:22s} {workers['rss']:12.1f} {workers['pss']:8.1f} {workers['uss']:8.1f} "
+              f"{total['pss']:11.1f} {total['uss']:8.1f}")
+        if name == "churn_service.serve":
+            result, elapsed, errors = await reload_under_load(url, pids, env["CHURN_MODEL_BUNDLE"], bundles[1],
+                                                              args.customers)
+            print(f"\nHot reload {result['previous_version']} -> {result['model_version']}: every worker swapped in "
+                  f"{elapsed:.2f} s, {errors} of 800 requests during it failed")
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--customers", type=int, default=2000)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    if httpx is None or psutil is None:
+        raise SystemExit("the worker benchmark needs httpx and psutil: pip install httpx psutil")
+    with tempfile.TemporaryDirectory() as directory:
+        asyncio.run(run(args, directory))
+
+
+if __name__ == "__main__":
+    main()
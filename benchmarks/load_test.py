@@ -0,0 +1,76 @@
+"""
+Latency under concurrent load for the per-customer endpoints of a running server.
+
+Start the API (uvicorn churn_service.main:app) and run from the repository root:
+    python -m benchmarks.load_test --clients 100 --requests 2000 --customers 1000
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import numpy as np
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+ENDPOINTS = {
+    "predict": "/customers_predicts/{customer_id}",
+    "customer": "/customers/{table_name}/{customer_id}",
+    "summary": "/customers/{table_name}/{customer_id}/data",
+}
+
+
+async def run_clients(base_url, path, clients, total_requests, customer_ids, table_name):
+    latencies = []
+    errors = 0
+    remaining = iter(range(total_requests))
+
+    async def client(http):
+        nonlocal errors
+        for _ in remaining:
+            url = path.format(customer_id=random.choice(customer_ids), table_name=table_name)
+            start = time.perf_counter()
+            try:
+                response = await http.get(url)
+                if response.status_code != 200:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as http:
+        start = time.perf_counter()
+        await asyncio.gather(*[client(http) for _ in range(clients)])
+        elapsed = time.perf_counter() - start
+    return np.array(latencies) * 1000, errors, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--table", default="ecommerce")
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=2000, help="requests per endpoint")
+    parser.add_argument("--customers", type=int, default=1000, help="customer ids are drawn from 1..customers")
+    parser.add_argument("--endpoints", nargs="+", choices=sorted(ENDPOINTS), default=sorted(ENDPOINTS))
+    args = parser.parse_args()
+    if httpx is None:
+        raise SystemExit("the load test needs httpx: pip install httpx")
+
+    customer_ids = list(range(1, args.customers + 1))
+    print(f"{args.clients} concurrent clients, {args.requests} requests per endpoint against {args.url}")
+    for name in args.endpoints:
+        latencies, errors, elapsed = asyncio.run(
+            run_clients(args.url, ENDPOINTS[name], args.clients, args.requests, customer_ids, args.table))
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        print(f"\n{name} ({ENDPOINTS[name]})")
+        print(f"   throughput: {len(latencies) / elapsed:8.1f} req/s   errors: {errors}")
+        print(f"   p50 {p50:8.1f} ms   p95 {p95:8.1f} ms   p99 {p99:8.1f} ms   max {latencies.max():8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
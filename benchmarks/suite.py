@@ -0,0 +1,223 @@
+"""
+End-to-end benchmark suite on synthetic data, without the production database.
+
+Generates purchases with benchmarks.synthetic, then measures
+    ingest          /create_table's insert_csv_data_to_table, purchase rows per second
+    window_builder  build_windows_for_customers over every customer, windows per second
+    predict         predict_churn for single customers, p50/p99 with the feature cache empty (cold)
+                    and the p50 of a repeat lookup served from the cache (warm)
+    refresh_scores  a full refresh of the precomputed scores, customers per second
+    churns          GET /Churns/ for the whole table through the API
+and writes the results as JSON. Given a --baseline results file, every result that got worse by
+more than --threshold is flagged and the exit status is 1.
+
+Runs against a temporary SQLite file by default, an embedded PostgreSQL server (pip install
+pgserver) with --embedded-postgres, or any SQLAlchemy URL. A randomly initialised model of the
+production size is used unless a model bundle or best_model.pth is found, as speed does not
+depend on the weights. Run from the repository root:
+    python -m benchmarks.suite --customers 20000 --out bench.json
+    python -m benchmarks.suite --customers 20000 --embedded-postgres --baseline bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from benchmarks.synthetic import write_csv
+
+try:
+    import pgserver
+except ImportError:
+    pgserver = None
+
+TABLE = "bench_ecommerce"
+
+
+def result(value, unit, higher_is_better):
+    return {"value": float(value), "unit": unit, "higher_is_better": higher_is_better}
+
+
+def load_benchmark_model(directory):
+    """Load the production model if there is one, otherwise a bundle with random weights"""
+    from churn_service import churn_service
+    if os.path.exists(churn_service.model_bundle_path) or os.path.exists(churn_service.checkpoint_path):
+        churn_service.load_model()
+        return "production"
+    from benchmarks.bench_startup import make_checkpoint
+    from churn_service.bundle import hyperparameter_names, make_bundle, save_bundle
+    checkpoint = os.path.join(directory, "best_model.pth")
+    make_checkpoint(checkpoint)
+    bundle = os.path.join(directory, "model_bundle.pt")
+    save_bundle(make_bundle(checkpoint, churn_service.scaler_path,
+                            {name: getattr(churn_service, name) for name in hyperparameter_names}), bundle)
+    churn_service.load_model(bundle_path=bundle)
+    return "random"
+
+
+def latency_percentiles(latencies):
+    p50, p99 = np.percentile(np.array(latencies) * 1000, [50, 99])
+    return p50, p99
+
+
+def run_suite(args, directory):
+    """Run every benchmark; the database URL must be in CHURN_DATABASE_URL before this imports the service"""
+    from fastapi.testclient import TestClient
+    from sqlalchemy import text
+
+    from churn_service.cache import feature_cache
+    from churn_service.database import engine
+    from churn_service.database.repositories import get_customers_in_range, insert_csv_data_to_table
+    from churn_service.domain import build_windows_for_customers, predict_churn
+    from churn_service.main import app
+    from churn_service.scores import refresh_scores
+
+    model = load_benchmark_model(directory)
+    results = {}
+
+    csv_path = os.path.join(directory, "synthetic.csv")
+    rows = write_csv(csv_path, args.customers, args.purchases, args.seed)
+    start = time.perf_counter()
+    insert_csv_data_to_table(csv_path, TABLE, engine)
+    results["ingest"] = result(rows / (time.perf_counter() - start), "rows/s", True)
+
+    df = get_customers_in_range(1, args.customers, TABLE)
+    timings = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        _, X, _, _, _ = build_windows_for_customers(df)
+        timings.append(time.perf_counter() - start)
+    results["window_builder"] = result(len(X) / min(timings), "windows/s", True)
+
+    customer_ids = np.random.default_rng(args.seed).integers(1, args.customers + 1, args.lookups)
+    cold, warm = [], []
+    for customer_id in customer_ids:
+        feature_cache.invalidate(TABLE)
+        start = time.perf_counter()
+        predict_churn(int(customer_id), TABLE)
+        cold.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        predict_churn(int(customer_id), TABLE)
+        warm.append(time.perf_counter() - start)
+    p50, p99 = latency_percentiles(cold)
+    results["predict_cold_p50"] = result(p50, "ms", False)
+    results["predict_cold_p99"] = result(p99, "ms", False)
+    # Cache hits take microseconds, too little for a p99 that is not noise
+    results["predict_warm_p50"] = result(latency_percentiles(warm)[0], "ms", False)
+
+    start = time.perf_counter()
+    refresh_scores(TABLE)
+    results["refresh_scores"] = result(args.customers / (time.perf_counter() - start), "customers/s", True)
+
+    # Without the context manager the app's startup (model loading, pool warming) is skipped;
+    # the model is already loaded and /Churns/ does not use the micro-batcher
+    client = TestClient(app)
+    timings = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        response = client.get("/Churns/", params={"table_name": TABLE})
+        timings.append(time.perf_counter() - start)
+        response.raise_for_status()
+    results["churns"] = result(min(timings) * 1000, "ms", False)
+
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP TABLE IF EXISTS {TABLE}_churn_scores"))
+        connection.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+    return results, {"dialect": engine.dialect.name, "model": model, "purchases": rows}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Print each result against the baseline's; returns the names of the ones that regressed by more than threshold"""
+    regressions = []
+    print(f"\n   {'':22s} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, current in results.items():
+        previous = baseline["results"].get(name)
+        if previous is None or previous["value"] == 0:
+            print(f"   {name:22s} {'-':>12} {current['value']:12.2f}")
+            continue
+        change = current["value"] / previous["value"] - 1
+        worse = -change if current["higher_is_better"] else change
+        flag = ""
+        if worse > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"   {name:22s} {previous['value']:12.2f} {current['value']:12.2f} {change:+8.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--customers", type=int, default=10_000)
+    parser.add_argument("--purchases", type=float, default=12, help="mean purchases per customer")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--lookups", type=int, default=200, help="single-customer predictions")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of the window builder and /Churns/, the fastest is kept")
+    parser.add_argument("--url", default=None, help="SQLAlchemy URL, defaults to a temporary SQLite file")
+    parser.add_argument("--embedded-postgres", action="store_true", help="start a throwaway PostgreSQL server with pgserver")
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--baseline", default=None, help="results JSON of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative slowdown flagged as a regression")
+    args = parser.parse_args()
+    if args.embedded_postgres and pgserver is None:
+        raise SystemExit("--embedded-postgres needs the pgserver package: pip install pgserver")
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.embedded_postgres:
+            server = pgserver.get_server(os.path.join(directory, "pgdata"), cleanup_mode="stop")
+            url = server.get_uri()
+        else:
+            url = args.url or f"sqlite:///{os.path.join(directory, 'bench.db')}"
+        os.environ["CHURN_DATABASE_URL"] = url
+        results, meta = run_suite(args, directory)
+
+    import torch
+    report = {
+        "meta": {
+            **meta,
+            "customers": args.customers,
+            "mean_purchases": args.purchases,
+            "seed": args.seed,
+            "lookups": args.lookups,
+            "commit": git_commit(),
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "torch_threads": torch.get_num_threads(),
+        },
+        "results": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"Benchmark suite ({meta['dialect']}, {args.customers} customers, {meta['purchases']} purchases, {meta['model']} model)")
+    for name, value in results.items():
+        print(f"   {name:22s} {value['value']:12.2f} {value['unit']}")
+    print(f"Results written to {args.out}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for key in ("customers", "mean_purchases", "dialect", "model"):
+            if baseline["meta"].get(key) != report["meta"][key]:
+                print(f"Warning: baseline has {key}={baseline['meta'].get(key)}, this run {report['meta'][key]}")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} results regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
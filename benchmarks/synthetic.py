@@ -0,0 +1,76 @@
+"""
+Synthetic ecommerce purchases in the CSV schema insert_csv_data_to_table expects.
+
+Each customer gets a purchase count drawn around --purchases (some below seq_length, so short
+padded histories are covered), purchase dates over three years, a fixed age, gender, name and
+Churn label, and about a third of the Returns values missing. Run from the repository root:
+    python -m benchmarks.synthetic --customers 50000 --purchases 12 --out synthetic.csv
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+categories = ["Books", "Clothing", "Electronics", "Home"]
+payment_methods = ["Cash", "Credit Card", "PayPal"]
+genders = ["Female", "Male"]
+columns = ["Customer ID", "Purchase Date", "Product Category", "Product Price", "Quantity", "Total Purchase Amount",
+           "Payment Method", "Customer Age", "Returns", "Customer Name", "Age", "Gender", "Churn"]
+
+
+def purchase_counts(n_customers, mean_purchases, rng):
+    """Purchases per customer: at least one, geometric-like around mean_purchases"""
+    return 1 + rng.poisson(max(mean_purchases - 1, 0) * rng.gamma(2.0, 0.5, n_customers))
+
+
+def make_purchases(first_customer, n_customers, mean_purchases, rng):
+    """Purchases of customers first_customer .. first_customer + n_customers - 1, in the CSV's column order"""
+    counts = purchase_counts(n_customers, mean_purchases, rng)
+    customer_ids = np.repeat(np.arange(first_customer, first_customer + n_customers), counts)
+    n_rows = len(customer_ids)
+    ages = np.repeat(rng.integers(18, 71, n_customers), counts)
+    price = rng.integers(10, 501, n_rows)
+    quantity = rng.integers(1, 6, n_rows)
+    returns = rng.choice([0.0, 1.0, np.nan], n_rows)
+    seconds = rng.integers(0, 3 * 365 * 24 * 3600, n_rows)
+    return pd.DataFrame({
+        "Customer ID": customer_ids,
+        "Purchase Date": (pd.Timestamp("2020-01-01") + pd.to_timedelta(seconds, unit="s")).strftime("%Y-%m-%d %H:%M:%S"),
+        "Product Category": rng.choice(categories, n_rows),
+        "Product Price": price,
+        "Quantity": quantity,
+        "Total Purchase Amount": price * quantity,
+        "Payment Method": rng.choice(payment_methods, n_rows),
+        "Customer Age": ages,
+        "Returns": returns,
+        "Customer Name": np.char.add("Customer ", customer_ids.astype(str)),
+        "Age": ages,
+        "Gender": np.repeat(rng.choice(genders, n_customers), counts),
+        "Churn": np.repeat(rng.integers(0, 2, n_customers), counts),
+    }, columns=columns)
+
+
+def write_csv(path, n_customers, mean_purchases=12, seed=0, customers_per_chunk=50_000):
+    """Write the purchases of n_customers customers to path a chunk at a time; returns the row count"""
+    rng = np.random.default_rng(seed)
+    rows = 0
+    for first in range(0, n_customers, customers_per_chunk):
+        chunk = make_purchases(first + 1, min(customers_per_chunk, n_customers - first), mean_purchases, rng)
+        chunk.to_csv(path, mode="w" if first == 0 else "a", header=first == 0, index=False)
+        rows += len(chunk)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--customers", type=int, default=10_000)
+    parser.add_argument("--purchases", type=float, default=12, help="mean purchases per customer")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="synthetic.csv")
+    args = parser.parse_args()
+    rows = write_csv(args.out, args.customers, args.purchases, args.seed)
+    print(f"{rows} purchases of {args.customers} customers written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import numpy as np
+
+from .metrics import batch_requests, batch_windows
+
+# Flush a batch once it holds this many windows or its first request has waited this long
+max_batch_size = int(os.getenv("CHURN_MAX_BATCH_SIZE", "256"))
+max_wait_ms = float(os.getenv("CHURN_MAX_WAIT_MS", "5"))
+
+
+class MicroBatcher:
+    """
+    Collects the windows of concurrent prediction requests into one forward pass.
+    A batch is flushed when it reaches max_batch_size windows or max_wait_ms after its first
+    request arrived. score_fn(windows, positions) runs on a single worker thread so the event
+    loop keeps accepting requests, and each request gets back the probabilities of its own windows.
+    When requests give their windows' lengths, score_fn is also passed lengths= for the batch.
+    Requests that name the model to score them with are batched only with requests for the same
+    model, and score_fn is passed model= for the batch, so a hot reload never mixes two models in one.
+    """
+
+    def __init__(self, score_fn, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms, executor=None):
+        self.score_fn = score_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix="churn-batcher")
+        self._queue = None
+        self._task = None
+        self._queued_windows = 0
+        # A request for another model than the batch being collected, held for the next batch
+        self._next = None
+        self.batches = 0
+        self.requests = 0
+        self.windows = 0
+        self.last_batch_size = 0
+        self.largest_batch_size = 0
+        self.forward_seconds = 0.0
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def submit(self, windows, positions, lengths=None, model=None):
+        """
+        Queue one request's windows (with their real lengths, None for full windows) and wait for
+        their probabilities under model (None for score_fn's own)
+        """
+        if self._task is None:
+            raise RuntimeError("MicroBatcher is not running, call start() first")
+        future = asyncio.get_running_loop().create_future()
+        self._queued_windows += len(windows)
+        self._queue.put_nowait((windows, positions, lengths, future, model))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if self._next is not None:
+                pending, self._next = [self._next], None
+            else:
+                pending = [await self._queue.get()]
+            model = pending[0][4]
+            size = len(pending[0][0])
+            deadline = loop.time() + self.max_wait
+            while size < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    request = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if request[4] is not model:
+                    self._next = request
+                    break
+                pending.append(request)
+                size += len(request[0])
+            self._queued_windows -= size
+            await self._flush(pending, size)
+
+    def _batch_score(self, pending):
+        """score_fn over the queued requests' windows stacked into one batch"""
+        windows = np.concatenate([request[0] for request in pending])
+        positions = np.concatenate([request[1] for request in pending])
+        score = partial(self.score_fn, windows, positions)
+        if pending[0][4] is not None:
+            score = partial(score, model=pending[0][4])
+        if any(request[2] is not None for request in pending):
+            full_length = windows.shape[1]
+            score = partial(score, lengths=np.concatenate([
+                request[2] if request[2] is not None else np.full(len(request[0]), full_length) for request in pending]))
+        return score
+
+    async def _flush(self, pending, size):
+        start = time.perf_counter()
+        try:
+            # Stacking fails on windows of mismatched shapes; that fails this batch's requests, not the loop
+            probabilities = await asyncio.get_running_loop().run_in_executor(self._executor, self._batch_score(pending))
+        except Exception as e:
+            for request in pending:
+                if not request[3].done():
+                    request[3].set_exception(e)
+            return
+        finally:
+            self.forward_seconds += time.perf_counter() - start
+            self.batches += 1
+            self.requests += len(pending)
+            self.windows += size
+            self.last_batch_size = size
+            self.largest_batch_size = max(self.largest_batch_size, size)
+            batch_windows.observe(size)
+            batch_requests.observe(len(pending))
+
+        offset = 0
+        for windows, _, _, future, _ in pending:
+            stop = offset + len(windows)
+            # The client may have disconnected and cancelled its future while we were scoring
+            if not future.done():
+                future.set_result(probabilities[offset:stop])
+            offset = stop
+
+    def stats(self):
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "queued_windows": self._queued_windows,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "batches": self.batches,
+            "requests": self.requests,
+            "windows": self.windows,
+            "mean_batch_size": self.windows / self.batches if self.batches else 0.0,
+            "mean_requests_per_batch": self.requests / self.batches if self.batches else 0.0,
+            "last_batch_size": self.last_batch_size,
+            "largest_batch_size": self.largest_batch_size,
+            "forward_seconds": self.forward_seconds,
+        }
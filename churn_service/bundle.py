@@ -0,0 +1,113 @@
+"""
+Single-file model bundle: ChurnModel weights, the scaler's mean and scale as plain arrays and the
+hyperparameters, saved in torch's zip format so load_bundle can memory-map the tensors instead of
+reading and unpickling them. Build it from best_model.pth and scaler.pkl, from the repository root:
+    python -m churn_service.bundle
+    python -m churn_service.bundle --checkpoint path/to/best_model.pth --scaler path/to/scaler.pkl --out bundle.pt
+"""
+import argparse
+import hashlib
+import os
+
+import numpy as np
+import torch
+
+bundle_format = 1
+hyperparameter_names = ("input_size", "d_model", "num_heads", "d_ff", "num_layers", "seq_length", "num_features")
+
+
+class Standardizer:
+    """The transform of the training StandardScaler, computed the same way from its mean and scale"""
+
+    def __init__(self, mean, scale):
+        self.mean_ = np.asarray(mean, dtype=np.float64)
+        self.scale_ = np.asarray(scale, dtype=np.float64)
+        # float32 copies for transform_windows
+        self.window_mean = self.mean_.astype(np.float32)
+        self.window_inverse_scale = (1.0 / self.scale_).astype(np.float32)
+
+    def transform(self, X):
+        X = np.array(X, dtype=np.float64)
+        X -= self.mean_
+        X /= self.scale_
+        return X
+
+    def transform_windows(self, windows):
+        """
+        Scale (n, seq_length, num_features) windows in float32, in place when they already are a
+        contiguous float32 array and into a float32 copy otherwise. Returns the scaled windows.
+        """
+        windows = np.ascontiguousarray(windows, dtype=np.float32)
+        flat = windows.reshape(len(windows), -1)
+        flat -= self.window_mean
+        flat *= self.window_inverse_scale
+        return windows
+
+
+def checkpoint_state_dict(checkpoint_path):
+    """The model weights of a training checkpoint, without the positional encoding buffer"""
+    checkpoint = torch.load(checkpoint_path, map_location="cpu")
+    state_dict = checkpoint.get("model_state_dict", checkpoint)
+    state_dict.pop("pos_encoder.pe", None)
+    return state_dict
+
+
+def checkpoint_version(checkpoint_path):
+    """Identifies the weights behind precomputed scores: a hash of the checkpoint file"""
+    with open(checkpoint_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:12]
+
+
+def make_bundle(checkpoint_path, scaler_path, hyperparameters):
+    """The bundle dict of a training checkpoint and a pickled StandardScaler (None for no scaler)"""
+    bundle = {
+        "format": bundle_format,
+        "model_version": checkpoint_version(checkpoint_path),
+        "hyperparameters": dict(hyperparameters),
+        "state_dict": checkpoint_state_dict(checkpoint_path),
+        "scaler_mean": None,
+        "scaler_scale": None,
+    }
+    if scaler_path is not None:
+        import joblib
+        scaler = joblib.load(scaler_path)
+        bundle["scaler_mean"] = torch.from_numpy(np.asarray(scaler.mean_, dtype=np.float64))
+        bundle["scaler_scale"] = torch.from_numpy(np.asarray(scaler.scale_, dtype=np.float64))
+    return bundle
+
+
+def save_bundle(bundle, path):
+    partial = f"{path}.{os.getpid()}.partial"
+    torch.save(bundle, partial)
+    os.replace(partial, path)
+
+
+def load_bundle(path):
+    """Load a bundle with its tensors memory-mapped from the file"""
+    bundle = torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+    if bundle.get("format") != bundle_format:
+        raise ValueError(f"{path} is a format {bundle.get('format')} model bundle, expected {bundle_format}")
+    return bundle
+
+
+def bundle_scaler(bundle):
+    if bundle["scaler_mean"] is None:
+        return None
+    return Standardizer(bundle["scaler_mean"].numpy(), bundle["scaler_scale"].numpy())
+
+
+def main():
+    from . import churn_service
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checkpoint", default=churn_service.checkpoint_path)
+    parser.add_argument("--scaler", default=churn_service.scaler_path)
+    parser.add_argument("--out", default=churn_service.model_bundle_path)
+    args = parser.parse_args()
+    hyperparameters = {name: getattr(churn_service, name) for name in hyperparameter_names}
+    bundle = make_bundle(args.checkpoint, args.scaler, hyperparameters)
+    save_bundle(bundle, args.out)
+    print(f"Model bundle {bundle['model_version']} written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
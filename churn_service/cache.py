@@ -0,0 +1,161 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Upper bound on the cached windows, labels and predictions, and how long an entry stays valid
+cache_max_bytes = int(float(os.getenv("CHURN_CACHE_MAX_MB", "256")) * 1024 * 1024)
+cache_ttl_seconds = float(os.getenv("CHURN_CACHE_TTL_SECONDS", "3600"))
+# Also keep each customer's last probabilities, so a repeat prediction skips the forward pass
+cache_predictions = os.getenv("CHURN_CACHE_PREDICTIONS", "1") == "1"
+# How often a table's version is read from the database: the longest another worker's reload,
+# purchase or purge can go unseen
+cache_sync_seconds = float(os.getenv("CHURN_CACHE_SYNC_SECONDS", "1"))
+
+
+class _Entry:
+    __slots__ = ("key", "windows", "labels", "lengths", "probabilities", "model", "scaler", "nbytes",
+                 "expires_at")
+
+    def __init__(self, key, windows, labels, expires_at, lengths=None, scaler=None):
+        self.key = key
+        self.windows = windows
+        self.labels = labels
+        self.lengths = lengths
+        self.probabilities = None
+        self.model = None
+        # The scaler the windows were scaled with
+        self.scaler = scaler
+        self.nbytes = windows.nbytes + labels.nbytes + (lengths.nbytes if lengths is not None else 0)
+        self.expires_at = expires_at
+
+
+class FeatureCache:
+    """
+    LRU cache of each customer's scaled windows keyed by (table_name, customer_id).
+    Bounded by the bytes of the arrays it holds and by a TTL; entries are dropped when their
+    table is reloaded. Each worker has its own cache, so sync() drops a table's entries when the
+    table's version in the database shows another worker changed it. Cached arrays are shared
+    between callers, which must not modify them.
+    """
+
+    def __init__(self, max_bytes=cache_max_bytes, ttl_seconds=cache_ttl_seconds, sync_seconds=cache_sync_seconds):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.sync_seconds = sync_seconds
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._generations = {}
+        # table_name: (when its version was read, the version)
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def generation(self, table_name):
+        """Take before reading a table; put() skips data read before the table was invalidated"""
+        with self._lock:
+            return self._generations.get(table_name, 0), self._generations.get(None, 0)
+
+    def sync(self, table_name, read_version):
+        """
+        Drop table_name's entries if read_version(), the table's version in the database, moved
+        since it was last read. Reads it at most every sync_seconds.
+        """
+        now = time.monotonic()
+        with self._lock:
+            synced = self._versions.get(table_name)
+            if synced is not None and now - synced[0] < self.sync_seconds:
+                return
+        version = read_version()
+        with self._lock:
+            synced = self._versions.get(table_name)
+            self._versions[table_name] = (now, version)
+        if synced is not None and synced[1] != version:
+            self.invalidate(table_name)
+
+    def get(self, table_name, customer_id):
+        """Return the cached entry or None, counting the lookup as a hit or a miss"""
+        key = (table_name, customer_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, table_name, customer_id, windows, labels, generation, lengths=None, scaler=None):
+        key = (table_name, customer_id)
+        entry = _Entry(key, windows, labels, time.monotonic() + self.ttl_seconds, lengths, scaler)
+        with self._lock:
+            if generation != (self._generations.get(table_name, 0), self._generations.get(None, 0)):
+                return entry
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self.nbytes += entry.nbytes
+            self._evict()
+        return entry
+
+    def set_prediction(self, entry, probabilities, model):
+        """Remember the probabilities model gave for a cached entry's windows"""
+        if not cache_predictions:
+            return
+        with self._lock:
+            added = probabilities.nbytes - (entry.probabilities.nbytes if entry.probabilities is not None else 0)
+            entry.probabilities = probabilities
+            entry.model = model
+            entry.nbytes += added
+            # The entry may have been evicted or invalidated since it was looked up
+            if self._entries.get(entry.key) is entry:
+                self.nbytes += added
+                self._evict()
+
+    def invalidate(self, table_name=None):
+        """Drop every entry of table_name, or the whole cache; returns how many were dropped"""
+        with self._lock:
+            self._generations[table_name] = self._generations.get(table_name, 0) + 1
+            keys = [key for key in self._entries if table_name is None or key[0] == table_name]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def discard(self, table_name, customer_id):
+        """Drop one customer's entry, after their rows changed"""
+        with self._lock:
+            # Also skips the put() of a lookup that read the customer before the change
+            self._generations[table_name] = self._generations.get(table_name, 0) + 1
+            if (table_name, customer_id) in self._entries:
+                self._remove((table_name, customer_id))
+
+    def _remove(self, key):
+        self.nbytes -= self._entries.pop(key).nbytes
+
+    def _evict(self):
+        # An entry larger than the whole budget is dropped straight away
+        while self.nbytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+feature_cache = FeatureCache()
@@ -1,32 +1,35 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from fastapi import FastAPI, HTTPException
-from typing import List, Optional
+from typing import List, NamedTuple, Optional
+from datetime import datetime
 from pydantic import BaseModel
-from sklearn.preprocessing import StandardScaler
-import joblib
 import math
-import pandas as pd
-import numpy as np
+import os
 
 class PositionalEncoding(nn.Module):
     def __init__(self, d_model, max_len=10000):
         super(PositionalEncoding, self).__init__()
-        
-        pe = torch.zeros(max_len, d_model)
-        position = torch.arange(0, max_len, dtype=torch.float).unsqueeze(1)
+
+        # Training registered a (1, max_len, d_model) 'pe' buffer; the same sin/cos rows are
+        # computed for just the positions a batch uses, which gives identical values. load_model
+        # drops 'pos_encoder.pe' from the checkpoint.
         div_term = torch.exp(torch.arange(0, d_model, 2).float() * (-math.log(10000.0) / d_model))
-        
-        pe[:, 0::2] = torch.sin(position * div_term)
-        pe[:, 1::2] = torch.cos(position * div_term)
-        pe = pe.unsqueeze(0)
-        self.register_buffer('pe', pe)
-        
-    def forward(self, x):
-        # x shape: (batch_size, seq_len, d_model)
-        x = x + self.pe[:, :x.size(1), :]
-        return x
+        self.register_buffer('div_term', div_term, persistent=False)
+
+    def encoding(self, positions):
+        """The (len(positions), d_model) encoding rows, interleaved as sin, cos, sin, ..."""
+        angles = positions.float().unsqueeze(1) * self.div_term
+        return torch.stack([torch.sin(angles), torch.cos(angles)], dim=2).flatten(1)
+
+    def forward(self, x, positions=None):
+        # ChurnModel calls this after moving to (seq_len, batch_size, d_model), so the encoding
+        # is indexed by each window's position in the batch. The model was trained that way;
+        # positions lets a caller scoring several customers in one batch give every window the
+        # index it has among its own customer's windows.
+        if positions is None:
+            positions = torch.arange(x.size(1), device=x.device)
+        return x + self.encoding(positions).unsqueeze(0)
 
 class TransformerLayer(nn.Module):
     def __init__(self, d_model, num_heads, d_ff, dropout=0.1):
@@ -40,12 +43,13 @@ class TransformerLayer(nn.Module):
         self.linear1 = nn.Linear(d_model, d_ff)
         self.linear2 = nn.Linear(d_ff, d_model)
         
-    def forward(self, src):
+    def forward(self, src, key_padding_mask=None):
         # src shape: (seq_len, batch_size, d_model)
+        # key_padding_mask: optional (batch_size, seq_len), True at padding steps no step attends to
         
         # Self-attention with residual connection
         src2 = self.norm1(src)
-        attn_output, _ = self.self_attn(src2, src2, src2)
+        attn_output, _ = self.self_attn(src2, src2, src2, key_padding_mask=key_padding_mask)
         src = src + (attn_output)
         
         # Feed-forward with residual connection
@@ -75,8 +79,14 @@ class ChurnModel(nn.Module):
         self.fc = nn.Linear(d_model, d_model//2)
         self.output_layer = nn.Linear(d_model//2, output_size)
         
-    def forward(self, x):
+    def forward(self, x, positions=None, lengths=None):
         # x shape: (batch_size, seq_len, input_size)
+        # positions: optional (batch_size,) window index of each row within its customer's windows
+        # lengths: optional (batch_size,) real time steps of each row; the zero padding after them
+        # is masked out of attention and the output is read at the last real step
+        key_padding_mask = None
+        if lengths is not None:
+            key_padding_mask = torch.arange(x.size(1), device=x.device) >= lengths.unsqueeze(1)
         
         # Reorder to (seq_len, batch_size, input_size)
         x = x.transpose(0, 1)
@@ -85,14 +95,17 @@ class ChurnModel(nn.Module):
         x = self.embedding(x)
         
         # Add positional encoding
-        x = self.pos_encoder(x)
+        x = self.pos_encoder(x, positions)
         
         # Pass through transformer layers
         for layer in self.transformer_layers:
-            x = layer(x)
+            x = layer(x, key_padding_mask)
         
         # Get last time step (many-to-one)
-        x = x[-1, :, :]  # (batch_size, d_model)
+        if lengths is None:
+            x = x[-1, :, :]  # (batch_size, d_model)
+        else:
+            x = x[lengths - 1, torch.arange(x.size(1), device=x.device)]
         
         # Output layer
         x = self.fc(x)
@@ -129,6 +142,40 @@ class ChurnPredictionInput(BaseModel):
     product_category_electronics: Optional[int] = None
     product_category_home: Optional[int] = None
 
+class PurchaseInput(BaseModel):
+    """One purchase with the columns of the ecommerce CSV, for POST /customers/{table_name}/{customer_id}/purchases"""
+    purchase_date: datetime
+    product_category: str
+    product_price: float
+    quantity: int
+    total_purchase_amount: Optional[float] = None  # product_price * quantity when not given
+    payment_method: str
+    customer_age: Optional[int] = None  # age when not given
+    returns: Optional[float] = None
+    customer_name: Optional[str] = None
+    age: int
+    gender: str
+    churn: int = 0
+
+    def csv_row(self):
+        """The purchase as a row of the CSV insert_csv_data_to_table reads"""
+        return {
+            # Purchase dates in the table are naive, like the CSV's
+            "Purchase Date": self.purchase_date.replace(tzinfo=None),
+            "Product Category": self.product_category,
+            "Product Price": self.product_price,
+            "Quantity": self.quantity,
+            "Total Purchase Amount": (self.total_purchase_amount if self.total_purchase_amount is not None
+                                      else self.product_price * self.quantity),
+            "Payment Method": self.payment_method,
+            "Customer Age": self.customer_age if self.customer_age is not None else self.age,
+            "Returns": self.returns,
+            "Customer Name": self.customer_name,
+            "Age": self.age,
+            "Gender": self.gender,
+            "Churn": self.churn,
+        }
+
 class ChurnPredictionResponse(BaseModel):
     customer_id: Optional[int]
     churn_probability: float
@@ -137,61 +184,119 @@ class ChurnPredictionResponse(BaseModel):
 
 
 
-model = None
-scaler = None
+class Serving(NamedTuple):
+    """
+    The model requests are scored with, with its scaler, version and inference backend.
+    install_model swaps it in with one assignment and scoring reads it once per call, so a request
+    that overlaps a hot reload is scaled and scored with the parts of one model.
+    """
+    model: object
+    scaler: object
+    model_version: Optional[str]
+    inference_backend: Optional[str]
+
+
+serving = Serving(None, None, None, None)
 data_api = None
 seq_length = 10
 num_features = 14
+# Column order of the 14 features in each time step, as produced by insert_csv_data_to_table
+feature_columns = ['Product Price', 'Quantity', 'Total Purchase Amount', 'Returns', 'Age', 'Year', 'Month', 'Day',
+                   'Gender_Male', 'Payment Method_Credit Card', 'Payment Method_PayPal', 'Product Category_Clothing',
+                   'Product Category_Electronics', 'Product Category_Home']
 input_size = 14  # Features per time step
 d_model = 128
 num_heads = 8
 d_ff = 218
 num_layers = 2
+package_dir = os.path.dirname(os.path.abspath(__file__))
+model_bundle_path = os.getenv("CHURN_MODEL_BUNDLE", os.path.join(package_dir, "model_bundle.pt"))
+# Training outputs, read when there is no bundle
+checkpoint_path = os.getenv("CHURN_CHECKPOINT_PATH", os.path.join(package_dir, "best_model.pth"))
+scaler_path = os.getenv("CHURN_SCALER_PATH", os.path.join(package_dir, "scaler.pkl"))
+# Opt-in: score short histories over their real purchases only, without the zero padding (see domain.score_windows)
+length_aware = os.getenv("CHURN_LENGTH_AWARE", "0") == "1"
 
 
-def load_model():
-    """Load the trained model from best_model.pth"""
-    global model, scaler
-        # Try to load the scaler if it was saved
-    try:
-        scaler = joblib.load("churn_service\\scaler.pkl")
-        print(scaler)
-        print("Scaler loaded successfully!")
-        
-    except FileNotFoundError:
-        print("Error: scaler.pkl not found. You may need to save the scaler from training.")
-        scaler = None
+def stale_bundle_sources(bundle_path):
+    """The training outputs that changed after the bundle was built from them"""
+    built = os.path.getmtime(bundle_path)
+    return [path for path in (checkpoint_path, scaler_path) if os.path.exists(path) and os.path.getmtime(path) > built]
 
+
+def read_model(backend=None, bundle_path=None):
+    """
+    Load the model and scaler from the model bundle (see bundle.py), or from best_model.pth and
+    scaler.pkl when there is no bundle, without installing them.
+    Returns them as a Serving. When the bundle exists it is the only file read, so a best_model.pth
+    or scaler.pkl replaced after the bundle was built raises ValueError instead of being ignored.
+    """
+    from .bundle import bundle_scaler, hyperparameter_names, load_bundle, make_bundle
+    from .runtime import build_runtime, model_backend
+    backend = backend or model_backend
+    bundle_path = bundle_path or model_bundle_path
+
+    if os.path.exists(bundle_path):
+        stale = stale_bundle_sources(bundle_path)
+        if stale:
+            raise ValueError(f"{', '.join(stale)} changed after the model bundle {bundle_path} was built; "
+                             f"rebuild it with python -m churn_service.bundle")
+        bundle = load_bundle(bundle_path)
+    else:
+        print(f"No model bundle at {bundle_path}, loading {checkpoint_path}. Build one with python -m churn_service.bundle")
+        if not os.path.exists(scaler_path):
+            print("Error: scaler.pkl not found. You may need to save the scaler from training.")
+        bundle = make_bundle(checkpoint_path, scaler_path if os.path.exists(scaler_path) else None,
+                             {name: globals()[name] for name in hyperparameter_names})
+    hyperparameters = bundle["hyperparameters"]
+    if (hyperparameters["seq_length"], hyperparameters["num_features"]) != (seq_length, num_features):
+        raise ValueError(f"model expects {hyperparameters['seq_length']} x {hyperparameters['num_features']} windows, "
+                         f"the service builds {seq_length} x {num_features}")
+
+    # Initialize model with the correct parameters from training
+    loaded = ChurnModel(
+        input_size=hyperparameters["input_size"],
+        d_model=hyperparameters["d_model"],
+        num_heads=hyperparameters["num_heads"],
+        d_ff=hyperparameters["d_ff"],
+        num_layers=hyperparameters["num_layers"],
+        output_size=1
+    )
+    # assign keeps the memory-mapped tensors as the parameters instead of copying them
+    loaded.load_state_dict(bundle["state_dict"], assign=True)
+    loaded.eval()
+    version = bundle["model_version"]
+    runtime_model = build_runtime(loaded, backend, version)
+    # int8 scores differ slightly from the float32 ones they would replace
+    if backend.endswith('-int8'):
+        version = f"{version}-int8"
+    if length_aware:
+        if backend.startswith('onnx'):
+            raise ValueError("CHURN_LENGTH_AWARE needs the eager or torchscript backends, "
+                             "the ONNX models only take full-length windows")
+        # Short histories score differently without their padding
+        version = f"{version}-length-aware"
+    return Serving(runtime_model, bundle_scaler(bundle), version, backend)
+
+
+def install_model(loaded):
+    """Make a read_model result the Serving requests use"""
+    global serving
+    serving = loaded
+
+
+def load_model(backend=None, bundle_path=None):
+    """
+    Load the model and scaler from the model bundle (see bundle.py), or from best_model.pth and
+    scaler.pkl when there is no bundle, and install them as serving, with the configured inference backend.
+    """
     try:
-        # Load the model state
-        checkpoint = torch.load('churn_service\\best_model.pth', map_location=torch.device('cpu'))
-        
-        # Extract model parameters
-        if 'model_state_dict' in checkpoint:
-            state_dict = checkpoint['model_state_dict']
-        else:
-            state_dict = checkpoint
-                
-        # Initialize model with the correct parameters from training
-        model = ChurnModel(
-            input_size=input_size,
-            d_model=d_model,
-            num_heads=num_heads,
-            d_ff=d_ff,
-            num_layers=num_layers,
-            output_size=1
-        )
-        model.load_state_dict(state_dict)
-        model.eval()
-        
-        print(f"Model loaded successfully!")
+        install_model(read_model(backend, bundle_path))
+        print(f"Model {serving.model_version} loaded successfully! Backend: {serving.inference_backend}")
         print(f"Sequence length: {seq_length}")
         print(f"Features per time step: {num_features}")
         print(f"Total input features: {seq_length * num_features}")
-        
+
     except Exception as e:
         print(f"Error loading model: {e}")
         raise
-
-
-
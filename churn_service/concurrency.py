@@ -0,0 +1,31 @@
+import asyncio
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+# Blocking pandas/psycopg2 calls run on a bounded pool sized to stay within the engine's
+# connection pool, model inference gets its own threads so slow queries can't starve it
+db_threads = int(os.getenv("CHURN_DB_THREADS", "10"))
+inference_threads = int(os.getenv("CHURN_INFERENCE_THREADS", "1"))
+
+db_executor = ThreadPoolExecutor(max_workers=db_threads, thread_name_prefix="churn-db")
+inference_executor = ThreadPoolExecutor(max_workers=inference_threads, thread_name_prefix="churn-inference")
+
+
+async def run_db(fn, *args, **kwargs):
+    """Run a blocking database call on the db executor without blocking the event loop"""
+    # In a copy of the caller's context, so the call's timing spans reach the request's profile
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(db_executor, partial(context.run, fn, *args, **kwargs))
+
+
+async def run_inference(fn, *args, **kwargs):
+    """Run a blocking model call on the inference executor, like run_db"""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(inference_executor, partial(context.run, fn, *args, **kwargs))
+
+
+def shutdown():
+    db_executor.shutdown(wait=False, cancel_futures=True)
+    inference_executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,56 @@
+import io
+
+import pandas as pd
+from sqlalchemy import Integer, MetaData, Table
+
+executemany_batch_size = 10_000  # rows per executemany call on backends without COPY
+
+
+def write_frame(data: pd.DataFrame, table_name: str, connection, create: bool = False) -> int:
+    """
+    Append data to table_name inside connection's transaction, first creating the table from
+    data's schema when create is set. Later frames are cast to the table's column types, so a
+    chunk loaded after the first one can hold nulls in its integer columns. PostgreSQL gets the
+    rows through COPY FROM STDIN, other backends through batched executemany.
+    Returns the number of rows written.
+    """
+    if create:
+        data.head(0).to_sql(table_name, connection, if_exists='replace', index=False)
+    table = Table(table_name, MetaData(), autoload_with=connection)
+    data = conform_frame(data, table)
+    if connection.dialect.name == 'postgresql':
+        copy_frame(data, table_name, connection)
+    else:
+        executemany_frame(data, table, connection)
+    return len(data)
+
+
+def conform_frame(data: pd.DataFrame, table: Table) -> pd.DataFrame:
+    """
+    data with the float columns that table stores as integers cast to nullable integers. pandas
+    reads an integer column with nulls as floats, which COPY would get as "35.0" and reject.
+    """
+    integer_columns = {column.name: 'Int64' for column in table.columns
+                       if isinstance(column.type, Integer) and column.name in data and data[column.name].dtype.kind == 'f'}
+    return data.astype(integer_columns) if integer_columns else data
+
+
+def copy_frame(data: pd.DataFrame, table_name: str, connection):
+    """Stream data into an existing PostgreSQL table with COPY ... FROM STDIN (CSV) through psycopg2"""
+    buffer = io.StringIO()
+    # NaN and None become empty unquoted fields, which COPY reads as NULL
+    data.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    columns = ", ".join(f'"{column}"' for column in data.columns)
+    # The psycopg2 connection behind connection, so the COPY joins its transaction
+    with connection.connection.cursor() as cursor:
+        cursor.copy_expert(f"COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def executemany_frame(data: pd.DataFrame, table: Table, connection, batch_size=executemany_batch_size):
+    """Insert data into an existing table with one executemany per batch_size rows"""
+    for start in range(0, len(data), batch_size):
+        batch = data.iloc[start:start + batch_size]
+        # Plain Python values with None for missing ones, which every DBAPI driver accepts
+        rows = batch.astype(object).where(batch.notna(), None).to_dict('records')
+        connection.execute(table.insert(), rows)
@@ -3,96 +3,291 @@ from sqlalchemy.orm import Session
 import torch
 from sqlalchemy import text
 from .database import get_db,engine
-from .database.repositories import get_all_customers_from_db, get_customer
-import joblib
+from .database.repositories import get_customer_features, get_customer_summaries, get_table_version
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 from fastapi import HTTPException
 from . import churn_service
-from .churn_service import ChurnPredictionResponse
-
-
-def get_customer_sequence_scaled(customer_id, table_name):
-    numerical_cols =['Product Price', 'Quantity','Total Purchase Amount', 'Returns', 'Age', 'Year', 'Month', 'Day','Gender_Male', 'Payment Method_Credit Card', 'Payment Method_PayPal', 'Product Category_Clothing','Product Category_Electronics', 'Product Category_Home']
-    df = get_customer(customer_id,table_name)
-    sequences = []
-    labels = []
-    seq_length = 10
-    churn_offset = 1 #when do we consider the customer seq as churn seq
-    features = numerical_cols 
-    try:
-        customer_data = df[df['Customer ID'] == customer_id].sort_values(by='Purchase Date')
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"there is no dataframe")
-    
-    for i in range(max(1,len(customer_data)-seq_length+1)):
-        seq = customer_data.iloc[i:min(i+seq_length, len(customer_data))][features].values
-        if len(seq) < seq_length:
-            pad_shape = (seq_length - len(seq), len(features))
-            padding = np.zeros(pad_shape)
-            seq = np.vstack([seq, padding])
-        if i + seq_length < len(customer_data) - churn_offset:
-            label = 0
-        else:
-            label = customer_data.iloc[min(i+seq_length-1, len(customer_data)-1)]['Churn']
-        sequences.append(seq)
-        labels.append(label)
-
-    X = np.array(sequences)
-    y = np.array(labels)
-    X = X.reshape(X.shape[0], -1)
-    if churn_service.scaler is None:
+from .concurrency import run_db
+from .cache import feature_cache
+from .metrics import span
+
+churn_offset = 1 #when do we consider the customer seq as churn seq
+scoring_chunk_size = 5000  # customers fetched per ordered range scan by scores.refresh_scores
+inference_batch_size = 1024  # windows per ChurnModel forward pass
+
+
+def build_windows(values, churn, boundaries=None, seq_length=churn_service.seq_length):
+    """
+    Build the sliding windows and labels for one or many customers' purchases.
+    values is a (n_purchases, n_features) array sorted by customer then purchase date, churn the
+    matching Churn column and boundaries the row index where each customer starts, followed by
+    n_purchases (defaults to a single customer). Customers with fewer than seq_length purchases
+    get a single zero-padded window.
+    Returns the (n_windows, seq_length, n_features) windows, their labels, each window's index
+    within its customer and each customer's window offsets.
+    """
+    values = np.asarray(values)
+    churn = np.asarray(churn)
+    if boundaries is None:
+        boundaries = np.array([0, len(values)])
+    boundaries = np.asarray(boundaries)
+    counts = np.diff(boundaries)
+    n_windows = np.maximum(1, counts - seq_length + 1)
+    offsets = np.concatenate([[0], np.cumsum(n_windows)])
+    positions = np.arange(offsets[-1]) - np.repeat(offsets[:-1], n_windows)
+    first_rows = np.repeat(boundaries[:-1], n_windows)
+    remaining = np.repeat(counts, n_windows) - positions
+
+    # seq_length - 1 trailing zero rows give every start row a full-length view to gather from
+    padded = np.concatenate([values, np.zeros((seq_length - 1, values.shape[1]), dtype=values.dtype)])
+    views = sliding_window_view(padded, (seq_length, values.shape[1]))[:, 0]
+    X = views[first_rows + positions]
+    # Short customers' windows run into the next customer's rows, zero them out
+    short = np.flatnonzero(remaining < seq_length)
+    X[short] = np.where((np.arange(seq_length) < remaining[short, None])[:, :, None], X[short], 0)
+
+    labels = churn[first_rows + np.minimum(positions + seq_length - 1, remaining + positions - 1)]
+    y = np.where(remaining < seq_length + churn_offset + 1, labels, 0)
+    return X, y, positions, offsets
+
+def scale_windows(X, scaler=None):
+    """
+    Apply the training scaler (the serving one by default) to (n, seq_length, num_features) windows
+    in float32 and return them as a contiguous float32 array. float32 windows are scaled in place,
+    so X must be windows the caller just built, never ones held by the feature cache.
+    """
+    scaler = scaler if scaler is not None else churn_service.serving.scaler
+    if scaler is None:
         raise HTTPException(status_code=500, detail="Scaler not loaded")
-    x_resampled = churn_service.scaler.transform(X) #change the scaler for each model
-    # x_resampled = x_resampled.reshape(-1, seq_length, len(numerical_cols))
-    return x_resampled.tolist(),y.tolist()
+    with span("scale"):
+        return scaler.transform_windows(X) #change the scaler for each model
+
+def window_lengths(counts, seq_length=churn_service.seq_length):
+    """Real purchases in each window build_windows makes for customers with counts purchases; the rest is zero padding"""
+    counts = np.asarray(counts)
+    return np.repeat(np.clip(counts, 1, seq_length), np.maximum(1, counts - seq_length + 1))
 
-def predict_churn(customer_id, table_name):
-    customer_sequences , labels = get_customer_sequence_scaled(customer_id, table_name)
-    if churn_service.model is None:
+def length_buckets(lengths, seq_length=churn_service.seq_length):
+    """(length, window indexes) for the windows of each length, longest first; indexes None stands for every window"""
+    lengths = np.asarray(lengths)
+    if (lengths == seq_length).all():
+        return [(seq_length, None)]
+    order = np.argsort(-lengths, kind="stable")
+    starts = np.flatnonzero(np.diff(lengths[order])) + 1
+    return [(int(lengths[indexes[0]]), indexes) for indexes in np.split(order, starts)]
+
+def score_windows(sequences, positions=None, batch_size=inference_batch_size, lengths=None, model=None):
+    """
+    Run ChurnModel over scaled windows in fixed-size batches and return the probabilities.
+    positions holds each window's index among its customer's windows; by default all windows are
+    taken to belong to one customer, which is what scoring that customer on its own gives.
+    lengths holds each window's real purchases (window_lengths). With churn_service.length_aware
+    the windows are bucketed by length and each bucket runs over its real steps only, so short
+    histories neither attend to nor get read out at their zero padding; otherwise it is ignored.
+    model defaults to the serving one, read once so a hot reload does not split the batches between two models.
+    """
+    model = model if model is not None else churn_service.serving.model
+    if model is None:
         raise HTTPException(status_code=500, detail="Model not loaded")
-    # Prepare sequence data
-    if len(customer_sequences[0]) != churn_service.seq_length * churn_service.num_features:
+    sequences = np.ascontiguousarray(sequences, dtype=np.float32)
+    if sequences[0].size != churn_service.seq_length * churn_service.num_features:
         raise HTTPException(
             status_code=400,
-            detail=f"Expected {churn_service.seq_length * churn_service.num_features} features in customer_sequence, got {len(customer_sequences[0])}"
+            detail=f"Expected {churn_service.seq_length * churn_service.num_features} features in customer_sequence, got {sequences[0].size}"
         )
-    sequences = customer_sequences
     # Reshape to (batch_size, seq_length, num_features)
-    sequence_tensor = torch.tensor(sequences, dtype=torch.float32).reshape(len(sequences), churn_service.seq_length, churn_service.num_features)
-        
-    result = []
-    # Make prediction
-    with torch.no_grad():
-        predictions = churn_service.model(sequence_tensor)
-        for pred in predictions:
-            churn_probability= pred.item()
-
-            # Determine churn prediction and confidence
-            churn_prediction = churn_probability > 0.5
-        
-            if churn_probability > 0.8 or churn_probability < 0.2:
-                confidence = "High"
-            elif churn_probability > 0.6 or churn_probability < 0.4:
-                confidence = "Medium"
-            else:
-                confidence = "Low"
-
-            result.append( ChurnPredictionResponse(
-                customer_id=customer_id,
-                churn_probability=round(churn_probability, 4),
-                churn_prediction=churn_prediction,
-                confidence=confidence
-                )
-            )
-    return result , labels
-    
-def predict_churned_customers(table_name):
-    df = get_all_customers_from_db(table_name)
-    predictions = {}
-    for customer_id in df['Customer ID']:
-        result, label = predict_churn(customer_id, table_name)
-        predictions[customer_id] = {
-            "prediction": result,
-            "actual": label
-        }
-    return predictions
\ No newline at end of file
+    sequence_tensor = torch.from_numpy(sequences).reshape(len(sequences), churn_service.seq_length, churn_service.num_features)
+    if positions is None:
+        positions = np.arange(len(sequences))
+    positions = torch.as_tensor(positions, dtype=torch.long)
+    probabilities = np.empty(len(sequences), dtype=np.float32)
+    buckets = [(churn_service.seq_length, None)]
+    if lengths is not None and churn_service.length_aware:
+        buckets = length_buckets(lengths)
+    with span("forward"), torch.no_grad():
+        for length, indexes in buckets:
+            bucket = sequence_tensor if indexes is None else sequence_tensor[indexes]
+            bucket_positions = positions if indexes is None else positions[indexes]
+            bucket_probabilities = probabilities if indexes is None else np.empty(len(indexes), dtype=np.float32)
+            for start in range(0, len(bucket), batch_size):
+                batch = bucket[start:start+batch_size, :length]
+                batch_positions = bucket_positions[start:start+batch_size]
+                bucket_probabilities[start:start+len(batch)] = model(batch, batch_positions).reshape(-1).numpy()
+            if indexes is not None:
+                probabilities[indexes] = bucket_probabilities
+    return probabilities
+
+def score_raw_windows(windows, positions, lengths=None, batch_size=inference_batch_size, serving=None):
+    """
+    Scale and score (n, seq_length, num_features) windows of raw feature values, such as the ones
+    POST /predict/batch receives, with one Serving (the current one by default)
+    """
+    serving = serving or churn_service.serving
+    if len(windows) == 0:
+        return np.empty(0, dtype=np.float32)
+    return score_windows(scale_windows(windows, serving.scaler), positions, batch_size, lengths, serving.model)
+
+confidence_levels = ("Low", "Medium", "High")
+
+def confidence_codes(probabilities):
+    """Index into confidence_levels of each probability: High below 0.2 or above 0.8, Medium below 0.4 or above 0.6, else Low"""
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    # Every High probability is also beyond the Medium bounds, so the two tests add up to the code
+    codes = ((probabilities > 0.6) | (probabilities < 0.4)).astype(np.int8)
+    codes += (probabilities > 0.8) | (probabilities < 0.2)
+    return codes
+
+def confidence_bands(probabilities):
+    """High/Medium/Low confidence of each probability"""
+    return np.array(confidence_levels)[confidence_codes(probabilities)]
+
+def prediction_columns(probabilities):
+    """Rounded probabilities, predictions and confidence codes of a whole output array, as lists ready to serialize"""
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    return {
+        "churn_probability": np.round(probabilities, 4).tolist(),
+        "churn_prediction": (probabilities > 0.5).tolist(),
+        "confidence": confidence_codes(probabilities).tolist(),
+    }
+
+def to_prediction_responses(customer_id, probabilities):
+    """One ChurnPredictionResponse-shaped dict per window"""
+    with span("responses"):
+        columns = prediction_columns(probabilities)
+        return [{"customer_id": customer_id, "churn_probability": probability, "churn_prediction": prediction,
+                 "confidence": confidence_levels[code]}
+                for probability, prediction, code in zip(columns["churn_probability"], columns["churn_prediction"],
+                                                         columns["confidence"])]
+
+def to_prediction_columns(customer_id, probabilities):
+    """The columnar shape of to_prediction_responses: parallel arrays, with confidence as codes into confidence_levels"""
+    with span("responses"):
+        return {"customer_id": customer_id, **prediction_columns(probabilities), "confidence_levels": confidence_levels}
+
+def customer_summaries(table_name, customer_ids=None, cursor=None, limit=None):
+    """
+    The dashboard's summary of each customer: name, email, total spent and days since the last
+    purchase, in the shape /customers/{table_name}/{customer_id}/data has always returned.
+    """
+    df = get_customer_summaries(table_name, customer_ids, cursor, limit)
+    days_since_last_purchase = (pd.Timestamp.now() - df["last_purchase_date"]).dt.days
+    names = df["customer_name"].fillna("")
+    summaries = pd.DataFrame({
+        "id": df["customer_id"],
+        "name": df["customer_name"],
+        "email": names.str.lower().str.replace(" ", "", regex=False) + "@gmail.com",
+        "totalSpent": df["total_spent"].astype(str),
+        # Days since the last purchase, under the key the dashboard reads
+        "last_purchase_date": days_since_last_purchase.astype("Int64").astype(str).replace("<NA>", "None"),
+        "last_purchase": df["last_purchase_date"].dt.strftime("%Y-%m-%dT%H:%M:%S").astype(object),
+    })
+    summaries["last_purchase"] = summaries["last_purchase"].where(df["last_purchase_date"].notna(), None)
+    return summaries.to_dict("records")
+
+def get_customer_sequence_scaled(customer_id, table_name, scaler=None):
+    """A customer's windows scaled with scaler (the serving one by default), their labels and their window_lengths"""
+    # Rows come back ordered by purchase date
+    customer_data = get_customer_features(customer_id,table_name)
+    with span("build_windows"):
+        X, y, _, _ = build_windows(customer_data[churn_service.feature_columns].to_numpy(dtype=np.float32),
+                                   customer_data['Churn'].to_numpy())
+    return scale_windows(X, scaler), y, window_lengths([len(customer_data)])
+
+def get_customer_windows(customer_id, table_name, scaler=None):
+    """Cache entry holding a customer's windows scaled with scaler (the serving one by default) and labels, built on a miss"""
+    scaler = scaler if scaler is not None else churn_service.serving.scaler
+    feature_cache.sync(table_name, lambda: get_table_version(table_name))
+    entry = feature_cache.get(table_name, customer_id)
+    # Windows cached before a hot reload changed the scaler are scaled again
+    if entry is None or entry.scaler is not scaler:
+        generation = feature_cache.generation(table_name)
+        customer_sequences , labels, lengths = get_customer_sequence_scaled(customer_id, table_name, scaler)
+        entry = feature_cache.put(table_name, customer_id, customer_sequences, labels, generation, lengths, scaler)
+    return entry
+
+def predict_churn(customer_id, table_name, columnar=False):
+    serving = churn_service.serving
+    entry = get_customer_windows(customer_id, table_name, serving.scaler)
+    probabilities = entry.probabilities
+    if probabilities is None or entry.model is not serving.model:
+        probabilities = score_windows(entry.windows, lengths=entry.lengths, model=serving.model)
+        feature_cache.set_prediction(entry, probabilities, serving.model)
+    if columnar:
+        return {**to_prediction_columns(customer_id, probabilities), "actual": entry.labels.tolist()}
+    return to_prediction_responses(customer_id, probabilities) , entry.labels.tolist()
+
+async def predict_churn_batched(customer_id, table_name, batcher, columnar=False):
+    """predict_churn, with the forward pass shared with concurrent requests through a MicroBatcher"""
+    serving = churn_service.serving
+    entry = await run_db(get_customer_windows, customer_id, table_name, serving.scaler)
+    probabilities = entry.probabilities
+    if probabilities is None or entry.model is not serving.model:
+        with span("batch_wait"):
+            probabilities = await batcher.submit(entry.windows, np.arange(len(entry.windows)), entry.lengths,
+                                                 serving.model)
+        # A copy, so the cache doesn't keep the whole batch's output alive
+        feature_cache.set_prediction(entry, probabilities.copy(), serving.model)
+    if columnar:
+        return {**to_prediction_columns(customer_id, probabilities), "actual": entry.labels.tolist()}
+    return to_prediction_responses(customer_id, probabilities) , entry.labels.tolist()
+
+def customer_boundaries(customer_ids):
+    """Row index where each customer's purchases start in ids sorted by customer, followed by len(customer_ids)"""
+    return np.concatenate([[0], np.flatnonzero(customer_ids[1:] != customer_ids[:-1]) + 1, [len(customer_ids)]])
+
+def build_windows_for_rows(customer_ids, values, churn):
+    """
+    Build windows for purchase rows ordered by customer then purchase date, given as the Customer ID
+    column, the (n, num_features) feature values and the Churn column.
+    Returns the customer ids followed by the windows, labels, positions and offsets of build_windows.
+    """
+    with span("build_windows"):
+        boundaries = customer_boundaries(customer_ids)
+        # Windows are gathered straight into float32, the dtype scale_windows works in
+        X, y, positions, offsets = build_windows(np.asarray(values, dtype=np.float32), churn, boundaries)
+    return customer_ids[boundaries[:-1]], X, y, positions, offsets
+
+def build_windows_for_customers(df):
+    """build_windows_for_rows for a DataFrame of the window columns, ordered by customer then purchase date"""
+    return build_windows_for_rows(df['Customer ID'].to_numpy(), df[churn_service.feature_columns].to_numpy(),
+                                  df['Churn'].to_numpy())
+
+def score_customer_rows(customer_ids, values, churn, batch_size=inference_batch_size, serving=None):
+    """
+    Score every window of purchase rows laid out as for build_windows_for_rows, with one Serving
+    (the current one by default).
+    Returns the customer ids, the window probabilities, labels and positions and each customer's window offsets.
+    """
+    serving = serving or churn_service.serving
+    lengths = window_lengths(np.diff(customer_boundaries(customer_ids))) if churn_service.length_aware else None
+    customer_ids, X, y, positions, offsets = build_windows_for_rows(customer_ids, values, churn)
+    probabilities = score_windows(scale_windows(X, serving.scaler), positions, batch_size, lengths, serving.model)
+    return customer_ids, probabilities, y, positions, offsets
+
+def score_customers(df, batch_size=inference_batch_size, serving=None):
+    """score_customer_rows for a DataFrame of the window columns, ordered by customer then purchase date"""
+    return score_customer_rows(df['Customer ID'].to_numpy(), df[churn_service.feature_columns].to_numpy(),
+                               df['Churn'].to_numpy(), batch_size, serving)
+
+def get_snapshot_sequence_scaled(customer_id, snapshot, scaler=None):
+    """get_customer_sequence_scaled, reading the customer's rows from a snapshots.FeatureSnapshot"""
+    rows = snapshot.customer_rows(customer_id)
+    if rows is None:
+        raise HTTPException(status_code=404, detail=f"customer {customer_id} not found")
+    values, churn = rows
+    X, y, _, _ = build_windows(np.asarray(values, dtype=np.float32), churn)
+    return scale_windows(X, scaler), y, window_lengths([len(values)])
+
+def predict_churn_from_snapshot(customer_id, snapshot):
+    """predict_churn without the database: the customer's windows come from a snapshots.FeatureSnapshot"""
+    serving = churn_service.serving
+    windows, labels, lengths = get_snapshot_sequence_scaled(customer_id, snapshot, serving.scaler)
+    probabilities = score_windows(windows, lengths=lengths, model=serving.model)
+    return to_prediction_responses(customer_id, probabilities), labels.tolist()
+
+def score_snapshot(snapshot, batch_size=inference_batch_size, serving=None):
+    """Score every customer of a snapshots.FeatureSnapshot, yielding score_customer_rows' result per partition"""
+    serving = serving or churn_service.serving
+    for customer_ids, values, churn in snapshot.iter_partitions():
+        yield score_customer_rows(customer_ids, values, churn, batch_size, serving)
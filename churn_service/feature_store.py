@@ -0,0 +1,301 @@
+"""
+Online feature store: the last seq_length encoded purchases of every customer, in ring buffers.
+
+POST /customers/{table_name}/{customer_id}/purchases encodes a new purchase as
+insert_csv_data_to_table encodes the CSV, appends it to the table (which stays the source of
+truth) and to the customer's ring buffer, and scores only the customer's newest window, instead
+of reading their whole history back and rescoring every window.
+
+A table's store is built from the table in one ordered pass the first time it is used, or at
+startup for the tables in CHURN_FEATURE_STORE_TABLES. Snapshots (one .npz per table in
+CHURN_FEATURE_STORE_DIR) are written on shutdown and by POST /feature_store/{table_name}/snapshot;
+one is loaded instead of rebuilding when the table still has the row count and latest purchase
+date the snapshot was taken at.
+
+Every worker has its own stores, kept in line with the table, which other workers write too. A
+store remembers the table's reload count (see repositories.bump_table_version) it was opened at
+and is reopened when the table was reloaded since. Before a customer's window is read or a
+purchase appended, the customer's purchase count and latest date in the table are checked against
+the store, and their history is reread when another worker appended to it.
+"""
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+from fastapi import HTTPException
+
+from . import churn_service
+from .cache import feature_cache
+from .database.repositories import (get_customer_features, get_customer_purchase_markers, get_table_encoding,
+                                    get_table_markers, get_table_version, insert_purchases, iter_query_chunks,
+                                    window_select)
+from .domain import customer_boundaries, scale_windows, score_windows, to_prediction_responses
+
+feature_store_tables = [table for table in os.getenv("CHURN_FEATURE_STORE_TABLES", "").split(",") if table]
+feature_store_dir = os.getenv("CHURN_FEATURE_STORE_DIR", os.path.join(churn_service.package_dir, "feature_store"))
+restore_chunk_size = 100_000  # Table rows read at a time when a store is rebuilt
+
+array_names = ("customer_ids", "rows", "counts", "last_churn", "last_purchase")
+
+
+class FeatureStore:
+    """
+    The ring buffers of one table's customers, in flat arrays indexed by a slot per customer:
+    rows[slot, k % seq_length] holds the customer's k-th purchase (counting from their first) for
+    their last seq_length purchases, counts how many purchases they have made, last_churn and
+    last_purchase the Churn and date of the newest one.
+    """
+
+    def __init__(self, table_name, capacity=1024, seq_length=churn_service.seq_length,
+                 num_features=churn_service.num_features):
+        self.table_name = table_name
+        self.seq_length = seq_length
+        self.encoding = None  # get_table_encoding's, for new purchases
+        self.version = None  # The table's reload count when the store was opened
+        self.slots = {}
+        self.customer_ids = np.zeros(capacity, dtype=np.int64)
+        self.rows = np.zeros((capacity, seq_length, num_features), dtype=np.float32)
+        self.counts = np.zeros(capacity, dtype=np.int64)
+        self.last_churn = np.zeros(capacity, dtype=np.int64)
+        self.last_purchase = np.zeros(capacity, dtype="datetime64[ns]")
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.slots)
+
+    def _grow(self, needed):
+        capacity = len(self.counts)
+        if needed <= capacity:
+            return
+        capacity = max(needed, 2 * capacity)
+        for name in array_names:
+            array = getattr(self, name)
+            grown = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+            grown[:len(array)] = array
+            setattr(self, name, grown)
+
+    def _slots(self, customer_ids):
+        """The slot of each customer, allocating slots for the new ones"""
+        slots = np.array([self.slots.setdefault(customer_id, len(self.slots)) for customer_id in customer_ids.tolist()],
+                         dtype=np.int64)
+        self._grow(len(self.slots))
+        self.customer_ids[slots] = customer_ids
+        return slots
+
+    def _extend(self, customer_ids, values, churn, purchase_dates):
+        boundaries = customer_boundaries(customer_ids)
+        starts, ends = boundaries[:-1], boundaries[1:]
+        added = np.diff(boundaries)
+        slots = self._slots(customer_ids[starts])
+        # Index of each row among its customer's rows here; only their last seq_length are kept
+        index = np.arange(len(customer_ids)) - np.repeat(starts, added)
+        keep = index >= np.repeat(added - self.seq_length, added)
+        purchase = index + np.repeat(self.counts[slots], added)
+        self.rows[np.repeat(slots, added)[keep], purchase[keep] % self.seq_length] = values[keep]
+        self.counts[slots] += added
+        self.last_churn[slots] = churn[ends - 1]
+        self.last_purchase[slots] = purchase_dates[ends - 1]
+
+    def extend(self, customer_ids, values, churn, purchase_dates):
+        """
+        Append purchase rows ordered by customer, then purchase date, each newer than the purchases
+        of its customer already in the store; a customer's rows may continue in the next call.
+        """
+        customer_ids = np.asarray(customer_ids, dtype=np.int64)
+        if len(customer_ids) == 0:
+            return
+        with self._lock:
+            self._extend(customer_ids, values, churn, purchase_dates)
+
+    def replace(self, customer_id, values, churn, purchase_dates):
+        """Replace a customer's purchases with their whole history, ordered by purchase date"""
+        with self._lock:
+            slot = self.slots.get(customer_id)
+            if slot is not None:
+                self.counts[slot] = 0
+                self.rows[slot] = 0
+            self._extend(np.full(len(values), customer_id, dtype=np.int64), values, churn, purchase_dates)
+
+    def customer_markers(self, customer_id):
+        """A customer's purchases seen and latest purchase date, as get_customer_purchase_markers gives them"""
+        with self._lock:
+            slot = self.slots.get(customer_id)
+            if slot is None or not self.counts[slot]:
+                return 0, None
+            return int(self.counts[slot]), pd.Timestamp(self.last_purchase[slot])
+
+    def newest_window(self, customer_id):
+        """
+        The customer's newest window laid out as build_windows lays it out (real rows first, then
+        zero padding), with its window index, real length and label; None for an unknown customer.
+        """
+        with self._lock:
+            slot = self.slots.get(customer_id)
+            if slot is None:
+                return None
+            count = int(self.counts[slot])
+            length = min(count, self.seq_length)
+            window = np.zeros((1,) + self.rows.shape[1:], dtype=np.float32)
+            window[0, :length] = self.rows[slot, (count - length + np.arange(length)) % self.seq_length]
+            return window, max(0, count - self.seq_length), length, int(self.last_churn[slot])
+
+    def markers(self):
+        """Purchases seen and latest purchase date, as get_table_markers gives them for the table"""
+        with self._lock:
+            n = len(self.slots)
+            return int(self.counts[:n].sum()), pd.Timestamp(self.last_purchase[:n].max()) if n else None
+
+    def stats(self):
+        n = len(self.slots)
+        return {
+            "customers": n,
+            "purchases": int(self.counts[:n].sum()),
+            "capacity": len(self.counts),
+            "bytes": sum(getattr(self, name).nbytes for name in array_names),
+        }
+
+    def save(self, path):
+        """Write the store to path, replacing the snapshot there only once the new one is complete"""
+        with self._lock:
+            n = len(self.slots)
+            arrays = {name: getattr(self, name)[:n].copy() for name in array_names}
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        partial = f"{path}.{os.getpid()}.partial"
+        with open(partial, "wb") as f:
+            np.savez(f, table_name=np.array(self.table_name), **arrays)
+        os.replace(partial, path)
+        return n
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as snapshot:
+            n, seq_length, num_features = snapshot["rows"].shape
+            store = cls(str(snapshot["table_name"]), max(n, 1), seq_length, num_features)
+            for name in array_names:
+                getattr(store, name)[:n] = snapshot[name]
+        store.slots = dict(zip(store.customer_ids[:n].tolist(), range(n)))
+        return store
+
+
+stores = {}
+_stores_lock = threading.Lock()
+
+
+def snapshot_path(table_name):
+    return os.path.join(feature_store_dir, f"{table_name}.npz")
+
+
+def restore(table_name, chunksize=restore_chunk_size):
+    """A store of every customer in table_name, rebuilt from the table in one pass ordered by customer and date"""
+    store = FeatureStore(table_name)
+    query = f'SELECT {window_select} FROM {table_name} ORDER BY "Customer ID", "Purchase Date"'
+    for chunk in iter_query_chunks(query, chunksize=chunksize):
+        store.extend(chunk["Customer ID"].to_numpy(), chunk[churn_service.feature_columns].to_numpy(dtype=np.float32),
+                     chunk["Churn"].to_numpy(), pd.to_datetime(chunk["Purchase Date"]).to_numpy())
+    return store
+
+
+def open_store(table_name):
+    """table_name's store from its snapshot when that is still up to date with the table, otherwise rebuilt"""
+    # Read first, so a reload while the store is built reopens it
+    version = get_table_version(table_name)[0]
+    path = snapshot_path(table_name)
+    store = None
+    if os.path.exists(path):
+        store = FeatureStore.load(path)
+        if store.markers() != get_table_markers(table_name):
+            print(f"Feature store snapshot {path} is behind {table_name}, rebuilding it from the table")
+            store = None
+    if store is None:
+        store = restore(table_name)
+    store.encoding = get_table_encoding(table_name)
+    store.version = version
+    return store
+
+
+def get_store(table_name):
+    """The store of table_name, opened the first time it is asked for and again after the table was reloaded"""
+    version = get_table_version(table_name)[0]
+    store = stores.get(table_name)
+    if store is None or store.version != version:
+        with _stores_lock:
+            store = stores.get(table_name)
+            if store is None or store.version != version:
+                store = stores[table_name] = open_store(table_name)
+    return store
+
+
+def drop_store(table_name):
+    """Forget table_name's store after the table was reloaded; the next use rebuilds it"""
+    with _stores_lock:
+        stores.pop(table_name, None)
+
+
+def save_store(table_name):
+    store = stores.get(table_name)
+    if store is None:
+        raise HTTPException(status_code=404, detail=f"No feature store is open for {table_name}")
+    path = snapshot_path(table_name)
+    return {"table_name": table_name, "path": path, "customers": store.save(path)}
+
+
+def save_stores():
+    return [save_store(table_name) for table_name in list(stores)]
+
+
+def feature_store_stats():
+    return {table_name: store.stats() for table_name, store in list(stores.items())}
+
+
+def reread_customer(store, customer_id):
+    """Replace the customer's purchases in store with their history in the table"""
+    history = get_customer_features(customer_id, store.table_name)
+    store.replace(customer_id, history[churn_service.feature_columns].to_numpy(dtype=np.float32),
+                  history["Churn"].to_numpy(), pd.to_datetime(history["Purchase Date"]).to_numpy())
+
+
+def sync_customer(store, customer_id):
+    """Reread the customer's history when the table has purchases of theirs the store has not seen"""
+    markers = get_customer_purchase_markers(customer_id, store.table_name)
+    if markers[0] and markers != store.customer_markers(customer_id):
+        reread_customer(store, customer_id)
+
+
+def score_newest_window(customer_id, table_name):
+    """The prediction of the customer's newest window, its window index and label, from the store alone"""
+    store = get_store(table_name)
+    sync_customer(store, customer_id)
+    return score_store_window(store, customer_id)
+
+
+def score_store_window(store, customer_id):
+    newest = store.newest_window(customer_id)
+    if newest is None:
+        raise HTTPException(status_code=404, detail=f"customer {customer_id} not found")
+    window, position, length, label = newest
+    serving = churn_service.serving
+    probabilities = score_windows(scale_windows(window, serving.scaler), [position], lengths=[length],
+                                  model=serving.model)
+    return {**to_prediction_responses(customer_id, probabilities)[0], "window_index": position, "actual": label}
+
+
+def append_purchase(customer_id, table_name, purchase):
+    """
+    Store one raw purchase of customer_id (a row of the CSV's columns) in table_name and its
+    feature store, then score the customer's newest window.
+    """
+    store = get_store(table_name)
+    seen, last_purchase = store.customer_markers(customer_id)
+    encoded = insert_purchases(pd.DataFrame([{**purchase, "Customer ID": customer_id}]), table_name, store.encoding)
+    feature_cache.discard(table_name, customer_id)
+    purchase_dates = encoded["Purchase Date"].to_numpy(dtype="datetime64[ns]")
+    purchases, _ = get_customer_purchase_markers(customer_id, table_name)
+    if purchases == seen + 1 and (last_purchase is None or purchase_dates[0] >= last_purchase):
+        store.extend([customer_id], encoded[churn_service.feature_columns].to_numpy(dtype=np.float32),
+                     encoded["Churn"].to_numpy(), purchase_dates)
+    else:
+        # The purchase lands inside the history, or another worker appended to the customer since
+        # the store saw them; reread the customer's rows
+        reread_customer(store, customer_id)
+    return score_store_window(store, customer_id)
@@ -1,48 +1,33 @@
 import pandas as pd
 import numpy as np
-import joblib
-from datetime import datetime
-from fastapi import FastAPI,HTTPException
+from typing import List, Optional
+from fastapi import BackgroundTasks,FastAPI,HTTPException,Query,Request
 from fastapi.middleware.cors import CORSMiddleware
-from . import models
-from .database import engine
-from .database.repositories import get_all_customers_from_db,get_customer,insert_csv_data_to_table
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Match
+import os
+import time
+from .database import engine, pool_stats, warm_pool
+from .database.repositories import (get_all_customers_from_db,get_customer,insert_csv_data_to_table,ingest_chunk_size,
+                                   get_customer_page, get_fill_values, iter_customer_rows, mark_table_changed)
 from . import churn_service
-from .domain import get_customer_sequence_scaled, predict_churn, predict_churned_customers
-
-def fill_nulls_with_mean(df):
-    """
-    Fill null values in DataFrame with appropriate strategies:
-    - Numeric columns: fill with mean
-    - Categorical columns: fill with mode (most frequent value)
-    - Boolean columns: fill with False
-    """
-    df = df.copy()
-    
-    for column in df.columns:
-        if df[column].dtype in ['int64', 'float64']:
-            # Numeric columns - fill with mean
-            mean_value = df[column].mean()
-            if pd.notna(mean_value):  # Check if mean is not NaN
-                df[column] = df[column].fillna(mean_value)
-            else:
-                # If mean is NaN (all values are null), fill with 0
-                df[column] = df[column].fillna(0)
-        elif df[column].dtype == 'bool':
-            # Boolean columns - fill with False
-            df[column] = df[column].fillna(False)
-        elif df[column].dtype == 'object':
-            # Categorical columns - fill with mode (most frequent value)
-            mode_value = df[column].mode()
-            if len(mode_value) > 0:
-                df[column] = df[column].fillna(mode_value[0])
-            else:
-                # If no mode (all values are unique), fill with 'Unknown'
-                df[column] = df[column].fillna('Unknown')
-    
-    return df
+from .domain import customer_summaries, get_customer_windows, predict_churn_batched, score_raw_windows, score_windows
+from .cache import feature_cache
+from .scores import get_churn_scores, get_churn_scores_page, iter_churn_scores, refresh_in_background, refresh_scores
+from .batching import MicroBatcher
+from . import concurrency
+from .concurrency import run_db, run_inference
+from . import metrics
+from . import payloads
+from . import feature_store
+from . import reloading
+from .payloads import FastJSONResponse
+from .metrics import CallbackMetric, profile_header, request_seconds, requests_total, server_timing, start_profile, stop_profile
 
 app = FastAPI()
+batcher = MicroBatcher(score_windows, executor=concurrency.inference_executor)
+# Most customers one page of /customers, /Churns/ or /customers/{table_name}/summaries may hold
+max_page_limit = int(os.getenv("CHURN_MAX_PAGE_LIMIT", "10000"))
 
 # Add CORS middleware
 app.add_middleware(
@@ -53,85 +38,253 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+CallbackMetric("churn_batch_queue_depth", "Requests waiting for a micro-batch", lambda: batcher.stats()["queue_depth"])
+CallbackMetric("churn_cache_entries", "Customers in the feature cache", lambda: feature_cache.stats()["entries"])
+CallbackMetric("churn_cache_bytes", "Bytes held by the feature cache", lambda: feature_cache.stats()["bytes"])
+CallbackMetric("churn_cache_hits_total", "Feature cache hits", lambda: feature_cache.hits, kind="counter")
+CallbackMetric("churn_cache_misses_total", "Feature cache misses", lambda: feature_cache.misses, kind="counter")
+CallbackMetric("churn_db_connections_checked_out", "Database connections in use",
+               lambda: pool_stats().get("checked_out", 0))
+
+def route_path(request):
+    """The route template a request matched, so metrics get one series per endpoint rather than per URL"""
+    for route in app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+@app.middleware("http")
+async def record_request(request, call_next):
+    """Count and time every request; with the profile header, return its stage timings as Server-Timing"""
+    profile, token = start_profile() if request.headers.get(profile_header) == "1" else (None, None)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        seconds = time.perf_counter() - start
+        if token is not None:
+            stop_profile(token)
+        route = route_path(request)
+        request_seconds.observe(seconds, method=request.method, route=route)
+        requests_total.inc(method=request.method, route=route, status=status)
+    if profile is not None:
+        profile["total"] = seconds
+        response.headers["Server-Timing"] = server_timing(profile)
+    return response
+
 @app.on_event("startup")
 async def startup_event():
-    models.Base.metadata.create_all(bind=engine)
-    churn_service.load_model()
+    # Model, scaler and database connections are ready before the first request; under
+    # churn_service.serve the model was loaded before the workers were forked
+    if churn_service.serving.model is None:
+        churn_service.load_model()
+    reloading.install_signal_handler()
+    await run_db(warm_pool)
+    await batcher.start()
+    for table_name in feature_store.feature_store_tables:
+        await run_db(feature_store.get_store, table_name)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await batcher.stop()
+    await run_db(feature_store.save_stores)
+    concurrency.shutdown()
     
 @app.post("/create_table")
-async def create_table(table_name: str, csv_file_path: str):
+async def create_table(table_name: str, csv_file_path: str, background_tasks: BackgroundTasks,
+                       chunksize: Optional[int] = ingest_chunk_size):
     #
     # models.create_table_from_csv(csv_file_path, table_name, engine)
-    insert_csv_data_to_table(csv_file_path, table_name, engine)
-    return {"message": "Table created successfully"}
+    load = await run_db(insert_csv_data_to_table, csv_file_path, table_name, engine, chunksize)
+    feature_store.drop_store(table_name)
+    # The load dropped the table's scores; /Churns/ serves them again once this is done
+    background_tasks.add_task(refresh_in_background, [table_name])
+    return {"message": "Table created successfully", **load}
 
 
-@app.get("/customers")
-async def get_customers():
-    """Get all customers"""
+def read_customers():
     df = pd.read_sql("SELECT * FROM ecommerce", engine)
     print(df.head())
     
-    # Fill null values with appropriate strategies
-    df = fill_nulls_with_mean(df)
+    # Fill null values with the column means and modes stored at ingest, in place
+    df.fillna(get_fill_values("ecommerce"), inplace=True)
     
     return df.to_dict('records')
 
+def read_customer_page(table_name, cursor, limit):
+    df = get_customer_page(table_name, cursor, limit)
+    df.fillna(get_fill_values(table_name), inplace=True)
+    # Pages are whole customers, a full page means there may be more after its last customer
+    next_cursor = int(df["Customer ID"].iat[-1]) if not df.empty and df["Customer ID"].nunique() == limit else None
+    return {"items": df.to_dict('records'), "next_cursor": next_cursor}
+
+def stream_customer_rows(table_name, cursor):
+    fill_values = get_fill_values(table_name)
+    for chunk in iter_customer_rows(table_name, cursor):
+        chunk.fillna(fill_values, inplace=True)
+        # pandas ends the lines with a newline in some versions and not in others
+        yield chunk.to_json(orient='records', lines=True, date_format='iso').rstrip("\n") + "\n"
 
+def stream_churn_scores(table_name, cursor):
+    for customer_id, predictions in iter_churn_scores(table_name, cursor):
+        yield payloads.json_dumps({"customer_id": customer_id, **predictions}) + b"\n"
+
+@app.get("/customers")
+async def get_customers(cursor: Optional[int] = None, limit: Optional[int] = Query(None, ge=1, le=max_page_limit),
+                        stream: bool = False):
+    """
+    Get all customers. With limit, returns the rows of the next limit customers after cursor and
+    the cursor of the page after; with stream, sends every row after cursor as NDJSON.
+    """
+    if stream:
+        return StreamingResponse(stream_customer_rows("ecommerce", cursor), media_type="application/x-ndjson")
+    if limit is not None:
+        return await run_db(read_customer_page, "ecommerce", cursor, limit)
+    return await run_db(read_customers)
+
+
+
+@app.get("/customers/{table_name}/summaries")
+async def get_customer_summaries(table_name: str, customer_id: Optional[List[int]] = Query(None),
+                                 cursor: Optional[int] = None,
+                                 limit: Optional[int] = Query(None, ge=1, le=max_page_limit)):
+    """
+    The /data summary of many customers in one call: those given as customer_id (repeatable),
+    or else the next limit customers after cursor, or every customer.
+    """
+    return await run_db(customer_summaries, table_name, customer_id, cursor, limit)
 
 @app.get("/customers/{table_name}/{customer_id}")
 async def get_customer_by_id(customer_id: int,table_name:str):
-    return get_customer(customer_id,table_name).to_dict('records')
+    df = await run_db(get_customer, customer_id, table_name)
+    return df.to_dict('records')
 
 @app.get("/customers/{table_name}/{customer_id}/data")
 async def get_customer_aggregated_data(customer_id: int,table_name:str):
-    x = get_customer(customer_id, table_name)
-    # Example: create a custom JSON response with selected fields
-    totalSpent = 0
-    # Find the latest purchase date for the customer by comparing timestamps
-    for i in range(len(x)):
-        totalSpent += x.iloc[0]['Product Price']* x.iloc[0]['Quantity']
-    last_purchase = "null"
-    last_purchase_date = None
-    if "Purchase Date" in x.columns:
-        # Convert to datetime if not already
-        x["Purchase Date"] = pd.to_datetime(x["Purchase Date"], errors="coerce")
-        last_purchase_date = x.loc[x["Purchase Date"].idxmax()]['Purchase Date'] if not x["Purchase Date"].isnull().all() else x.iloc[0]["Purchase Date"]
-    # Calculate days since last purchase
-
-    days_since_last_purchase = None
-    if last_purchase_date != None:
-        try:
-            now = datetime.now()
-            days_since_last_purchase = (now - last_purchase_date).days
-        except Exception:
-            days_since_last_purchase = 0
-
-    if not x.empty:
-        customer_data = x.iloc[0].to_dict()
-        custom_json = {
-            "id": customer_data.get("Customer ID"),
-            "name": customer_data.get("Customer Name"),
-            "email": customer_data.get("Customer Name").lower().replace(" ","") + "@gmail.com",
-            "totalSpent": str(totalSpent),
-            "last_purchase_date": str(days_since_last_purchase),
-        }
-        return custom_json
-    else:
-        return {"error": "Customer not found"}
+    summaries = await run_db(customer_summaries, table_name, [customer_id])
+    if not summaries:
+        raise HTTPException(status_code=404, detail=f"customer {customer_id} not found")
+    return summaries[0]
+
+@app.post("/customers/{table_name}/{customer_id}/purchases")
+async def add_customer_purchase(customer_id: int, table_name: str, purchase: churn_service.PurchaseInput):
+    """
+    Record a new purchase of the customer and return the prediction of their newest window, scored
+    from the online feature store without rereading their history (see feature_store.py)
+    """
+    return await run_db(feature_store.append_purchase, customer_id, table_name, purchase.csv_row())
+
+@app.get("/customers/{table_name}/{customer_id}/latest")
+async def get_latest_prediction(customer_id: int, table_name: str):
+    """The prediction of the customer's newest window, from the online feature store"""
+    return await run_db(feature_store.score_newest_window, customer_id, table_name)
 
 @app.get("/customers/all/{table_name}/")
 async def get_all_customers(table_name:str):
-    return get_all_customers_from_db(table_name).to_dict('records')
+    df = await run_db(get_all_customers_from_db, table_name)
+    return df.to_dict('records')
+
+@app.get("/Churns/", response_class=FastJSONResponse)
+def get_churned_customers(table_name, cursor: Optional[int] = None,
+                          limit: Optional[int] = Query(None, ge=1, le=max_page_limit), stream: bool = False,
+                          columnar: bool = False):
+    """
+    Predictions of every customer. With limit, returns the next limit customers after cursor and
+    the cursor of the page after; with stream, sends one NDJSON line per customer after cursor.
+    With columnar, the predictions are parallel arrays with one entry per window and confidence
+    as codes into confidence_levels.
+    """
+    if stream:
+        return StreamingResponse(stream_churn_scores(table_name, cursor), media_type="application/x-ndjson")
+    if limit is not None:
+        return FastJSONResponse(get_churn_scores_page(table_name, cursor, limit, columnar))
+    return FastJSONResponse(get_churn_scores(table_name, columnar))
 
-@app.get("/Churns/")
-def get_churned_customers(table_name):
-    return predict_churned_customers(table_name)
+@app.post("/scores/refresh")
+async def refresh_churn_scores(table_name: str, incremental: bool = True):
+    """Rescore the customers of table_name into the precomputed scores table that /Churns/ reads"""
+    return await run_db(refresh_scores, table_name, incremental)
 
 @app.get("/customers/{table_name}/{customer_id}/sequence")
 async def get_customer_sequence(customer_id: int, table_name: str):
-    return get_customer_sequence_scaled(customer_id, table_name)
+    entry = await run_db(get_customer_windows, customer_id, table_name)
+    return entry.windows.reshape(len(entry.windows), -1).tolist(), entry.labels.tolist()
+
+@app.get("/customers_predicts/{customer_id}", response_class=FastJSONResponse)
+async def predictChurn(customer_id: int, columnar: bool = False):
+    return FastJSONResponse(await predict_churn_batched(customer_id, "ecommerce", batcher, columnar))
+
+@app.post("/predict/batch")
+async def predict_batch(request: Request):
+    """
+    Score windows sent in the body instead of looked up by customer: ChurnPredictionInput records
+    as JSON, raw little-endian float32 or Arrow IPC (see payloads.py). The results come back as
+    parallel arrays in the request's format.
+    """
+    content_type = payloads.media_type(request.headers.get("content-type"))
+    body = await request.body()
+    batch = await run_inference(payloads.decode, body, content_type)
+    serving = churn_service.serving
+    probabilities = await run_inference(score_raw_windows, batch.windows, batch.positions, batch.lengths,
+                                        serving=serving)
+    content = await run_inference(payloads.encode, batch, probabilities, content_type, serving.model_version)
+    return Response(content, media_type=content_type,
+                    headers={"X-Churn-Model-Version": str(serving.model_version)})
+
+@app.get("/model")
+async def get_model():
+    """The model this worker is serving"""
+    serving = churn_service.serving
+    return {"model_version": serving.model_version, "backend": serving.inference_backend,
+            "length_aware": churn_service.length_aware, "pid": os.getpid()}
 
-@app.get("/customers_predicts/{customer_id}")
-async def predictChurn(customer_id: int):
-    return predict_churn(customer_id, "ecommerce")
+@app.post("/model/reload")
+async def reload_model(background_tasks: BackgroundTasks, max_change: Optional[float] = None):
+    """
+    Load the model again in the background, check it on the probe batch and swap it in while
+    requests keep flowing (see reloading.py). Under churn_service.serve every worker reloads.
+    The precomputed scores are then refreshed with the new model.
+    """
+    result = await run_db(reloading.reload_model, max_change)
+    if result["reloaded"]:
+        reloading.notify_workers()
+        background_tasks.add_task(refresh_in_background)
+    return result
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Every metric in the Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/metrics/batching")
+async def get_batching_metrics():
+    return batcher.stats()
+
+@app.get("/metrics/pool")
+async def get_pool_metrics():
+    return pool_stats()
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    return feature_cache.stats()
+
+@app.get("/feature_store/stats")
+async def get_feature_store_stats():
+    return feature_store.feature_store_stats()
+
+@app.post("/feature_store/{table_name}/snapshot")
+async def snapshot_feature_store(table_name: str):
+    """Write the table's online feature store to disk, so a restart loads it instead of rebuilding it"""
+    return await run_db(feature_store.save_store, table_name)
+
+@app.delete("/cache")
+async def purge_cache(table_name: Optional[str] = None):
+    """
+    Drop the cached windows and predictions of one table, or of every table. This worker's are
+    dropped now, the other workers' at their next feature_cache.sync.
+    """
+    await run_db(mark_table_changed, table_name)
+    return {"purged": feature_cache.invalidate(table_name)}
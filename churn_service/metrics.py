@@ -0,0 +1,168 @@
+"""
+Latency spans and Prometheus metrics.
+
+`with span("stage"):` times one stage of the scoring or ingest pipeline into the
+churn_stage_seconds histogram, and into the current request's profile when the client sent
+the X-Churn-Profile: 1 header (main.py returns it as a Server-Timing header). render() writes
+every registered metric in the Prometheus text format served on /metrics.
+"""
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+latency_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+size_buckets = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+profile_header = "X-Churn-Profile"
+
+registry = []
+_profile = contextvars.ContextVar("churn_profile", default=None)
+
+
+def format_labels(pairs):
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def lines(self):
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{format_labels(list(zip(self.labelnames, key)))} {value}" for key, value in values]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=latency_buckets):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # Per label values: the count of each bucket (not cumulative), the sum and the count
+        self._series = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def lines(self):
+        with self._lock:
+            series = [(key, list(counts), total, count) for key, (counts, total, count) in self._series.items()]
+        lines = []
+        for key, counts, total, count in series:
+            pairs = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{format_labels(pairs + [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_bucket{format_labels(pairs + [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{format_labels(pairs)} {total}")
+            lines.append(f"{self.name}_count{format_labels(pairs)} {count}")
+        return lines
+
+
+class CallbackMetric:
+    """A gauge or counter whose value is read from another component's stats when scraped"""
+
+    def __init__(self, name, help, read, kind="gauge"):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.read = read
+        registry.append(self)
+
+    def lines(self):
+        return [f"{self.name} {self.read()}"]
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.lines())
+    return "\n".join(lines) + "\n"
+
+
+stage_seconds = Histogram("churn_stage_seconds", "Time spent in each stage of the scoring and ingest pipelines", ["stage"])
+request_seconds = Histogram("churn_request_seconds", "HTTP request latency", ["method", "route"])
+requests_total = Counter("churn_requests_total", "HTTP requests served", ["method", "route", "status"])
+batch_windows = Histogram("churn_batch_windows", "Windows per micro-batched forward pass", buckets=size_buckets)
+batch_requests = Histogram("churn_batch_requests", "Requests per micro-batched forward pass", buckets=size_buckets)
+rows_scanned = Counter("churn_rows_scanned_total", "Purchase rows read from the database for scoring", ["query"])
+rows_ingested = Counter("churn_rows_ingested_total", "Purchase rows loaded by /create_table", ["table"])
+
+
+def record(stage, seconds):
+    stage_seconds.observe(seconds, stage=stage)
+    profile = _profile.get()
+    if profile is not None:
+        profile[stage] = profile.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def span(stage):
+    """Time the enclosed block as stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+
+def timed_iter(iterable, stage):
+    """Yield from iterable, timing each step of the iteration as stage"""
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            record(stage, time.perf_counter() - start)
+        yield item
+
+
+def start_profile():
+    """Collect the spans of the current request (and the threads it hands work to); returns the profile and a reset token"""
+    profile = {}
+    return profile, _profile.set(profile)
+
+
+def stop_profile(token):
+    _profile.reset(token)
+
+
+def server_timing(profile):
+    """A Server-Timing header value with the milliseconds spent in each stage"""
+    return ", ".join(f"{stage};dur={seconds * 1000:.3f}" for stage, seconds in profile.items())
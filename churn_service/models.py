@@ -1,6 +1,6 @@
 import pandas as pd
 from .database import Base
-from sqlalchemy import TIMESTAMP, text,create_engine, MetaData, Table, Column, Integer, String, Float, DateTime, Boolean
+from sqlalchemy import TIMESTAMP, text,create_engine, MetaData, Table, Column, Integer, BigInteger, String, Float, DateTime, Boolean
 from sqlalchemy.dialects.postgresql import UUID
 import uuid
 
@@ -73,5 +73,51 @@ def create_table_from_csv(csv_file_path, table_name, engine):
     
     return table
 
+def churn_scores_table(table_name, metadata=None):
+    """
+    Precomputed predictions for every window of every customer in table_name.
+    last_purchase_date and purchases record the customer's rows when they were scored, so an
+    incremental refresh can tell which customers changed since.
+    """
+    return Table(
+        f"{table_name}_churn_scores", metadata if metadata is not None else MetaData(),
+        Column("customer_id", BigInteger, primary_key=True),
+        Column("window_index", Integer, primary_key=True),
+        Column("churn_probability", Float, nullable=False),
+        Column("churn_prediction", Boolean, nullable=False),
+        Column("confidence", String, nullable=False),
+        Column("actual", Integer),
+        Column("model_version", String),
+        Column("last_purchase_date", DateTime),
+        Column("purchases", Integer),
+        Column("scored_at", DateTime),
+    )
+
+def column_stats_table(table_name, metadata=None):
+    """Fill value of each column of table_name: a mean for numeric columns, a mode for text columns"""
+    return Table(
+        f"{table_name}_column_stats", metadata if metadata is not None else MetaData(),
+        Column("column_name", String, primary_key=True),
+        Column("numeric_value", Float),
+        Column("text_value", String),
+    )
+
+def table_versions_table(metadata=None):
+    """
+    Counters bumped in the database whenever a table is reloaded (loaded and changed) or its rows
+    change (changed), so every worker can tell its in-process copies of the table went stale.
+    scored and scored_model record the changed count and model version its scores table was last
+    refreshed at; refresh_started is set while one worker holds the table's score refresh.
+    """
+    return Table(
+        "churn_table_versions", metadata if metadata is not None else MetaData(),
+        Column("table_name", String, primary_key=True),
+        Column("loaded", Integer, nullable=False),
+        Column("changed", Integer, nullable=False),
+        Column("scored", Integer),
+        Column("scored_model", String),
+        Column("refresh_started", DateTime),
+    )
+
 # Example usage:
 # insert_csv_data_to_table('ecommerce_customer_data_large.csv', 'customer_data', engine)
@@ -0,0 +1,228 @@
+"""
+Request and response bodies of POST /predict/batch, which scores windows an upstream pipeline
+already built, with no database lookup.
+
+A body holds n windows of seq_length x num_features raw (unscaled) feature values, in one of
+    application/json                     ChurnPredictionInput records, [{"customer_id": 1, "sequence_data": [140 values]}, ...],
+                                         or the same fields as parallel arrays, {"customer_id": [...], "sequence_data": [[...], ...]}
+    application/octet-stream             n * 140 little-endian float32 values, window after window
+    application/vnd.apache.arrow.stream  an Arrow IPC stream (or file) with a sequence_data column of
+                                         140-value lists and optional customer_id, position and length columns
+and the results come back as parallel arrays in the same format (raw float32 probabilities for
+application/octet-stream). Windows are decoded into one (n, seq_length, num_features) array
+without touching the values one at a time in Python.
+
+Each window's position (its index among its customer's windows, which the model's positional
+encoding reads) comes from the position column when given, otherwise windows that follow each
+other with the same customer_id are numbered 0, 1, ... as predict_churn numbers them, and
+windows without a customer_id get 0. The columnar JSON and Arrow bodies may also give each
+window's length, its real time steps before the zero padding, which length-aware scoring reads
+(see domain.score_windows); windows are taken to be full-length otherwise.
+
+json_dumps and FastJSONResponse encode large JSON responses (these and /Churns/) with orjson when
+it is installed, from content that is already plain lists and dicts.
+"""
+import io
+import json
+import os
+
+import numpy as np
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from . import churn_service
+from .domain import confidence_codes, confidence_levels, customer_boundaries, prediction_columns
+
+json_type = "application/json"
+binary_type = "application/octet-stream"
+arrow_types = ("application/vnd.apache.arrow.stream", "application/vnd.apache.arrow.file")
+# Largest batch one request may carry; 500,000 windows are 280 MB of float32
+max_batch_windows = int(os.getenv("CHURN_MAX_BATCH_WINDOWS", "500000"))
+
+window_size = churn_service.seq_length * churn_service.num_features
+
+
+def json_dumps(content):
+    """content as compact JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, separators=(",", ":")).encode()
+
+
+def json_loads(body):
+    return orjson.loads(body) if orjson is not None else json.loads(body)
+
+
+class FastJSONResponse(JSONResponse):
+    """A JSONResponse encoded by json_dumps; return it from an endpoint to skip FastAPI's jsonable_encoder"""
+
+    def render(self, content):
+        return json_dumps(content)
+
+
+class Batch:
+    """Decoded windows with their customer ids and lengths (None when the body had none) and positions"""
+
+    def __init__(self, windows, customer_ids=None, positions=None, lengths=None):
+        self.windows = windows
+        self.customer_ids = customer_ids
+        self.positions = positions if positions is not None else default_positions(customer_ids, len(windows))
+        if lengths is not None and len(lengths) and (lengths.min() < 1 or lengths.max() > churn_service.seq_length):
+            raise HTTPException(status_code=400, detail=f"length must be between 1 and {churn_service.seq_length}")
+        self.lengths = lengths
+
+
+def default_positions(customer_ids, n):
+    """Number the windows of each run of equal customer ids 0, 1, ...; all 0 without customer ids"""
+    if customer_ids is None or n == 0:
+        return np.zeros(n, dtype=np.int64)
+    boundaries = customer_boundaries(np.asarray(customer_ids))
+    return np.arange(n) - np.repeat(boundaries[:-1], np.diff(boundaries))
+
+
+def media_type(content_type):
+    """The payload format of a Content-Type header, or a 415 for one we don't read"""
+    content_type = (content_type or json_type).split(";")[0].strip().lower()
+    if content_type in arrow_types:
+        if pa is None:
+            raise HTTPException(status_code=415, detail="Arrow payloads need pyarrow on the server: pip install pyarrow")
+        return arrow_types[0]
+    if content_type in (json_type, binary_type):
+        return content_type
+    raise HTTPException(status_code=415, detail=f"Unsupported Content-Type '{content_type}', expected "
+                                                f"{json_type}, {binary_type} or {arrow_types[0]}")
+
+
+def to_windows(values, n):
+    """(n, seq_length, num_features) float32 windows the caller owns, so scale_windows may scale them in place"""
+    if n > max_batch_windows:
+        raise HTTPException(status_code=413, detail=f"{n} windows in one request, the limit is {max_batch_windows}")
+    values = np.asarray(values, dtype=np.float32)
+    if values.size != n * window_size:
+        raise HTTPException(status_code=400, detail=f"Expected {window_size} values in each sequence_data, "
+                                                    f"got {values.size} for {n} sequences")
+    windows = values.reshape(n, churn_service.seq_length, churn_service.num_features)
+    # Buffers of the request body and Arrow columns are read-only
+    return windows if windows.flags.writeable and windows.flags.c_contiguous else windows.copy()
+
+
+def integer_column(values, name, n):
+    if values is None:
+        return None
+    values = np.asarray(values)
+    if len(values) != n or (n and values.dtype.kind not in "iu"):
+        raise HTTPException(status_code=400, detail=f"{name} must hold one integer for each sequence")
+    return values.astype(np.int64)
+
+
+def decode_json(body):
+    try:
+        payload = json_loads(body)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON body: {e}")
+    if isinstance(payload, dict):
+        sequences, customer_ids, positions = payload.get("sequence_data"), payload.get("customer_id"), payload.get("position")
+        lengths = payload.get("length")
+        if not isinstance(sequences, list):
+            raise HTTPException(status_code=400, detail="sequence_data must be a list of sequences")
+    elif isinstance(payload, list):
+        try:
+            sequences = [record["sequence_data"] for record in payload]
+        except (KeyError, TypeError):
+            raise HTTPException(status_code=400, detail="Every ChurnPredictionInput record needs sequence_data")
+        customer_ids = [record.get("customer_id") for record in payload]
+        positions = lengths = None
+    else:
+        raise HTTPException(status_code=400, detail="Expected a list of ChurnPredictionInput records or an object of columns")
+    n = len(sequences)
+    if customer_ids is not None and any(customer_id is None for customer_id in customer_ids):
+        if isinstance(payload, dict):
+            raise HTTPException(status_code=400, detail="customer_id must hold one integer for each sequence")
+        customer_ids = None
+    try:
+        values = np.array(sequences, dtype=np.float32)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail=f"Every sequence_data must hold {window_size} numbers")
+    return Batch(to_windows(values, n), integer_column(customer_ids, "customer_id", n),
+                 integer_column(positions, "position", n), integer_column(lengths, "length", n))
+
+
+def decode_binary(body):
+    if len(body) % (window_size * 4):
+        raise HTTPException(status_code=400, detail=f"Body of {len(body)} bytes is not a whole number of "
+                                                    f"{window_size}-value float32 sequences")
+    return Batch(to_windows(np.frombuffer(body, dtype="<f4"), len(body) // (window_size * 4)))
+
+
+def decode_arrow(body):
+    try:
+        try:
+            table = pa.ipc.open_stream(body).read_all()
+        except pa.ArrowInvalid:
+            table = pa.ipc.open_file(pa.BufferReader(body)).read_all()
+    except pa.ArrowInvalid as e:
+        raise HTTPException(status_code=400, detail=f"Invalid Arrow IPC body: {e}")
+    if "sequence_data" not in table.column_names:
+        raise HTTPException(status_code=400, detail="The Arrow table needs a sequence_data column")
+    n = table.num_rows
+    sequences = table.column("sequence_data").combine_chunks()
+    if not (pa.types.is_list(sequences.type) or pa.types.is_fixed_size_list(sequences.type)
+            or pa.types.is_large_list(sequences.type)) or sequences.null_count:
+        raise HTTPException(status_code=400, detail="sequence_data must be a column of numeric lists")
+    if not pa.types.is_fixed_size_list(sequences.type) and np.any(np.diff(sequences.offsets.to_numpy()) != window_size):
+        raise HTTPException(status_code=400, detail=f"Every sequence_data must hold {window_size} numbers")
+    # The list's child values, all windows back to back
+    values = sequences.flatten().to_numpy(zero_copy_only=False)
+
+    def column(name):
+        if name not in table.column_names:
+            return None
+        if table.column(name).null_count:
+            raise HTTPException(status_code=400, detail=f"{name} must hold one integer for each sequence")
+        return table.column(name).to_numpy()
+    return Batch(to_windows(values, n), integer_column(column("customer_id"), "customer_id", n),
+                 integer_column(column("position"), "position", n), integer_column(column("length"), "length", n))
+
+
+decoders = {json_type: decode_json, binary_type: decode_binary, arrow_types[0]: decode_arrow}
+
+
+def decode(body, content_type):
+    return decoders[content_type](body)
+
+
+def encode(batch, probabilities, content_type, model_version=None):
+    """The response body of probabilities for a batch, in content_type, tagged with the model_version that scored them"""
+    if content_type == binary_type:
+        return probabilities.astype("<f4").tobytes()
+    if content_type == json_type:
+        return json_dumps({
+            "model_version": model_version,
+            "customer_id": batch.customer_ids.tolist() if batch.customer_ids is not None else None,
+            "position": batch.positions.tolist(),
+            **prediction_columns(probabilities),
+            "confidence_levels": confidence_levels,
+        })
+    columns = {
+        "position": pa.array(batch.positions),
+        "churn_probability": pa.array(probabilities),
+        "churn_prediction": pa.array(probabilities > 0.5),
+        "confidence": pa.DictionaryArray.from_arrays(confidence_codes(probabilities), list(confidence_levels)),
+    }
+    if batch.customer_ids is not None:
+        columns = {"customer_id": pa.array(batch.customer_ids), **columns}
+    table = pa.table(columns).replace_schema_metadata({"model_version": str(model_version)})
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
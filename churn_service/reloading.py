@@ -0,0 +1,137 @@
+"""
+Zero-downtime model reload. POST /model/reload, or SIGHUP, loads the model bundle
+(CHURN_MODEL_BUNDLE, or best_model.pth and scaler.pkl when there is none) again on a database
+thread while requests keep being scored by the running model. Replace the bundle to deploy a new
+model: a best_model.pth or scaler.pkl newer than the bundle fails the reload with a 422 asking
+for the bundle to be rebuilt, rather than reloading the old bundle as the same version. The new model is checked on a fixed probe batch and then swapped in with
+churn_service.install_model. Under churn_service.serve, the worker that handles the request
+tells the parent, which sends SIGHUP to every worker. A worker already running the bundle's
+version skips it.
+
+The model, scaler and version are swapped in as one churn_service.Serving, so a request scores
+with one model's parts even when a reload lands in the middle of it. Cached predictions are tied
+to the model that made them and cached windows to the scaler that scaled them, so they are
+recomputed after a swap; the windows are dropped when the scaler changes.
+The precomputed scores are then rescored in the background by one of the workers,
+incrementally, for the customers whose model_version differs.
+"""
+import asyncio
+import os
+import signal
+import threading
+
+import numpy as np
+import torch
+from fastapi import HTTPException
+
+from . import churn_service
+from .cache import feature_cache
+from .concurrency import run_db
+from .scores import refresh_in_background
+
+probe_windows = 64
+_reload_lock = threading.Lock()
+_background = set()
+
+
+def probe_batch(n=probe_windows, seed=0):
+    """The fixed probe batch: scaled windows drawn around the training mean, with their positions"""
+    rng = np.random.default_rng(seed)
+    windows = rng.standard_normal((n, churn_service.seq_length, churn_service.num_features)).astype(np.float32)
+    return torch.from_numpy(windows), torch.arange(n) % 16
+
+
+def probe(model):
+    """The probe batch's probabilities under model"""
+    windows, positions = probe_batch()
+    with torch.no_grad():
+        return model(windows, positions).reshape(-1).numpy().astype(np.float64)
+
+
+def check_model(loaded):
+    """Score the probe batch with a read_model result; raises ValueError when it is unfit to serve"""
+    model, scaler, version, _ = loaded
+    probabilities = probe(model)
+    if probabilities.shape != (probe_windows,):
+        raise ValueError(f"model {version} gave {probabilities.shape} probabilities for {probe_windows} probe windows")
+    if not np.all(np.isfinite(probabilities)) or probabilities.min() < 0 or probabilities.max() > 1:
+        raise ValueError(f"model {version} gave probabilities outside [0, 1] on the probe batch")
+    if not np.array_equal(probabilities, probe(model)):
+        raise ValueError(f"model {version} scores the probe batch differently each time")
+    if churn_service.serving.scaler is not None and scaler is None:
+        raise ValueError(f"model {version} comes without a scaler")
+    if scaler is not None and not (np.all(np.isfinite(scaler.mean_)) and np.all(scaler.scale_ > 0)):
+        raise ValueError(f"model {version} has a scaler with non-finite means or non-positive scales")
+    return probabilities
+
+
+def same_scaler(a, b):
+    if a is None or b is None:
+        return a is b
+    return np.array_equal(a.mean_, b.mean_) and np.array_equal(a.scale_, b.scale_)
+
+
+def reload_model(max_change=None):
+    """
+    Load the model again, check it on the probe batch and swap it in. With max_change, a model
+    whose probe probabilities move by more than that on average from the running model's is refused.
+    """
+    if not _reload_lock.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="A model reload is already in progress")
+    try:
+        running = churn_service.serving
+        previous_version = running.model_version
+        try:
+            loaded = churn_service.read_model(running.inference_backend)
+            if loaded.model_version == previous_version:
+                return {"reloaded": False, "model_version": previous_version, "pid": os.getpid()}
+            probabilities = check_model(loaded)
+            change = None
+            if running.model is not None:
+                change = float(np.abs(probabilities - probe(running.model)).mean())
+                if max_change is not None and change > max_change:
+                    raise ValueError(f"model {loaded.model_version} moves the probe probabilities by {change:.4f} "
+                                     f"on average, more than {max_change}")
+        except (OSError, RuntimeError, ValueError) as e:
+            print(f"Model reload failed, still serving {previous_version}: {e}")
+            raise HTTPException(status_code=422, detail=f"Model reload failed: {e}")
+        scaler_changed = not same_scaler(loaded.scaler, running.scaler)
+        churn_service.install_model(loaded)
+        if scaler_changed:
+            feature_cache.invalidate()
+        print(f"Model {loaded.model_version} swapped in for {previous_version}")
+        return {"reloaded": True, "model_version": loaded.model_version, "previous_version": previous_version,
+                "probe_mean_change": change, "scaler_changed": scaler_changed, "pid": os.getpid()}
+    finally:
+        _reload_lock.release()
+
+
+def notify_workers():
+    """Under churn_service.serve, ask the parent to reload every worker"""
+    parent = os.getenv("CHURN_SERVE_PARENT")
+    if parent and int(parent) == os.getppid():
+        os.kill(int(parent), signal.SIGHUP)
+
+
+async def reload_in_background():
+    try:
+        result = await run_db(reload_model)
+    except HTTPException as e:
+        print(f"Model reload skipped: {e.detail}")
+        return
+    if result["reloaded"]:
+        # The first worker to get here rescores; the others find the refresh taken
+        await refresh_in_background()
+
+
+def install_signal_handler():
+    """Reload the model on SIGHUP; only the main thread's event loop can take signals"""
+    if not hasattr(signal, "SIGHUP") or threading.current_thread() is not threading.main_thread():
+        return
+
+    def on_sighup():
+        # Held until done, the event loop only keeps weak references to its tasks
+        task = asyncio.ensure_future(reload_in_background())
+        _background.add(task)
+        task.add_done_callback(_background.discard)
+    asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, on_sighup)
@@ -0,0 +1,115 @@
+"""
+Inference backends for ChurnModel.
+
+load_model builds the eager model from the checkpoint and hands it to build_runtime, which
+returns what domain.score_windows calls as model(windows, positions). CHURN_MODEL_BACKEND picks:
+    eager, eager-int8, torchscript, torchscript-int8, onnx, onnx-int8
+The -int8 variants dynamically quantize the Linear layers (weights int8, activations quantized
+on the fly). TorchScript and ONNX artifacts are written once per checkpoint version under
+CHURN_ARTIFACT_DIR; export them ahead of a deployment from the repository root with
+    python -m churn_service.runtime --backend torchscript-int8 onnx
+or let the first load_model export them.
+"""
+import argparse
+import os
+
+import torch
+import torch.nn as nn
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+from . import churn_service
+
+backends = ("eager", "eager-int8", "torchscript", "torchscript-int8", "onnx", "onnx-int8")
+model_backend = os.getenv("CHURN_MODEL_BACKEND", "eager")
+artifact_dir = os.getenv("CHURN_ARTIFACT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "artifacts"))
+onnx_opset = 17
+
+
+class OnnxChurnModel:
+    """An ONNX Runtime session behind the same model(windows, positions) call as ChurnModel"""
+
+    def __init__(self, path):
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = torch.get_num_threads()
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+    def __call__(self, windows, positions=None):
+        if positions is None:
+            positions = torch.arange(len(windows))
+        inputs = {"windows": windows.contiguous().numpy(), "positions": positions.to(torch.long).numpy()}
+        return torch.from_numpy(self.session.run(None, inputs)[0])
+
+
+def quantize(model):
+    """Copy of model with every nn.Linear dynamically quantized to int8"""
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+def example_inputs(batch_size=4):
+    windows = torch.randn(batch_size, churn_service.seq_length, churn_service.num_features)
+    return windows, torch.arange(batch_size)
+
+
+def artifact_path(backend, version, directory=None):
+    extension = "onnx" if backend.startswith("onnx") else "pt"
+    return os.path.join(directory or artifact_dir, f"churn_model-{version}-{backend}.{extension}")
+
+
+def export(model, backend, path):
+    """Write model as backend's artifact at path; the file only appears once it is complete"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = f"{path}.{os.getpid()}.partial"
+    windows, positions = example_inputs()
+    if backend.startswith("torchscript"):
+        module = quantize(model) if backend.endswith("-int8") else model
+        with torch.no_grad():
+            torch.jit.trace(module, (windows, positions)).save(partial)
+    elif backend == "onnx":
+        # Batch size is the only dynamic dimension; positions stays a model input
+        torch.onnx.export(model, (windows, positions), partial, opset_version=onnx_opset, dynamo=False,
+                          input_names=["windows", "positions"], output_names=["probability"],
+                          dynamic_axes={"windows": {0: "batch"}, "positions": {0: "batch"}, "probability": {0: "batch"}})
+    else:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        fp32_path = path.replace("onnx-int8", "onnx")
+        if not os.path.exists(fp32_path):
+            export(model, "onnx", fp32_path)
+        quantize_dynamic(fp32_path, partial, weight_type=QuantType.QInt8)
+    os.replace(partial, path)
+
+
+def build_runtime(model, backend=model_backend, version=None, directory=None):
+    """What to run for backend given the eager model, exporting its artifact if there is none yet"""
+    if backend not in backends:
+        raise ValueError(f"Unknown model backend '{backend}', expected one of {', '.join(backends)}")
+    if backend == "eager":
+        return model
+    if backend == "eager-int8":
+        return quantize(model)
+    if backend.startswith("onnx") and onnxruntime is None:
+        raise RuntimeError("the onnx backends need onnxruntime: pip install onnx onnxruntime")
+    path = artifact_path(backend, version, directory)
+    if not os.path.exists(path):
+        export(model, backend, path)
+    if backend.startswith("torchscript"):
+        return torch.jit.load(path).eval()
+    return OnnxChurnModel(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", nargs="+", choices=backends[2:], default=["torchscript"])
+    args = parser.parse_args()
+    churn_service.load_model(backend="eager")
+    serving = churn_service.serving
+    for backend in args.backend:
+        build_runtime(serving.model, backend, serving.model_version)
+        print(f"{backend}: {artifact_path(backend, serving.model_version)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""
+Precomputed churn scores.
+
+Every window of every customer is scored into <table>_churn_scores, which /Churns/ reads
+instead of running the model on each page load. Reloading a table drops its scores, and
+/create_table and model reloads start a refresh in the background; /Churns/ only reads, and
+answers 503 until a table's first refresh is done. Purchases appended since are scored by the
+next refresh, run nightly from the repository root or with POST /scores/refresh:
+    python -m churn_service.scores --table ecommerce              # rescore everything
+    python -m churn_service.scores --table ecommerce --incremental
+"""
+import argparse
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from fastapi import HTTPException
+from sqlalchemy import inspect, delete
+
+from . import churn_service
+from .database import engine
+from .database.bulk_load import write_frame
+from .concurrency import run_db
+from .database.repositories import (claim_scores_refresh, get_customer_markers, get_customers_by_ids,
+                                    get_customers_in_range, get_score_markers, get_scored_tables, get_scores,
+                                    get_scores_page, get_scores_version, iter_scores, release_scores_refresh)
+from .domain import (confidence_bands, confidence_levels, customer_boundaries, inference_batch_size, score_customers,
+                     scoring_chunk_size)
+from .models import churn_scores_table
+
+# A worker's claim on a table's score refresh (see claim_scores_refresh) lapses after this long
+refresh_lease_seconds = float(os.getenv("CHURN_SCORES_LEASE_SECONDS", "3600"))
+
+
+def score_rows(df, markers, scored_at, serving, batch_size=inference_batch_size):
+    """Score the customers in df with serving and lay the results out as rows of the scores table"""
+    customer_ids, probabilities, labels, positions, offsets = score_customers(df, batch_size, serving)
+    rows = pd.DataFrame({
+        "customer_id": np.repeat(customer_ids, np.diff(offsets)),
+        "window_index": positions,
+        "churn_probability": probabilities.astype(np.float64),
+        "churn_prediction": probabilities > 0.5,
+        "confidence": confidence_bands(probabilities),
+        "actual": labels,
+        "model_version": serving.model_version,
+    })
+    customer_markers = markers.loc[rows["customer_id"]]
+    rows["last_purchase_date"] = customer_markers["last_purchase_date"].to_numpy()
+    rows["purchases"] = customer_markers["purchases"].to_numpy()
+    rows["scored_at"] = scored_at
+    return rows
+
+
+def changed_customers(markers, scores, model_version):
+    """Customers whose rows or model version differ from when they were scored, and customers that are gone"""
+    scored = get_score_markers(scores.name).set_index("customer_id")
+    current = markers.join(scored, rsuffix="_scored", how="left")
+    changed = ((current["last_purchase_date"] != current["last_purchase_date_scored"])
+               | (current["purchases"] != current["purchases_scored"])
+               | (current["model_version"] != model_version))
+    return current.index[changed].to_numpy(), scored.index.difference(markers.index).to_numpy()
+
+
+def refresh_scores(table_name, incremental=False, chunk_size=scoring_chunk_size, batch_size=inference_batch_size):
+    """
+    Score table_name into its scores table. A full refresh replaces every score in one transaction;
+    an incremental one rescores only changed customers, chunk_size customers per transaction.
+    One worker refreshes a table at a time, the others get a 409.
+    Returns how many customers were rescored and removed.
+    """
+    if churn_service.serving.model is None:
+        churn_service.load_model()
+    # Read once, so a hot reload during the refresh does not mix two models' scores
+    serving = churn_service.serving
+    if not claim_scores_refresh(table_name, refresh_lease_seconds):
+        raise HTTPException(status_code=409, detail=f"A score refresh of {table_name} is already running")
+    scored = None
+    try:
+        # Read before the rows, so changes made during the refresh leave the scores stale
+        changed = get_scores_version(table_name)[0]
+        result = score_into_table(table_name, serving, incremental, chunk_size, batch_size)
+        scored = changed
+        return result
+    finally:
+        release_scores_refresh(table_name, scored, serving.model_version)
+
+
+def score_into_table(table_name, serving, incremental, chunk_size, batch_size):
+    scores = churn_scores_table(table_name)
+    scores.create(engine, checkfirst=True)
+    markers = get_customer_markers(table_name).set_index("customer_id")
+    scored_at = datetime.now()
+
+    if not incremental:
+        all_ids = markers.index.to_numpy()
+        with engine.begin() as connection:
+            connection.execute(delete(scores))
+            for start in range(0, len(all_ids), chunk_size):
+                chunk_ids = all_ids[start:start + chunk_size]
+                df = get_customers_in_range(int(chunk_ids[0]), int(chunk_ids[-1]), table_name)
+                write_frame(score_rows(df, markers, scored_at, serving, batch_size), scores.name, connection)
+        return {"rescored": len(all_ids), "removed": 0}
+
+    changed, removed = changed_customers(markers, scores, serving.model_version)
+    with engine.begin() as connection:
+        connection.execute(delete(scores).where(scores.c.customer_id.in_([int(i) for i in removed])))
+    for start in range(0, len(changed), chunk_size):
+        chunk_ids = changed[start:start + chunk_size]
+        rows = score_rows(get_customers_by_ids(chunk_ids, table_name), markers, scored_at, serving, batch_size)
+        with engine.begin() as connection:
+            connection.execute(delete(scores).where(scores.c.customer_id.in_([int(i) for i in chunk_ids])))
+            write_frame(rows, scores.name, connection)
+    return {"rescored": len(changed), "removed": len(removed)}
+
+
+def scores_to_predictions(df):
+    """Group scores rows (ordered by customer, window) into a per-customer {customer_id: {"prediction": [...], "actual": [...]}}"""
+    if df.empty:
+        return {}
+    customer_ids = df["customer_id"].tolist()
+    actual = df["actual"].tolist()
+    rows = [{"customer_id": customer_id, "churn_probability": probability, "churn_prediction": prediction,
+             "confidence": confidence}
+            for customer_id, probability, prediction, confidence in zip(
+                customer_ids, df["churn_probability"].round(4).tolist(), df["churn_prediction"].astype(bool).tolist(),
+                df["confidence"].tolist())]
+    boundaries = customer_boundaries(df["customer_id"].to_numpy()).tolist()
+    return {customer_ids[start]: {"prediction": rows[start:stop], "actual": actual[start:stop]}
+            for start, stop in zip(boundaries[:-1], boundaries[1:])}
+
+
+def scores_to_columns(df):
+    """
+    Scores rows as parallel arrays, one entry per window ordered by customer then window, with
+    confidence as codes into confidence_levels: the columnar shape of scores_to_predictions.
+    """
+    return {
+        "customer_id": df["customer_id"].tolist(),
+        "churn_probability": df["churn_probability"].round(4).tolist(),
+        "churn_prediction": df["churn_prediction"].astype(bool).tolist(),
+        "confidence": pd.Categorical(df["confidence"], categories=confidence_levels).codes.tolist(),
+        "confidence_levels": confidence_levels,
+        "actual": df["actual"].tolist(),
+    }
+
+
+def scores_are_current(table_name):
+    """Whether table_name's scores were refreshed after its last change, by the serving model"""
+    changed, scored, scored_model = get_scores_version(table_name)
+    return scored == changed and scored_model == churn_service.serving.model_version
+
+
+def refresh_stale_scores(table_name):
+    """An incremental refresh of table_name's scores (a full one when it has none), unless they are current"""
+    if inspect(engine).has_table(churn_scores_table(table_name).name) and scores_are_current(table_name):
+        return {"rescored": 0, "removed": 0}
+    return refresh_scores(table_name, incremental=inspect(engine).has_table(churn_scores_table(table_name).name))
+
+
+async def refresh_in_background(table_names=None):
+    """refresh_stale_scores for table_names, by default every table that has scores; for after a load or model reload"""
+    for table_name in (table_names if table_names is not None else await run_db(get_scored_tables)):
+        try:
+            await run_db(refresh_stale_scores, table_name)
+        except HTTPException as e:
+            print(f"Score refresh of {table_name} skipped: {e.detail}")
+
+
+def ensure_scores(table_name):
+    """Name of table_name's scores table; a 503 until its first refresh is done"""
+    scores = churn_scores_table(table_name)
+    if not inspect(engine).has_table(scores.name):
+        raise HTTPException(status_code=503, detail=f"The scores of {table_name} are not computed yet; /create_table "
+                                                    f"starts that, or POST /scores/refresh", headers={"Retry-After": "30"})
+    return scores.name
+
+
+def get_churn_scores(table_name, columnar=False):
+    """The precomputed predictions of every customer, by customer (scores_to_predictions) or as columns"""
+    df = get_scores(ensure_scores(table_name))
+    return scores_to_columns(df) if columnar else scores_to_predictions(df)
+
+
+def get_churn_scores_page(table_name, cursor, limit, columnar=False):
+    """The precomputed predictions of the first limit customers after cursor, and the cursor of the next page"""
+    df = get_scores_page(ensure_scores(table_name), cursor, limit)
+    next_cursor = int(df["customer_id"].iat[-1]) if not df.empty and df["customer_id"].nunique() == limit else None
+    return {"items": scores_to_columns(df) if columnar else scores_to_predictions(df), "next_cursor": next_cursor}
+
+
+def iter_churn_scores(table_name, cursor=None, chunksize=10_000):
+    """Yield (customer_id, predictions) for every customer after cursor, read through a server-side cursor"""
+    pending = None
+    for chunk in iter_scores(ensure_scores(table_name), cursor, chunksize):
+        if pending is not None:
+            chunk = pd.concat([pending, chunk], ignore_index=True)
+        # The last customer may continue in the next chunk
+        last = chunk["customer_id"].iat[-1]
+        complete = chunk["customer_id"] != last
+        pending = chunk[~complete]
+        yield from scores_to_predictions(chunk[complete]).items()
+    if pending is not None:
+        yield from scores_to_predictions(pending).items()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--table", default="ecommerce")
+    parser.add_argument("--incremental", action="store_true", help="only rescore customers whose rows changed")
+    parser.add_argument("--chunk-size", type=int, default=scoring_chunk_size)
+    parser.add_argument("--batch-size", type=int, default=inference_batch_size)
+    args = parser.parse_args()
+    try:
+        result = refresh_scores(args.table, args.incremental, args.chunk_size, args.batch_size)
+    except HTTPException as e:
+        raise SystemExit(e.detail)
+    print(f"Scores for '{args.table}' refreshed: {result['rescored']} customers rescored, {result['removed']} removed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Pre-fork server. It imports the app and loads the model once, then forks the uvicorn workers.
+The workers share the parent's memory copy-on-write, so none of them imports torch or loads the
+model itself. uvicorn --workers spawns fresh interpreters instead, and each one pays for its own
+copy.
+
+The model's weights stay memory-mapped from the bundle (see bundle.py), so workers keep sharing
+them through the page cache after a hot reload too. The parent runs no inference before forking;
+torch's thread pools are started in the workers.
+
+SIGHUP to the parent, or POST /model/reload to any worker, reloads the model in every worker
+(see reloading.py). SIGTERM or SIGINT stops the workers, and a worker that dies is replaced. The
+parent keeps the model it forked with, so after a reload a replacement worker reloads the model
+itself before serving.
+Run from the repository root:
+    python -m churn_service.serve --workers 4 --port 8000
+"""
+import argparse
+import os
+import signal
+import sys
+
+import uvicorn
+
+# uvicorn's exit status when the app's startup fails
+startup_failure = 3
+
+
+def run_worker(config, sock, reload=False):
+    for signum in (signal.SIGHUP, signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, signal.SIG_DFL)
+    server = uvicorn.Server(config)
+    try:
+        if reload:
+            from fastapi import HTTPException
+            from . import churn_service, reloading
+            if churn_service.serving.model is not None:
+                try:
+                    reloading.reload_model()
+                except HTTPException as e:
+                    print(f"Model reload skipped: {e.detail}")
+        server.run(sockets=[sock])
+    finally:
+        os._exit(0 if server.started else startup_failure)
+
+
+def serve(host, port, workers, log_level="info"):
+    os.environ["CHURN_SERVE_PARENT"] = str(os.getpid())
+    from . import churn_service
+    from .main import app
+    from .runtime import model_backend
+    # onnxruntime sessions start their thread pools when created, which does not survive a fork
+    if not model_backend.startswith("onnx"):
+        churn_service.load_model()
+    config = uvicorn.Config(app, host=host, port=port, log_level=log_level)
+    sock = config.bind_socket()
+    children = set()
+    stopping = False
+    reloaded = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            run_worker(config, sock, reloaded)
+        children.add(pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    def reload(signum, frame):
+        nonlocal reloaded
+        reloaded = True
+        for pid in children:
+            os.kill(pid, signal.SIGHUP)
+
+    for _ in range(workers):
+        spawn()
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGHUP, reload)
+    print(f"Serving on http://{host}:{port} with {workers} workers, model {churn_service.serving.model_version}")
+    status = 0
+    while children:
+        try:
+            pid, wait_status = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if os.waitstatus_to_exitcode(wait_status) == startup_failure:
+            print(f"Worker {pid} failed to start, stopping")
+            status = startup_failure
+            stop(None, None)
+        elif not stopping:
+            print(f"Worker {pid} exited, starting another")
+            spawn()
+    sock.close()
+    return status
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+    sys.exit(serve(args.host, args.port, args.workers, args.log_level))
+
+
+if __name__ == "__main__":
+    main()
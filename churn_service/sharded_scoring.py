@@ -0,0 +1,154 @@
+"""
+Full-table churn scoring across processes.
+
+The customer IDs are split into contiguous shards scored by a pool of worker processes. Each
+worker loads the model and scaler once, pins its torch thread count and reads its shards from
+the database itself. The scored rows (the layout of <table>_churn_scores) stream back to this
+process, which writes them to the scores table or to a Parquet file as shards finish.
+Run from the repository root:
+    python -m churn_service.sharded_scoring --table ecommerce --workers 8
+    python -m churn_service.sharded_scoring --table ecommerce --workers 8 --parquet scores.parquet
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import pandas as pd
+from fastapi import HTTPException
+from sqlalchemy import delete
+
+from . import churn_service
+from .database import engine
+from .database.bulk_load import write_frame
+from .database.repositories import (claim_scores_refresh, get_customer_markers, get_customers_in_range,
+                                    get_scores_version, release_scores_refresh)
+from .domain import inference_batch_size
+from .models import churn_scores_table
+from .scores import refresh_lease_seconds, score_rows
+
+shard_size = 2000  # customers per shard; several shards per worker keep the pool balanced
+
+
+def init_worker(threads):
+    """Runs once in every worker process before it takes a shard"""
+    import torch
+    torch.set_num_threads(threads)
+    # Connections inherited from the parent must not be shared, only the parent may close them
+    engine.dispose(close=False)
+    churn_service.load_model()
+
+
+def score_shard(table_name, markers, scored_at, batch_size):
+    """Score the customers of one shard; markers holds their last purchase date and purchase count"""
+    start = time.perf_counter()
+    df = get_customers_in_range(int(markers.index[0]), int(markers.index[-1]), table_name)
+    fetched = time.perf_counter()
+    rows = score_rows(df, markers, scored_at, churn_service.serving, batch_size)
+    timings = {"pid": os.getpid(), "customers": len(markers), "windows": len(rows),
+               "fetch_seconds": fetched - start, "score_seconds": time.perf_counter() - fetched}
+    return rows, timings
+
+
+def write_parquet(path):
+    """A function writing each batch of rows to the Parquet file at path, and one closing it"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    writer = None
+
+    def write(rows):
+        nonlocal writer
+        table = pa.Table.from_pandas(rows, preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(path, table.schema)
+        writer.write_table(table.cast(writer.schema))
+
+    def close():
+        if writer is not None:
+            writer.close()
+    return write, close
+
+
+def score_table(table_name, workers=os.cpu_count(), threads=None, parquet_path=None,
+                shard_size=shard_size, batch_size=inference_batch_size):
+    """
+    Score every customer of table_name with a pool of workers. Rows replace the scores table in
+    one transaction, holding the table's score refresh like scores.refresh_scores, or go to
+    parquet_path when it is set. Returns the per-worker timings.
+    """
+    if parquet_path:
+        return run_shards(table_name, workers, threads, shard_size, batch_size, write_parquet(parquet_path))
+    if not claim_scores_refresh(table_name, refresh_lease_seconds):
+        raise HTTPException(status_code=409, detail=f"A score refresh of {table_name} is already running")
+    scored, model_versions = None, set()
+    try:
+        # Read before the rows, so changes made during the refresh leave the scores stale
+        changed = get_scores_version(table_name)[0]
+        scores = churn_scores_table(table_name)
+        scores.create(engine, checkfirst=True)
+        with engine.begin() as connection:
+            connection.execute(delete(scores))
+
+            def write(rows):
+                model_versions.update(rows["model_version"].unique())
+                write_frame(rows, scores.name, connection)
+            timings = run_shards(table_name, workers, threads, shard_size, batch_size, (write, lambda: None))
+        scored = changed
+        return timings
+    finally:
+        # Every worker loads the same bundle, so the rows have one model_version
+        release_scores_refresh(table_name, scored, min(model_versions) if model_versions else None)
+
+
+def run_shards(table_name, workers, threads, shard_size, batch_size, writer):
+    """Score table_name's shards with a pool of workers, passing each shard's rows to writer's write, then close it"""
+    write, close = writer
+    threads = threads or max(1, (os.cpu_count() or 1) // workers)
+    markers = get_customer_markers(table_name).set_index("customer_id")
+    shards = [markers.iloc[start:start + shard_size] for start in range(0, len(markers), shard_size)]
+    scored_at = datetime.now()
+    timings = []
+
+    try:
+        with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(threads,)) as pool:
+            futures = [pool.submit(score_shard, table_name, shard, scored_at, batch_size) for shard in shards]
+            for future in as_completed(futures):
+                rows, shard_timings = future.result()
+                write(rows)
+                timings.append(shard_timings)
+    finally:
+        close()
+    return pd.DataFrame(timings)
+
+
+def report(timings, elapsed):
+    per_worker = timings.groupby("pid").sum(numeric_only=True)
+    busy = per_worker["fetch_seconds"] + per_worker["score_seconds"]
+    print(f"{'worker':>8} {'shards':>7} {'customers':>10} {'windows':>10} {'fetch s':>8} {'score s':>8} {'windows/s':>10}")
+    for pid, worker in per_worker.iterrows():
+        print(f"{pid:>8} {(timings['pid'] == pid).sum():>7} {worker['customers']:>10.0f} {worker['windows']:>10.0f} "
+              f"{worker['fetch_seconds']:>8.2f} {worker['score_seconds']:>8.2f} {worker['windows'] / busy[pid]:>10.0f}")
+    print(f"total: {timings['customers'].sum()} customers, {timings['windows'].sum()} windows in {elapsed:.2f}s "
+          f"({timings['windows'].sum() / elapsed:.0f} windows/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--table", default="ecommerce")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--threads", type=int, default=None, help="torch threads per worker, cores / workers by default")
+    parser.add_argument("--parquet", default=None, help="write the scores to this Parquet file instead of the scores table")
+    parser.add_argument("--shard-size", type=int, default=shard_size)
+    parser.add_argument("--batch-size", type=int, default=inference_batch_size)
+    args = parser.parse_args()
+    start = time.perf_counter()
+    try:
+        timings = score_table(args.table, args.workers, args.threads, args.parquet, args.shard_size, args.batch_size)
+    except HTTPException as e:
+        raise SystemExit(e.detail)
+    report(timings, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
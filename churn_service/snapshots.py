@@ -0,0 +1,200 @@
+"""
+Columnar snapshots of an encoded feature table, for offline scoring and backtests without the database.
+
+export_snapshot writes the window columns of a table loaded by insert_csv_data_to_table, sorted by
+customer then purchase date, as a directory of partitions that each hold whole customers, plus
+manifest.json with every partition's customer range. Arrow IPC partitions are memory-mapped by
+FeatureSnapshot, so their columns are read without copies; Parquet partitions suit other tools
+but are decoded into memory. Run from the repository root:
+    python -m churn_service.snapshots export --table ecommerce --path snapshots/ecommerce
+    python -m churn_service.snapshots score --path snapshots/ecommerce --parquet scores.parquet
+"""
+import argparse
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+from . import churn_service
+from .database.repositories import iter_query_chunks, window_select
+
+snapshot_partition_rows = 1_000_000  # rows per partition, rounded up to a whole customer
+manifest_name = "manifest.json"
+
+
+def write_partition(df, path, file_format, schema=None):
+    batch = pa.RecordBatch.from_pandas(df, schema=schema, preserve_index=False)
+    if file_format == "arrow":
+        # One record batch per file, so a partition's columns are single contiguous buffers
+        with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, batch.schema) as writer:
+            writer.write_batch(batch)
+    else:
+        pq.write_table(pa.Table.from_batches([batch]), path)
+    return batch.schema
+
+
+def export_snapshot(table_name, path, file_format="arrow", partition_rows=snapshot_partition_rows, chunksize=100_000):
+    """
+    Write table_name's window columns to a snapshot directory at path, replacing any snapshot there.
+    Rows stream from a server-side cursor, so memory stays bounded by partition_rows.
+    Returns the manifest.
+    """
+    if pa is None:
+        raise RuntimeError("snapshots need pyarrow: pip install pyarrow")
+    if file_format not in ("arrow", "parquet"):
+        raise ValueError(f"Unknown snapshot format '{file_format}', expected arrow or parquet")
+    partial = f"{path}.partial"
+    shutil.rmtree(partial, ignore_errors=True)
+    os.makedirs(partial)
+    manifest = {"table": table_name, "format": file_format, "seq_length": churn_service.seq_length,
+                "feature_columns": churn_service.feature_columns, "partitions": []}
+    schema = None
+
+    def flush(df):
+        nonlocal schema
+        name = f"part-{len(manifest['partitions']):05d}.{file_format}"
+        schema = write_partition(df, os.path.join(partial, name), file_format, schema)
+        manifest["partitions"].append({"file": name, "rows": len(df), "first_customer": int(df["Customer ID"].iat[0]),
+                                       "last_customer": int(df["Customer ID"].iat[-1])})
+
+    query = f'SELECT {window_select} FROM {table_name} ORDER BY "Customer ID", "Purchase Date"'
+    pending = []
+    pending_rows = 0
+    for chunk in iter_query_chunks(query, chunksize=chunksize):
+        chunk["Purchase Date"] = pd.to_datetime(chunk["Purchase Date"])
+        pending.append(chunk)
+        pending_rows += len(chunk)
+        if pending_rows < partition_rows:
+            continue
+        df = pd.concat(pending, ignore_index=True)
+        # The last customer may continue in the next chunk
+        last = df["Customer ID"].to_numpy() == df["Customer ID"].iat[-1]
+        if not last.all():
+            flush(df[~last])
+            df = df[last].reset_index(drop=True)
+        pending, pending_rows = [df], len(df)
+    if pending_rows:
+        flush(pd.concat(pending, ignore_index=True))
+
+    with open(os.path.join(partial, manifest_name), "w") as f:
+        json.dump(manifest, f, indent=2)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(partial, path)
+    return manifest
+
+
+class FeatureSnapshot:
+    """
+    Read-only view of a snapshot directory written by export_snapshot. Partitions are opened on
+    first use; Arrow ones are memory-mapped, so the arrays returned point into the mapped file.
+    """
+
+    def __init__(self, path):
+        if pa is None:
+            raise RuntimeError("snapshots need pyarrow: pip install pyarrow")
+        self.path = path
+        with open(os.path.join(path, manifest_name)) as f:
+            self.manifest = json.load(f)
+        if self.manifest["feature_columns"] != churn_service.feature_columns:
+            raise ValueError(f"snapshot at {path} has different feature columns than the model")
+        self.partitions = self.manifest["partitions"]
+        self._first_customers = np.array([partition["first_customer"] for partition in self.partitions])
+        self._batches = {}
+
+    def batch(self, index):
+        """The record batch of partition index"""
+        if index not in self._batches:
+            file = os.path.join(self.path, self.partitions[index]["file"])
+            if self.manifest["format"] == "arrow":
+                self._batches[index] = pa.ipc.open_file(pa.memory_map(file)).get_batch(0)
+            else:
+                self._batches[index] = pq.read_table(file).combine_chunks().to_batches()[0]
+        return self._batches[index]
+
+    def partition_arrays(self, index):
+        """The Customer ID column, the (n, num_features) feature values and the Churn column of partition index"""
+        batch = self.batch(index)
+
+        def column(name):
+            # Zero-copy for numeric columns without nulls, nulls become NaN otherwise
+            return batch.column(name).to_numpy(zero_copy_only=False)
+        values = np.column_stack([column(name) for name in churn_service.feature_columns])
+        return column("Customer ID"), values, column("Churn")
+
+    def iter_partitions(self):
+        for index in range(len(self.partitions)):
+            yield self.partition_arrays(index)
+
+    def customer_rows(self, customer_id):
+        """A customer's feature values and Churn column in purchase order, or None if it isn't in the snapshot"""
+        index = np.searchsorted(self._first_customers, customer_id, side="right") - 1
+        if index < 0 or customer_id > self.partitions[index]["last_customer"]:
+            return None
+        batch = self.batch(index)
+        customer_ids = batch.column("Customer ID").to_numpy(zero_copy_only=False)
+        start, stop = np.searchsorted(customer_ids, [customer_id, customer_id + 1])
+        if start == stop:
+            return None
+        rows = batch.slice(start, stop - start)
+        values = np.column_stack([rows.column(name).to_numpy(zero_copy_only=False) for name in churn_service.feature_columns])
+        return values, rows.column("Churn").to_numpy(zero_copy_only=False)
+
+
+def score_snapshot_to_parquet(snapshot, path):
+    """Score every window of a snapshot into a Parquet file, one row group per partition; returns the window count"""
+    from .domain import confidence_bands, score_snapshot
+    writer = None
+    windows = 0
+    serving = churn_service.serving
+    for customer_ids, probabilities, labels, positions, offsets in score_snapshot(snapshot, serving=serving):
+        table = pa.table({
+            "customer_id": np.repeat(customer_ids, np.diff(offsets)).astype(np.int64),
+            "window_index": positions,
+            "churn_probability": probabilities.astype(np.float64),
+            "churn_prediction": probabilities > 0.5,
+            "confidence": confidence_bands(probabilities),
+            "actual": labels,
+            "model_version": np.full(len(probabilities), serving.model_version, dtype=object),
+        })
+        if writer is None:
+            writer = pq.ParquetWriter(path, table.schema)
+        writer.write_table(table)
+        windows += len(probabilities)
+    if writer is not None:
+        writer.close()
+    return windows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="write a table's window columns to a snapshot")
+    export.add_argument("--table", default="ecommerce")
+    export.add_argument("--path", required=True)
+    export.add_argument("--format", choices=["arrow", "parquet"], default="arrow")
+    export.add_argument("--partition-rows", type=int, default=snapshot_partition_rows)
+    score = commands.add_parser("score", help="score every customer of a snapshot into a Parquet file")
+    score.add_argument("--path", required=True)
+    score.add_argument("--parquet", required=True)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        manifest = export_snapshot(args.table, args.path, args.format, args.partition_rows)
+        rows = sum(partition["rows"] for partition in manifest["partitions"])
+        print(f"Snapshot of '{args.table}' written to {args.path}: {rows} rows in {len(manifest['partitions'])} partitions")
+    else:
+        churn_service.load_model()
+        windows = score_snapshot_to_parquet(FeatureSnapshot(args.path), args.parquet)
+        print(f"Scored {windows} windows from {args.path} into {args.parquet}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+import os
+import tempfile
+
+import numpy as np
+import pytest
+import torch
+
+# The database tests run against a throwaway SQLite file, never the configured server; set before
+# churn_service.database creates its engine
+os.environ["CHURN_DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'churn_test.db')}"
+
+
+def random_serving(seed, version):
+    """A Serving of a random-weight model and an identity scaler"""
+    from churn_service import churn_service
+    from churn_service.bundle import Standardizer
+    torch.manual_seed(seed)
+    model = churn_service.ChurnModel(churn_service.input_size, churn_service.d_model, churn_service.num_heads,
+                                     churn_service.d_ff, churn_service.num_layers).eval()
+    size = churn_service.seq_length * churn_service.num_features
+    return churn_service.Serving(model, Standardizer(np.zeros(size), np.ones(size)), version, "eager")
+
+
+@pytest.fixture
+def serving(monkeypatch):
+    """Serve a random model "v1" for the test"""
+    from churn_service import churn_service
+    monkeypatch.setattr(churn_service, "serving", random_serving(0, "v1"))
+    return churn_service.serving
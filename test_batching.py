@@ -0,0 +1,43 @@
+import asyncio
+
+import numpy as np
+
+from churn_service.batching import MicroBatcher
+
+
+def score(windows, positions, lengths=None):
+    return windows.reshape(len(windows), -1).sum(axis=1)
+
+
+def test_a_batch_that_cannot_be_stacked_fails_its_requests_only():
+    async def run():
+        batcher = MicroBatcher(score, max_wait_ms=20)
+        await batcher.start()
+        try:
+            good = np.ones((2, 3, 4), dtype=np.float32)
+            bad = np.ones((1, 5, 4), dtype=np.float32)
+            results = await asyncio.gather(batcher.submit(good, np.arange(2)), batcher.submit(bad, np.arange(1)),
+                                           return_exceptions=True)
+            assert all(isinstance(result, ValueError) for result in results)
+            # The loop is still running and scores the next request
+            np.testing.assert_array_equal(await asyncio.wait_for(batcher.submit(good, np.arange(2)), 5), [12, 12])
+        finally:
+            await batcher.stop()
+    asyncio.run(run())
+
+
+def test_requests_for_different_models_are_not_batched_together():
+    def score_with(windows, positions, lengths=None, model=None):
+        return np.full(len(windows), model, dtype=np.float32)
+
+    async def run():
+        batcher = MicroBatcher(score_with, max_wait_ms=20)
+        await batcher.start()
+        try:
+            windows = np.ones((2, 3, 4), dtype=np.float32)
+            results = await asyncio.gather(*[batcher.submit(windows, np.arange(2), model=model) for model in (1, 1, 2)])
+            assert [result.tolist() for result in results] == [[1, 1], [1, 1], [2, 2]]
+            assert batcher.batches == 2
+        finally:
+            await batcher.stop()
+    asyncio.run(run())
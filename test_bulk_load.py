@@ -0,0 +1,46 @@
+import numbers
+
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, event
+
+from churn_service.database import engine
+from churn_service.database.bulk_load import write_frame
+
+
+@pytest.fixture(params=["sqlite", "postgresql"])
+def bulk_engine(request, tmp_path):
+    if request.param == "sqlite":
+        yield engine
+        return
+    # PostgreSQL takes the COPY path, which rejects "35.0" for an integer column
+    pgserver = pytest.importorskip("pgserver")
+    server = pgserver.get_server(str(tmp_path / "pgdata"), cleanup_mode="stop")
+    postgres = create_engine(server.get_uri())
+    yield postgres
+    postgres.dispose()
+    server.cleanup()
+
+
+def test_later_chunks_may_hold_nulls_in_integer_columns(bulk_engine):
+    first = pd.DataFrame({"id": [1, 2], "age": [35, 40], "price": [1.5, 2.0]})
+    later = pd.DataFrame({"id": [3, 4], "age": [np.nan, 52.0], "price": [np.nan, 3.0]})
+    sent = []
+
+    @event.listens_for(bulk_engine, "before_cursor_execute")
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("INSERT INTO mixed_chunks"):
+            sent.extend(parameters if executemany else [parameters])
+
+    try:
+        with bulk_engine.begin() as connection:
+            write_frame(first, "mixed_chunks", connection, create=True)
+            assert write_frame(later, "mixed_chunks", connection) == 2
+    finally:
+        event.remove(bulk_engine, "before_cursor_execute", record)
+
+    # executemany gets the ages as integers and None, never 35.0
+    assert all(row[1] is None or isinstance(row[1], numbers.Integral) for row in sent)
+    loaded = pd.read_sql("SELECT * FROM mixed_chunks ORDER BY id", bulk_engine)
+    pd.testing.assert_frame_equal(loaded, pd.concat([first, later], ignore_index=True), check_dtype=False)
@@ -0,0 +1,23 @@
+import numpy as np
+
+from churn_service.cache import FeatureCache
+from churn_service.database.repositories import get_table_version, mark_table_changed
+
+
+def test_sync_drops_entries_another_worker_changed():
+    # Two workers' caches over one table; sync_seconds=0 reads the version on every call
+    workers = [FeatureCache(sync_seconds=0), FeatureCache(sync_seconds=0)]
+    for cache in workers:
+        cache.sync("synced", lambda: get_table_version("synced"))
+        cache.put("synced", 1, np.zeros((1, 2, 3), dtype=np.float32), np.zeros(1), cache.generation("synced"))
+
+    # The first worker purges its own cache and counts the change in the database
+    mark_table_changed("synced")
+    workers[0].invalidate("synced")
+    workers[1].sync("synced", lambda: get_table_version("synced"))
+    assert workers[1].get("synced", 1) is None
+
+    # Unchanged tables keep their entries
+    workers[1].put("synced", 1, np.zeros((1, 2, 3), dtype=np.float32), np.zeros(1), workers[1].generation("synced"))
+    workers[1].sync("synced", lambda: get_table_version("synced"))
+    assert workers[1].get("synced", 1) is not None
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+from churn_service import churn_service, domain
+from churn_service.feature_store import FeatureStore, array_names
+
+
+@pytest.fixture(scope="module")
+def purchases():
+    # Customers with fewer, exactly and more purchases than seq_length
+    rng = np.random.default_rng(0)
+    counts = rng.integers(1, 3 * churn_service.seq_length, 40)
+    customer_ids = np.repeat(np.arange(100, 140), counts)
+    values = rng.standard_normal((len(customer_ids), churn_service.num_features)).astype(np.float32)
+    churn = np.repeat(rng.integers(0, 2, 40), counts)
+    dates = np.datetime64("2024-01-01") + np.arange(len(customer_ids)).astype("timedelta64[h]")
+    return customer_ids, values, churn, dates
+
+
+def test_newest_window_matches_build_windows(purchases):
+    customer_ids, values, churn, dates = purchases
+    # Small chunks and capacity split customers across extend calls and grow the arrays
+    store = FeatureStore("purchases", capacity=4)
+    for start in range(0, len(customer_ids), 7):
+        chunk = slice(start, start + 7)
+        store.extend(customer_ids[chunk], values[chunk], churn[chunk], dates[chunk])
+    assert len(store) == 40
+    for customer_id in np.unique(customer_ids).tolist():
+        rows = customer_ids == customer_id
+        X, y, positions, _ = domain.build_windows(values[rows], churn[rows])
+        window, position, length, label = store.newest_window(customer_id)
+        np.testing.assert_array_equal(window[0], X[-1])
+        assert (position, length, label) == (positions[-1], min(rows.sum(), churn_service.seq_length), y[-1])
+    assert store.newest_window(1) is None
+
+
+def test_snapshot_round_trip(purchases, tmp_path):
+    store = FeatureStore("purchases")
+    store.extend(*purchases)
+    path = str(tmp_path / "purchases.npz")
+    assert store.save(path) == 40
+    loaded = FeatureStore.load(path)
+    assert loaded.table_name == "purchases" and loaded.slots == store.slots
+    assert loaded.markers() == store.markers()
+    for name in array_names:
+        np.testing.assert_array_equal(getattr(loaded, name)[:len(loaded)], getattr(store, name)[:len(store)])
+
+
+def test_two_workers_stores_over_one_table(serving, tmp_path, monkeypatch):
+    from datetime import datetime
+    from benchmarks.synthetic import write_csv
+    from churn_service import feature_store
+    from churn_service.churn_service import PurchaseInput
+    from churn_service.database import engine
+    from churn_service.database.repositories import insert_csv_data_to_table
+
+    csv_path = str(tmp_path / "purchases.csv")
+    write_csv(csv_path, 5, seed=3)
+    insert_csv_data_to_table(csv_path, "shared", engine)
+    monkeypatch.setattr(feature_store, "stores", {})
+    workers = [feature_store.open_store("shared"), feature_store.open_store("shared")]
+
+    def purchase(day):
+        return PurchaseInput(purchase_date=datetime(2024, 1, day), product_category="Books", product_price=20.0,
+                             quantity=2, payment_method="Cash", age=40, gender="Female", churn=1).csv_row()
+
+    def as_worker(worker):
+        feature_store.stores["shared"] = workers[worker]
+
+    # Each worker appends a purchase the other has not seen, then reads or appends in turn
+    as_worker(0)
+    feature_store.append_purchase(1, "shared", purchase(1))
+    as_worker(1)
+    feature_store.append_purchase(1, "shared", purchase(2))
+    as_worker(0)
+    newest = feature_store.score_newest_window(1, "shared")
+    as_worker(1)
+    feature_store.append_purchase(1, "shared", purchase(3))
+    as_worker(0)
+    feature_store.append_purchase(1, "shared", purchase(4))
+
+    rebuilt = feature_store.restore("shared")
+    for store in workers:
+        as_worker(workers.index(store))
+        feature_store.score_newest_window(1, "shared")
+        for expected, actual in zip(rebuilt.newest_window(1), store.newest_window(1)):
+            np.testing.assert_array_equal(actual, expected)
+    assert newest["window_index"] == rebuilt.newest_window(1)[1] - 2
+
+    # A reload of the table reopens both workers' stores
+    write_csv(csv_path, 3, seed=4)
+    insert_csv_data_to_table(csv_path, "shared", engine)
+    for store in workers:
+        as_worker(workers.index(store))
+        assert len(feature_store.get_store("shared")) == 3
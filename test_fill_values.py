@@ -0,0 +1,29 @@
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import write_csv
+from churn_service.database import engine
+from churn_service.database.repositories import (ColumnStatistics, compute_fill_values, get_fill_values,
+                                                 insert_csv_data_to_table)
+
+
+def test_all_null_columns_fall_back_to_the_defaults():
+    statistics = ColumnStatistics()
+    statistics.update(pd.DataFrame({"price": [None, None], "name": pd.Series([None, None], dtype=object)}))
+    statistics.update(pd.DataFrame({"price": [2.0, 4.0], "name": pd.Series([None, None], dtype=object)}))
+    assert statistics.fill_values() == {"price": 3.0, "name": "Unknown"}
+
+
+def test_ingest_statistics_match_the_sql_aggregates(tmp_path):
+    csv_path = str(tmp_path / "purchases.csv")
+    write_csv(csv_path, 50, seed=6)
+    df = pd.read_csv(csv_path)
+    # A column null throughout, and one null in the first chunks only
+    df["Customer Name"] = None
+    df.loc[:40, "Payment Method"] = None
+    df.to_csv(csv_path, index=False)
+    insert_csv_data_to_table(csv_path, "filled", engine, chunksize=20)
+    stored = get_fill_values("filled")
+    computed = compute_fill_values("filled")
+    assert stored.keys() == computed.keys() and stored["Customer Name"] == 0
+    assert stored == pytest.approx(computed)
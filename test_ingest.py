@@ -0,0 +1,36 @@
+import pandas as pd
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import inspect
+
+from benchmarks.synthetic import columns, write_csv
+from churn_service.database import engine
+from churn_service.database.repositories import get_table_markers, insert_csv_data_to_table
+
+
+def read_table(table_name):
+    return pd.read_sql(f'SELECT * FROM {table_name} ORDER BY "Customer ID", "Purchase Date"', engine)
+
+
+def test_chunked_load_matches_a_single_chunk(tmp_path):
+    csv_path = str(tmp_path / "purchases.csv")
+    write_csv(csv_path, 30, seed=7)
+    # Chunks split customers and some chunks miss categories the others have
+    assert insert_csv_data_to_table(csv_path, "chunked", engine, chunksize=7)["rows"] == len(pd.read_csv(csv_path))
+    insert_csv_data_to_table(csv_path, "whole", engine, chunksize=None)
+    pd.testing.assert_frame_equal(read_table("chunked"), read_table("whole"))
+    assert not inspect(engine).has_table("chunked__staging")
+    assert "ix_chunked_customer_date" in {index["name"] for index in inspect(engine).get_indexes("chunked")}
+
+
+@pytest.mark.parametrize("chunksize", [7, None])
+def test_a_csv_without_rows_keeps_the_table(tmp_path, chunksize):
+    csv_path = str(tmp_path / "purchases.csv")
+    write_csv(csv_path, 5, seed=8)
+    insert_csv_data_to_table(csv_path, "kept", engine)
+    markers = get_table_markers("kept")
+    pd.DataFrame(columns=columns).to_csv(csv_path, index=False)
+    with pytest.raises(HTTPException) as error:
+        insert_csv_data_to_table(csv_path, "kept", engine, chunksize=chunksize)
+    assert error.value.status_code == 400
+    assert get_table_markers("kept") == markers and not inspect(engine).has_table("kept__staging")
@@ -0,0 +1,68 @@
+import re
+
+from fastapi.testclient import TestClient
+
+from benchmarks.synthetic import write_csv
+from churn_service import metrics
+from churn_service.database import engine
+from churn_service.database.repositories import insert_csv_data_to_table
+from churn_service.main import app
+
+route = "/customers/{table_name}/{customer_id}/sequence"
+
+
+def scrape(client):
+    response = client.get("/metrics")
+    assert response.status_code == 200 and response.headers["content-type"].startswith("text/plain")
+    samples = {}
+    for line in response.text.splitlines():
+        if not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+
+def test_requests_are_counted_by_route_and_profiled_on_request(serving, tmp_path):
+    csv_path = str(tmp_path / "purchases.csv")
+    write_csv(csv_path, 3, seed=12)
+    insert_csv_data_to_table(csv_path, "profiled", engine)
+    client = TestClient(app)
+    requests = f'churn_requests_total{{method="GET",route="{route}",status="200"}}'
+    latency = f'churn_request_seconds_count{{method="GET",route="{route}"}}'
+    before = scrape(client)
+
+    profiled = client.get("/customers/profiled/1/sequence", headers={metrics.profile_header: "1"})
+    assert profiled.status_code == 200
+    stages = dict(entry.split(";dur=") for entry in profiled.headers["Server-Timing"].split(", "))
+    # The first read of a customer fetches its rows, in the thread run_db hands the query to
+    assert {"fetch", "build_windows", "total"} <= stages.keys()
+    assert all(re.fullmatch(r"\d+\.\d{3}", duration) for duration in stages.values())
+    plain = client.get("/customers/profiled/2/sequence")
+    assert plain.status_code == 200 and "Server-Timing" not in plain.headers
+
+    after = scrape(client)
+    # One series per route template, never per URL
+    assert after[requests] - before.get(requests, 0) == 2
+    assert after[latency] - before.get(latency, 0) == 2
+    assert not any("/customers/profiled/" in name for name in after)
+
+
+def test_histogram_buckets_are_cumulative_and_include_their_edge():
+    histogram = metrics.Histogram("churn_test_seconds", "Test histogram", ["stage"], buckets=(0.1, 1))
+    try:
+        for value in (0.05, 0.1, 0.5, 1, 7):
+            histogram.observe(value, stage='a "quoted"\nstage')
+        text = metrics.render()
+    finally:
+        metrics.registry.remove(histogram)
+    labels = 'stage="a \\"quoted\\"\\nstage"'
+    assert "# HELP churn_test_seconds Test histogram\n# TYPE churn_test_seconds histogram\n" in text
+    assert (f'churn_test_seconds_bucket{{{labels},le="0.1"}} 2\n'
+            f'churn_test_seconds_bucket{{{labels},le="1"}} 4\n'
+            f'churn_test_seconds_bucket{{{labels},le="+Inf"}} 5\n'
+            f'churn_test_seconds_sum{{{labels}}} 8.65\n'
+            f'churn_test_seconds_count{{{labels}}} 5\n') in text
+
+
+def test_server_timing_is_in_milliseconds():
+    assert metrics.server_timing({"fetch": 0.0012345, "total": 0.5}) == "fetch;dur=1.234, total;dur=500.000"
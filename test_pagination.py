@@ -0,0 +1,93 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from benchmarks.synthetic import write_csv
+from churn_service.database import engine
+from churn_service.database.repositories import insert_csv_data_to_table, iter_customer_rows
+from churn_service.main import app, max_page_limit
+from churn_service.scores import refresh_scores
+
+client = TestClient(app)
+
+
+@pytest.fixture(scope="module")
+def ecommerce(tmp_path_factory):
+    csv_path = str(tmp_path_factory.mktemp("pages") / "purchases.csv")
+    write_csv(csv_path, 23, seed=10)
+    insert_csv_data_to_table(csv_path, "ecommerce", engine)
+    return "ecommerce"
+
+
+def customer_rows(table_name):
+    """{customer_id: number of rows} of the whole table"""
+    counts = {}
+    for chunk in iter_customer_rows(table_name):
+        for customer_id, rows in chunk["Customer ID"].value_counts().items():
+            counts[customer_id] = counts.get(customer_id, 0) + rows
+    return counts
+
+
+def pages(path, params, limit):
+    """Every page of path from the start until next_cursor is None"""
+    cursor = None
+    while True:
+        response = client.get(path, params={**params, "limit": limit, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200
+        page = response.json()
+        yield page["items"]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return
+
+
+def test_customer_pages_hold_whole_customers(ecommerce):
+    expected = customer_rows(ecommerce)
+    seen = {}
+    for items in pages("/customers", {}, 5):
+        customer_ids = [item["Customer ID"] for item in items]
+        assert len(set(customer_ids)) <= 5
+        for customer_id in set(customer_ids):
+            # A customer split across pages would show up in two of them
+            assert customer_id not in seen
+            seen[customer_id] = customer_ids.count(customer_id)
+    assert seen == expected
+
+
+def test_customer_stream_is_one_json_object_per_line(ecommerce, monkeypatch):
+    # Small chunks, so the stream is made of several of them
+    import churn_service.main as main
+    monkeypatch.setattr(main, "iter_customer_rows", lambda table_name, cursor: iter_customer_rows(table_name, cursor, 7))
+    lines = client.get("/customers", params={"stream": True}).text.split("\n")
+    assert lines[-1] == ""
+    rows = [json.loads(line) for line in lines[:-1]]
+    assert len(rows) == sum(customer_rows(ecommerce).values())
+    cursor = rows[10]["Customer ID"]
+    after = client.get("/customers", params={"stream": True, "cursor": cursor}).text.splitlines()
+    assert [json.loads(line)["Customer ID"] for line in after] == [row["Customer ID"] for row in rows
+                                                                   if row["Customer ID"] > cursor]
+
+
+def test_churn_pages_and_stream_match_the_whole_response(ecommerce, serving):
+    refresh_scores(ecommerce)
+    whole = client.get("/Churns/", params={"table_name": ecommerce}).json()
+    paged = {}
+    for items in pages("/Churns/", {"table_name": ecommerce}, 4):
+        assert len(items) <= 4 and not paged.keys() & items.keys()
+        paged.update(items)
+    assert paged == whole
+    lines = client.get("/Churns/", params={"table_name": ecommerce, "stream": True}).text.split("\n")
+    assert lines[-1] == ""
+    streamed = {}
+    for line in lines[:-1]:
+        customer = json.loads(line)
+        streamed[str(customer.pop("customer_id"))] = customer
+    assert streamed == whole
+
+
+@pytest.mark.parametrize("path", ["/customers", "/Churns/", "/customers/ecommerce/summaries"])
+@pytest.mark.parametrize("limit", [0, -1, max_page_limit + 1])
+def test_out_of_range_limits_are_rejected(path, limit):
+    # LIMIT -1 would read the whole table on SQLite
+    assert client.get(path, params={"table_name": "ecommerce", "limit": limit}).status_code == 422
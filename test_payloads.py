@@ -0,0 +1,84 @@
+import io
+import json
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+from churn_service import churn_service, payloads
+
+shape = (6, churn_service.seq_length, churn_service.num_features)
+
+
+@pytest.fixture(scope="module")
+def windows():
+    return np.random.default_rng(0).standard_normal(shape).astype(np.float32)
+
+
+def test_json_records_and_columns_decode_alike(windows):
+    customer_ids = [7, 7, 7, 3, 3, 9]
+    records = [{"customer_id": customer_id, "sequence_data": window.ravel().tolist()}
+               for customer_id, window in zip(customer_ids, windows)]
+    columns = {"customer_id": customer_ids, "sequence_data": windows.reshape(len(windows), -1).tolist()}
+    for body in (records, columns):
+        batch = payloads.decode(json.dumps(body).encode(), payloads.json_type)
+        assert np.array_equal(batch.windows, windows)
+        assert batch.customer_ids.tolist() == customer_ids
+        # Windows of the same customer are numbered as predict_churn numbers them
+        assert batch.positions.tolist() == [0, 1, 2, 0, 1, 0]
+
+
+def test_binary_body_decodes_to_writable_windows(windows):
+    batch = payloads.decode(windows.astype("<f4").tobytes(), payloads.binary_type)
+    assert np.array_equal(batch.windows, windows)
+    assert batch.windows.flags.writeable
+    assert batch.customer_ids is None and batch.positions.tolist() == [0] * len(windows)
+    probabilities = np.linspace(0, 1, len(windows), dtype=np.float32)
+    assert np.array_equal(np.frombuffer(payloads.encode(batch, probabilities, payloads.binary_type), "<f4"), probabilities)
+
+
+def test_arrow_round_trip(windows):
+    pa = pytest.importorskip("pyarrow")
+    table = pa.table({
+        "sequence_data": pa.FixedSizeListArray.from_arrays(pa.array(windows.ravel()), windows[0].size),
+        "position": pa.array(np.arange(len(windows)) + 10),
+    })
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    batch = payloads.decode(sink.getvalue(), payloads.media_type("application/vnd.apache.arrow.stream"))
+    assert np.array_equal(batch.windows, windows)
+    assert batch.positions.tolist() == list(range(10, 16))
+
+    probabilities = np.array([0.1, 0.3, 0.5, 0.55, 0.7, 0.9], dtype=np.float32)
+    result = pa.ipc.open_stream(payloads.encode(batch, probabilities, payloads.arrow_types[0])).read_all()
+    assert np.array_equal(result.column("churn_probability").to_numpy(), probabilities)
+    assert result.column("churn_prediction").to_pylist() == [False, False, False, True, True, True]
+    assert result.column("confidence").to_pylist() == ["High", "Medium", "Low", "Low", "Medium", "High"]
+
+
+@pytest.mark.parametrize("body", [
+    {"sequence_data": [[0.0] * 139]},
+    {"sequence_data": [[0.0] * 140], "customer_id": [1, 2]},
+    {"sequence_data": [[0.0] * 140], "position": [0.5]},
+    [{"customer_id": 1}],
+])
+def test_malformed_json_is_rejected(body):
+    with pytest.raises(HTTPException) as error:
+        payloads.decode(json.dumps(body).encode(), payloads.json_type)
+    assert error.value.status_code == 400
+
+
+def test_unknown_content_type_is_rejected():
+    with pytest.raises(HTTPException) as error:
+        payloads.media_type("text/csv")
+    assert error.value.status_code == 415
+
+
+def test_json_results_are_columns_with_confidence_codes(windows):
+    batch = payloads.decode(windows.astype("<f4").tobytes(), payloads.binary_type)
+    probabilities = np.array([0.1, 0.3, 0.5, 0.55, 0.7, 0.9], dtype=np.float32)
+    result = json.loads(payloads.encode(batch, probabilities, payloads.json_type))
+    assert result["churn_probability"] == [0.1, 0.3, 0.5, 0.55, 0.7, 0.9]
+    assert result["churn_prediction"] == [False, False, False, True, True, True]
+    assert [result["confidence_levels"][code] for code in result["confidence"]] == ["High", "Medium", "Low", "Low", "Medium", "High"]
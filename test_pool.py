@@ -0,0 +1,32 @@
+import pytest
+from sqlalchemy import create_engine, exc, text
+
+from churn_service.database import TimedQueuePool, engine, pool_stats, pool_waits
+
+
+def test_checkouts_are_timed_and_reported():
+    before = pool_stats()
+    assert before["pool"] == "TimedQueuePool"
+    total_seconds = pool_waits.total_seconds
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+        during = pool_stats()
+        assert during["checked_out"] == before["checked_out"] + 1
+        assert during["waits"]["checkouts"] == before["waits"]["checkouts"] + 1
+        # The override of QueuePool._do_get ran, so the checkout was timed
+        assert pool_waits.total_seconds > total_seconds and during["waits"]["max_wait_ms"] > 0
+    assert pool_stats()["checked_out"] == before["checked_out"]
+
+
+def test_checkouts_that_time_out_are_counted(tmp_path):
+    small = create_engine(f"sqlite:///{tmp_path / 'pool.db'}", poolclass=TimedQueuePool, pool_size=1,
+                          max_overflow=0, pool_timeout=0.05)
+    timeouts, max_seconds = pool_waits.timeouts, pool_waits.max_seconds
+    try:
+        with small.connect():
+            with pytest.raises(exc.TimeoutError):
+                small.connect()
+    finally:
+        small.dispose()
+    assert pool_waits.timeouts == timeouts + 1
+    assert pool_waits.max_seconds >= max(max_seconds, 0.05)
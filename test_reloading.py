@@ -0,0 +1,70 @@
+import os
+
+import numpy as np
+import pytest
+import torch
+from fastapi import HTTPException
+
+from churn_service import churn_service, reloading
+from churn_service.bundle import Standardizer
+
+scaler = Standardizer(np.zeros(churn_service.seq_length * churn_service.num_features),
+                      np.ones(churn_service.seq_length * churn_service.num_features))
+
+
+def random_model(seed):
+    torch.manual_seed(seed)
+    return churn_service.ChurnModel(churn_service.input_size, churn_service.d_model, churn_service.num_heads,
+                                    churn_service.d_ff, churn_service.num_layers).eval()
+
+
+@pytest.fixture
+def running(monkeypatch):
+    """A running model "v1"; the fixture returns a function setting what read_model loads next"""
+    monkeypatch.setattr(churn_service, "serving", churn_service.Serving(random_model(0), scaler, "v1", "eager"))
+
+    def next_model(model, version, new_scaler=scaler):
+        loaded = churn_service.Serving(model, new_scaler, version, "eager")
+        monkeypatch.setattr(churn_service, "read_model", lambda backend=None: loaded)
+    return next_model
+
+
+def test_reload_swaps_in_the_checked_model(running):
+    model = random_model(1)
+    running(model, "v2")
+    result = reloading.reload_model()
+    assert result["reloaded"] and result["previous_version"] == "v1" and not result["scaler_changed"]
+    assert churn_service.serving.model is model and churn_service.serving.model_version == "v2"
+    assert reloading.reload_model()["reloaded"] is False
+
+
+def test_reload_refuses_a_broken_model(running):
+    previous = churn_service.serving
+    broken = random_model(1)
+    with torch.no_grad():
+        broken.output_layer.weight.fill_(float("nan"))
+    running(broken, "v2")
+    with pytest.raises(HTTPException) as error:
+        reloading.reload_model()
+    assert error.value.status_code == 422
+    assert churn_service.serving is previous
+
+
+def test_reload_refuses_a_model_that_moves_too_far(running):
+    running(random_model(1), "v2")
+    with pytest.raises(HTTPException):
+        reloading.reload_model(max_change=0.0)
+    assert churn_service.serving.model_version == "v1"
+
+
+def test_reload_refuses_a_bundle_older_than_its_checkpoint(running, monkeypatch, tmp_path):
+    bundle, checkpoint = tmp_path / "model_bundle.pt", tmp_path / "best_model.pth"
+    bundle.write_bytes(b"")
+    checkpoint.write_bytes(b"")
+    os.utime(bundle, (0, 0))
+    monkeypatch.setattr(churn_service, "model_bundle_path", str(bundle))
+    monkeypatch.setattr(churn_service, "checkpoint_path", str(checkpoint))
+    with pytest.raises(HTTPException) as error:
+        reloading.reload_model()
+    assert error.value.status_code == 422 and "rebuild" in error.value.detail
+    assert churn_service.serving.model_version == "v1"
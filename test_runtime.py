@@ -0,0 +1,81 @@
+import math
+
+import pytest
+import torch
+
+from churn_service import churn_service
+from churn_service.runtime import backends, build_runtime, onnxruntime
+
+# Largest difference from the eager float32 probabilities each backend may show
+tolerances = {"eager": 0.0, "torchscript": 1e-5, "onnx": 1e-5,
+              "eager-int8": 0.05, "torchscript-int8": 0.05, "onnx-int8": 0.05}
+
+
+@pytest.fixture(scope="module")
+def eager_model():
+    torch.manual_seed(0)
+    model = churn_service.ChurnModel(churn_service.input_size, churn_service.d_model, churn_service.num_heads,
+                                     churn_service.d_ff, churn_service.num_layers)
+    return model.eval()
+
+
+@pytest.fixture(scope="module")
+def inputs():
+    generator = torch.Generator().manual_seed(1)
+    windows = torch.randn(64, churn_service.seq_length, churn_service.num_features, generator=generator)
+    # Window indexes of several customers, including long histories
+    positions = torch.cat([torch.arange(30), torch.arange(4), torch.arange(500, 530)])
+    return windows, positions
+
+
+def test_positional_encoding_matches_training_buffer():
+    d_model, max_len = churn_service.d_model, 1000
+    pe = torch.zeros(max_len, d_model)
+    position = torch.arange(0, max_len, dtype=torch.float).unsqueeze(1)
+    div_term = torch.exp(torch.arange(0, d_model, 2).float() * (-math.log(10000.0) / d_model))
+    pe[:, 0::2] = torch.sin(position * div_term)
+    pe[:, 1::2] = torch.cos(position * div_term)
+
+    encoding = churn_service.PositionalEncoding(d_model).encoding(torch.arange(max_len))
+    assert torch.equal(encoding, pe)
+
+
+@pytest.mark.parametrize("backend", backends)
+def test_backend_matches_eager(backend, eager_model, inputs, tmp_path):
+    if backend.startswith("onnx") and onnxruntime is None:
+        pytest.skip("onnxruntime is not installed")
+    windows, positions = inputs
+    with torch.no_grad():
+        expected = eager_model(windows, positions)
+        runtime = build_runtime(eager_model, backend, version="test", directory=str(tmp_path))
+        # Loaded a second time from the artifact written by the first call
+        runtime = build_runtime(eager_model, backend, version="test", directory=str(tmp_path))
+        actual = runtime(windows, positions)
+    assert actual.shape == expected.shape
+    assert (actual - expected).abs().max().item() <= tolerances[backend]
+
+
+def test_padding_mask_matches_unpadded_windows(eager_model, inputs):
+    windows, positions = inputs
+    lengths = torch.randint(1, churn_service.seq_length + 1, (len(windows),), generator=torch.Generator().manual_seed(2))
+    padded = windows * (torch.arange(churn_service.seq_length) < lengths.unsqueeze(1)).unsqueeze(2)
+    with torch.no_grad():
+        masked = eager_model(padded, positions, lengths)
+        unpadded = torch.cat([eager_model(padded[i:i + 1, :lengths[i]], positions[i:i + 1]) for i in range(len(windows))])
+        full = eager_model(padded, positions)
+    assert (masked - unpadded).abs().max().item() <= 1e-6
+    # Full-length windows score exactly as without lengths
+    assert torch.equal(masked[lengths == churn_service.seq_length], full[lengths == churn_service.seq_length])
+
+
+def test_length_buckets_score_like_the_padding_mask(eager_model, inputs, monkeypatch):
+    from churn_service import domain
+    windows, positions = inputs
+    lengths = domain.window_lengths([1, 3, 10, 25, 9, 40])[:len(windows)]
+    windows = windows[:len(lengths)]
+    monkeypatch.setattr(churn_service, "length_aware", True)
+    bucketed = domain.score_windows(windows.numpy(), positions[:len(lengths)].numpy(), batch_size=8, lengths=lengths,
+                                    model=eager_model)
+    with torch.no_grad():
+        masked = eager_model(windows, positions[:len(lengths)], torch.as_tensor(lengths)).reshape(-1).numpy()
+    assert abs(bucketed - masked).max() <= 1e-6
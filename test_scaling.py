@@ -0,0 +1,62 @@
+import os
+
+import numpy as np
+import pytest
+import torch
+
+from churn_service import churn_service, domain
+from churn_service.bundle import Standardizer
+
+joblib = pytest.importorskip("joblib")
+pytest.importorskip("sklearn")
+
+
+@pytest.fixture(scope="module")
+def sklearn_scaler():
+    return joblib.load(os.path.join(os.path.dirname(churn_service.__file__), "scaler.pkl"))
+
+
+@pytest.fixture(scope="module")
+def windows(sklearn_scaler):
+    # Feature values around the training distribution, including zero-padded rows of short windows
+    rng = np.random.default_rng(0)
+    shape = (500, churn_service.seq_length, churn_service.num_features)
+    mean = sklearn_scaler.mean_.reshape(shape[1:])
+    scale = sklearn_scaler.scale_.reshape(shape[1:])
+    X = np.round(mean + scale * rng.standard_normal(shape), 2)
+    X[:50, 6:] = 0
+    return X
+
+
+def sklearn_path(scaler, X):
+    """The scaling the service used to do: sklearn in float64, then cast to float32"""
+    return scaler.transform(X.reshape(len(X), -1)).astype(np.float32).reshape(X.shape)
+
+
+def test_float32_scaling_matches_sklearn(sklearn_scaler, windows):
+    expected = sklearn_path(sklearn_scaler, windows)
+    scaled = domain.scale_windows(windows.astype(np.float32), Standardizer(sklearn_scaler.mean_, sklearn_scaler.scale_))
+    assert scaled.dtype == np.float32 and scaled.flags.c_contiguous
+    np.testing.assert_allclose(scaled, expected, rtol=1e-5, atol=1e-5)
+
+
+def test_model_output_matches_sklearn_path(sklearn_scaler, windows, monkeypatch):
+    monkeypatch.setattr(churn_service, "serving", churn_service.Serving(
+        None, Standardizer(sklearn_scaler.mean_, sklearn_scaler.scale_), None, None))
+    torch.manual_seed(0)
+    model = churn_service.ChurnModel(churn_service.input_size).eval()
+    positions = torch.arange(len(windows))
+    with torch.no_grad():
+        expected = model(torch.from_numpy(sklearn_path(sklearn_scaler, windows)), positions)
+        actual = model(torch.from_numpy(domain.scale_windows(windows.astype(np.float32))), positions)
+    assert (actual - expected).abs().max().item() < 1e-5
+
+
+def test_scaling_in_place_only_for_float32(sklearn_scaler, windows):
+    standardizer = Standardizer(sklearn_scaler.mean_, sklearn_scaler.scale_)
+    original = windows.copy()
+    assert standardizer.transform_windows(windows) is not windows
+    np.testing.assert_array_equal(windows, original)
+
+    windows32 = windows.astype(np.float32)
+    assert standardizer.transform_windows(windows32) is windows32
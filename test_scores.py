@@ -0,0 +1,150 @@
+import numpy as np
+import pandas as pd
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+from benchmarks.bench_startup import make_checkpoint
+from benchmarks.synthetic import make_purchases, write_csv
+from churn_service import churn_service, scores
+from churn_service.bundle import hyperparameter_names, make_bundle, save_bundle
+from churn_service.database import engine
+from churn_service.database.repositories import (claim_scores_refresh, get_score_markers, get_table_encoding,
+                                                 insert_csv_data_to_table, insert_purchases, release_scores_refresh)
+from churn_service.main import app
+from churn_service.scores import refresh_scores, refresh_stale_scores, scores_are_current
+from churn_service.sharded_scoring import score_table
+from conftest import random_serving
+
+
+def churns(table_name):
+    response = TestClient(app).get("/Churns/", params={"table_name": table_name})
+    assert response.status_code == 200
+    return response.json()
+
+
+def create_table(table_name, csv_path):
+    # TestClient runs the response's background tasks, the score refresh, before it returns
+    response = TestClient(app).post("/create_table", params={"table_name": table_name, "csv_file_path": csv_path})
+    assert response.status_code == 200
+
+
+def test_churns_follow_a_table_reload(serving, tmp_path):
+    csv_path = str(tmp_path / "purchases.csv")
+    write_csv(csv_path, 30, seed=0)
+    create_table("reloaded", csv_path)
+    assert len(churns("reloaded")) == 30
+
+    write_csv(csv_path, 20, mean_purchases=4, seed=1)
+    create_table("reloaded", csv_path)
+    reloaded = churns("reloaded")
+    assert len(reloaded) == 20
+    # The same scores as a first refresh of the new rows
+    create_table("fresh", csv_path)
+    assert reloaded == churns("fresh")
+
+
+def test_churns_are_unavailable_until_scored(serving, tmp_path):
+    csv_path = str(tmp_path / "purchases.csv")
+    write_csv(csv_path, 5, seed=3)
+    insert_csv_data_to_table(csv_path, "unscored", engine)
+    response = TestClient(app).get("/Churns/", params={"table_name": "unscored"})
+    assert response.status_code == 503 and "Retry-After" in response.headers
+    assert refresh_stale_scores("unscored") == {"rescored": 5, "removed": 0}
+    assert len(churns("unscored")) == 5
+
+
+def test_churns_are_rescored_after_a_model_reload(serving, tmp_path, monkeypatch):
+    csv_path = str(tmp_path / "purchases.csv")
+    write_csv(csv_path, 10, seed=2)
+    create_table("rescored", csv_path)
+    before = churns("rescored")
+    assert scores_are_current("rescored")
+    assert refresh_stale_scores("rescored") == {"rescored": 0, "removed": 0}
+
+    monkeypatch.setattr(churn_service, "serving", random_serving(1, "v2"))
+    # Reads serve the old scores, the refresh after the reload rescores them
+    assert not scores_are_current("rescored") and churns("rescored") == before
+    assert refresh_stale_scores("rescored") == {"rescored": 10, "removed": 0}
+    after = churns("rescored")
+    assert after.keys() == before.keys() and after != before
+    assert set(get_score_markers("rescored_churn_scores")["model_version"]) == {"v2"}
+
+
+def test_appended_purchases_make_the_scores_stale(serving, tmp_path):
+    csv_path = str(tmp_path / "purchases.csv")
+    write_csv(csv_path, 6, seed=4)
+    create_table("appended", csv_path)
+    purchase = make_purchases(2, 1, 1, np.random.default_rng(0)).assign(**{"Purchase Date": "2024-06-01 12:00:00"})
+    insert_purchases(purchase, "appended", get_table_encoding("appended"))
+    assert not scores_are_current("appended")
+    assert refresh_stale_scores("appended") == {"rescored": 1, "removed": 0}
+    assert scores_are_current("appended")
+
+
+def test_one_refresh_of_a_table_at_a_time(serving, tmp_path, monkeypatch):
+    csv_path = str(tmp_path / "purchases.csv")
+    write_csv(csv_path, 12, seed=5)
+    insert_csv_data_to_table(csv_path, "leased", engine)
+    assert claim_scores_refresh("leased", 60)
+    assert not claim_scores_refresh("leased", 60)
+    with pytest.raises(HTTPException) as raised:
+        refresh_scores("leased")
+    assert raised.value.status_code == 409
+    assert TestClient(app).post("/scores/refresh", params={"table_name": "leased"}).status_code == 409
+
+    # A worker that died holding the refresh does not block it once its lease runs out
+    monkeypatch.setattr(scores, "refresh_lease_seconds", 0)
+    assert refresh_scores("leased") == {"rescored": 12, "removed": 0}
+    assert claim_scores_refresh("leased", 60)
+    release_scores_refresh("leased")
+    assert scores_are_current("leased")
+
+
+def read_scores(table_name):
+    return pd.read_sql(f"SELECT customer_id, window_index, churn_probability, actual, model_version, purchases "
+                       f"FROM {table_name}_churn_scores ORDER BY customer_id, window_index", engine)
+
+
+def test_incremental_refresh_rescores_what_changed(serving, tmp_path, monkeypatch):
+    csv_path = str(tmp_path / "purchases.csv")
+    write_csv(csv_path, 12, seed=9)
+    insert_csv_data_to_table(csv_path, "incremental", engine)
+    assert refresh_scores("incremental") == {"rescored": 12, "removed": 0}
+    assert refresh_scores("incremental", incremental=True) == {"rescored": 0, "removed": 0}
+
+    # A new purchase of customer 3, and customer 5's rows deleted
+    purchase = make_purchases(3, 1, 1, np.random.default_rng(0)).assign(**{"Purchase Date": "2024-06-01 12:00:00"})
+    insert_purchases(purchase, "incremental", get_table_encoding("incremental"))
+    with engine.begin() as connection:
+        connection.execute(text('DELETE FROM incremental WHERE "Customer ID" = 5'))
+    assert refresh_scores("incremental", incremental=True, chunk_size=4) == {"rescored": 1, "removed": 1}
+    incremental = read_scores("incremental")
+    refresh_scores("incremental")
+    pd.testing.assert_frame_equal(incremental, read_scores("incremental"))
+
+    # Another model rescores every customer
+    monkeypatch.setattr(churn_service, "serving", random_serving(1, "v2"))
+    assert refresh_scores("incremental", incremental=True, chunk_size=4) == {"rescored": 11, "removed": 0}
+    assert set(read_scores("incremental")["model_version"]) == {"v2"}
+
+
+def test_sharded_scoring_matches_a_refresh(tmp_path, monkeypatch):
+    # The workers load the model themselves, from a bundle of random weights
+    checkpoint, bundle_path = str(tmp_path / "best_model.pth"), str(tmp_path / "model_bundle.pt")
+    make_checkpoint(checkpoint)
+    hyperparameters = {name: getattr(churn_service, name) for name in hyperparameter_names}
+    save_bundle(make_bundle(checkpoint, churn_service.scaler_path, hyperparameters), bundle_path)
+    monkeypatch.setattr(churn_service, "model_bundle_path", bundle_path)
+    monkeypatch.setattr(churn_service, "serving", churn_service.read_model())
+
+    csv_path = str(tmp_path / "purchases.csv")
+    write_csv(csv_path, 25, seed=6)
+    insert_csv_data_to_table(csv_path, "sharded", engine)
+    timings = score_table("sharded", workers=2, shard_size=4)
+    assert timings["customers"].sum() == 25 and len(timings) == 7
+    assert scores_are_current("sharded")
+    sharded = read_scores("sharded")
+    refresh_scores("sharded")
+    pd.testing.assert_frame_equal(sharded, read_scores("sharded"))
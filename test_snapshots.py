@@ -0,0 +1,40 @@
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import write_csv
+from churn_service.database import engine
+from churn_service.database.repositories import insert_csv_data_to_table
+from churn_service.scores import refresh_scores
+from churn_service.snapshots import FeatureSnapshot, export_snapshot, score_snapshot_to_parquet
+
+pytest.importorskip("pyarrow")
+
+
+@pytest.mark.parametrize("file_format", ["arrow", "parquet"])
+def test_snapshot_round_trip(serving, tmp_path, file_format):
+    csv_path = str(tmp_path / "purchases.csv")
+    write_csv(csv_path, 20, seed=11)
+    insert_csv_data_to_table(csv_path, "snapshotted", engine)
+    # Partitions and read chunks both end inside customers
+    manifest = export_snapshot("snapshotted", str(tmp_path / "snapshot"), file_format, partition_rows=30, chunksize=17)
+    assert len(manifest["partitions"]) > 1
+    assert sum(partition["rows"] for partition in manifest["partitions"]) == len(pd.read_csv(csv_path))
+
+    snapshot = FeatureSnapshot(str(tmp_path / "snapshot"))
+    seen = set()
+    for index, (customer_ids, values, labels) in enumerate(snapshot.iter_partitions()):
+        partition = manifest["partitions"][index]
+        assert customer_ids[0] == partition["first_customer"] and customer_ids[-1] == partition["last_customer"]
+        # No customer straddles two partitions
+        assert seen.isdisjoint(customer_ids)
+        seen.update(customer_ids)
+    assert seen == set(range(1, 21))
+
+    scores_path = str(tmp_path / "scores.parquet")
+    windows = score_snapshot_to_parquet(snapshot, scores_path)
+    refresh_scores("snapshotted")
+    columns = "customer_id, window_index, churn_probability, churn_prediction, confidence, actual, model_version"
+    live = pd.read_sql(f"SELECT {columns} FROM snapshotted_churn_scores ORDER BY customer_id, window_index", engine)
+    offline = pd.read_parquet(scores_path).sort_values(["customer_id", "window_index"], ignore_index=True)
+    assert windows == len(live)
+    pd.testing.assert_frame_equal(offline, live, check_dtype=False)
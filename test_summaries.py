@@ -0,0 +1,48 @@
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+
+from benchmarks.synthetic import write_csv
+from churn_service.database import engine
+from churn_service.database.repositories import insert_csv_data_to_table
+from churn_service.domain import customer_summaries
+from churn_service.main import app
+
+
+@pytest.fixture(scope="module")
+def summarized(tmp_path_factory):
+    csv_path = str(tmp_path_factory.mktemp("summaries") / "purchases.csv")
+    write_csv(csv_path, 15, seed=10)
+    insert_csv_data_to_table(csv_path, "summarized", engine)
+    return pd.read_sql("SELECT * FROM summarized", engine)
+
+
+def expected_summary(purchases, customer_id):
+    """The summary worked out from the customer's rows alone"""
+    rows = purchases[purchases["Customer ID"] == customer_id]
+    last_purchase = pd.to_datetime(rows["Purchase Date"]).max()
+    return {"id": customer_id, "name": rows["Customer Name"].iat[0],
+            "email": rows["Customer Name"].iat[0].lower().replace(" ", "") + "@gmail.com",
+            "totalSpent": (rows["Product Price"] * rows["Quantity"]).sum(),
+            "last_purchase_date": str((pd.Timestamp.now() - last_purchase).days),
+            "last_purchase": last_purchase.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def test_summaries_match_each_customers_rows(summarized):
+    client = TestClient(app)
+    customer_ids = [1, 4, 9, 15]
+    expected = [expected_summary(summarized, customer_id) for customer_id in customer_ids]
+    for summary in expected:
+        data = client.get(f"/customers/summarized/{summary['id']}/data").json()
+        assert {**data, "totalSpent": float(data["totalSpent"])} == summary
+    many = client.get("/customers/summarized/summaries", params={"customer_id": customer_ids}).json()
+    assert [{**summary, "totalSpent": float(summary["totalSpent"])} for summary in many] == expected
+
+
+def test_unknown_and_no_customers(summarized):
+    client = TestClient(app)
+    assert client.get("/customers/summarized/999/data").status_code == 404
+    assert client.get("/customers/summarized/summaries", params={"customer_id": [999]}).json() == []
+    assert customer_summaries("summarized", []) == []
+    # Without customer_id every customer is summarized
+    assert len(client.get("/customers/summarized/summaries").json()) == 15
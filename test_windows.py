@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+import torch
+
+from benchmarks.bench_windows import legacy_windows
+from benchmarks.synthetic import write_csv
+from churn_service import churn_service, domain
+from churn_service.bundle import Standardizer
+from churn_service.database import engine
+from churn_service.database.repositories import get_customer, get_customers_in_range, insert_csv_data_to_table
+from conftest import random_serving
+
+
+@pytest.fixture(scope="module")
+def table(tmp_path_factory):
+    # Customers with fewer, about as many and more purchases than seq_length
+    csv_path = str(tmp_path_factory.mktemp("windows") / "purchases.csv")
+    write_csv(csv_path, 40, mean_purchases=churn_service.seq_length, seed=5)
+    insert_csv_data_to_table(csv_path, "windows", engine)
+    return "windows"
+
+
+@pytest.fixture
+def serving(table, monkeypatch):
+    """A random model with a scaler fitted to the table's windows, so scaling is not the identity"""
+    df = get_customers_in_range(0, 10 ** 9, table)
+    X = domain.build_windows_for_customers(df)[1].reshape(-1, churn_service.seq_length * churn_service.num_features)
+    serving = random_serving(0, "v1")._replace(scaler=Standardizer(X.mean(axis=0), X.std(axis=0) + 1e-3))
+    monkeypatch.setattr(churn_service, "serving", serving)
+    return serving
+
+
+def baseline_predict_churn(customer_id, table_name, serving):
+    """What predict_churn returned before the bulk window builder: the window loop, float64 scaling, 4 decimals"""
+    customer_data = get_customer(customer_id, table_name).sort_values(by="Purchase Date")
+    X, y = legacy_windows(customer_data, churn_service.seq_length)
+    X = serving.scaler.transform(X.reshape(len(X), -1))
+    with torch.no_grad():
+        predictions = serving.model(torch.tensor(X, dtype=torch.float32).reshape(
+            len(X), churn_service.seq_length, churn_service.num_features))
+    return [round(prediction.item(), 4) for prediction in predictions], y.tolist()
+
+
+def test_bulk_windows_match_the_window_loop(table):
+    df = get_customers_in_range(0, 10 ** 9, table)
+    customer_ids, X, y, positions, offsets = domain.build_windows_for_customers(df)
+    for i, customer_id in enumerate(customer_ids.tolist()):
+        legacy_X, legacy_y = legacy_windows(df[df["Customer ID"] == customer_id], churn_service.seq_length)
+        windows = slice(offsets[i], offsets[i + 1])
+        np.testing.assert_array_equal(X[windows], legacy_X.astype(np.float32))
+        np.testing.assert_array_equal(y[windows], legacy_y)
+        np.testing.assert_array_equal(positions[windows], np.arange(len(legacy_X)))
+
+
+def test_predictions_match_the_baseline(table, serving):
+    df = get_customers_in_range(0, 10 ** 9, table)
+    customer_ids, probabilities, labels, _, offsets = domain.score_customers(df)
+    for i, customer_id in enumerate(customer_ids.tolist()):
+        expected, expected_labels = baseline_predict_churn(customer_id, table, serving)
+        predictions, actual = domain.predict_churn(customer_id, table)
+        # float32 scaling moves the probabilities by far less than their 4 decimals
+        np.testing.assert_allclose([p["churn_probability"] for p in predictions], expected, atol=1.5e-4)
+        np.testing.assert_allclose(probabilities[offsets[i]:offsets[i + 1]], expected, atol=1.5e-4)
+        assert [p["churn_prediction"] for p in predictions] == [p > 0.5 for p in expected]
+        assert actual == expected_labels == labels[offsets[i]:offsets[i + 1]].tolist()